@@ -1,17 +1,36 @@
+from collections.abc import Callable
 from logging import Logger
 
 from sisyphus_mirror.cli import handle_cli_options
 from sisyphus_mirror.config import ConfigHandler
 from sisyphus_mirror.consts import DEFAULT_CONF_PATH
+from sisyphus_mirror.filters import filter_test
+from sisyphus_mirror.history import show_stats
+from sisyphus_mirror.image import export_images, import_images
 from sisyphus_mirror.logger import get_logger, setup_logging
+from sisyphus_mirror.logs import analyze_logs
 from sisyphus_mirror.mirror import repo_mirroring
+from sisyphus_mirror.proxy import serve
 from sisyphus_mirror.typedefs import CLIArgsT, ConfigKW
+from sisyphus_mirror.usage import report_usage
+
+COMMAND_MAP: dict[str, Callable[..., None]] = {
+    "mirror": repo_mirroring,
+    "usage": report_usage,
+    "filter-test": filter_test,
+    "stats": show_stats,
+    "serve": serve,
+    "export": export_images,
+    "import": import_images,
+    "analyze-logs": analyze_logs,
+}
 
 
 def main(logger: Logger = get_logger(__name__)) -> None:
     cli_options = handle_cli_options()
 
     config_path = cli_options.pop("config", DEFAULT_CONF_PATH)
+    command = cli_options.pop("command", "mirror")
     config_options = ConfigKW()
 
     config_handler = ConfigHandler(config_path)
@@ -30,7 +49,7 @@ def main(logger: Logger = get_logger(__name__)) -> None:
     )
     logger.info("Started.")
     logger.debug(f"Merged options: {options}")
-    repo_mirroring(**options)
+    COMMAND_MAP[command](**options)
 
 
 if __name__ == "__main__":
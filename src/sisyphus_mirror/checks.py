@@ -9,3 +9,18 @@ def is_rsync_rate_limit(value: Any) -> bool:
         or
         (isinstance(value, str) and bool(re.match(RSYNC_RATE_LIMIT_RE, value)))
     )
+
+SIZE_RE = re.compile(r"^\d+[KMGTkmgt]?$")
+
+def is_size(value: Any) -> bool:
+    return (
+        (isinstance(value, int) and not isinstance(value, bool) and value >= 0)
+        or
+        (isinstance(value, str) and bool(re.match(SIZE_RE, value)))
+    )
+
+IO_MAX_LIMIT = r"(?:rbps|wbps|riops|wiops)=(?:\d+|max)"
+IO_MAX_RE = re.compile(rf"^{IO_MAX_LIMIT}(?:\s+{IO_MAX_LIMIT})*$")
+
+def is_io_max(value: Any) -> bool:
+    return isinstance(value, str) and bool(re.match(IO_MAX_RE, value))
@@ -2,6 +2,8 @@ from argparse import SUPPRESS, ArgumentParser
 from collections.abc import Sequence
 from functools import partial
 from pathlib import Path
+from typing import Any
+from urllib.parse import urlparse
 
 from sisyphus_mirror.checks import is_rsync_rate_limit
 from sisyphus_mirror.consts import (
@@ -11,12 +13,16 @@ from sisyphus_mirror.consts import (
     DEFAULT_CONF_PATH,
     DEFAULT_CONN_TIMEOUT,
     DEFAULT_EXCLUDE_FILES,
+    DEFAULT_HISTORY_DAYS,
     DEFAULT_HOME_PATH,
+    DEFAULT_HOT_LIST_SIZE,
     DEFAULT_INCLUDE_FILES,
     DEFAULT_IO_TIMEOUT,
     DEFAULT_RATE_LIMIT,
     DEFAULT_SNAPSHOTS_LIMIT,
     DEFAULT_SOURCE,
+    DEFAULT_SYNC_TIMEOUT,
+    SOURCE_URL_SCHEMES,
 )
 from sisyphus_mirror.errors import CommandError
 from sisyphus_mirror.typedefs import CLIArgsT
@@ -25,9 +31,9 @@ from sisyphus_mirror.typedefs import CLIArgsT
 def handle_cli_options(
     args: Sequence[str] | None = None,  # for pytest
 ) -> CLIArgsT:
-    parser = ArgumentParser()
+    common_parser = ArgumentParser(add_help=False)
 
-    add_arg = partial(parser.add_argument, default=SUPPRESS)
+    add_arg = partial(common_parser.add_argument, default=SUPPRESS)
     add_flag = partial(add_arg, action="store_true")
 
     add_arg("-c", "--config", type=Path,
@@ -42,8 +48,13 @@ def handle_cli_options(
     add_arg("-b", "--branch-list", choices=BRANCH_LIST, nargs="*",
         help="Explicitly defined repository branches.")
 
-    add_arg("-s", "--source-url",
-        help=f"Repository source URL. Defaults: {DEFAULT_SOURCE}.")
+    add_arg("-s", "--source-url", help=(
+        "Repository source URL: rsync://, http:// or https://. "
+        f"Defaults: {DEFAULT_SOURCE}."))
+
+    add_arg("-P", "--peer-urls", nargs="*", help=(
+        "rsync URLs of LAN peer mirrors tried in order to seed a new snapshot "
+        "before the upstream synchronization."))
 
     add_arg("-w", "--working-dir", type=Path, help=(
         "Working directory for snapshots and temporary synchronization data. "
@@ -76,8 +87,77 @@ def handle_cli_options(
     add_arg("--io-timeout", type=int,
         help=f"I/O timeout in seconds. Defaults: {DEFAULT_IO_TIMEOUT}.")
 
+    add_arg("--sync-timeout", type=int, help=(
+        "Timeout of one rsync attempt in seconds, 0 - unlimited. "
+        f"Defaults: {DEFAULT_SYNC_TIMEOUT}."))
+
+    parser = ArgumentParser(parents=[common_parser])
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND", help=(
+        "Optional command. Without a command the repository is mirrored."))
+    add_command = partial(commands.add_parser, parents=[common_parser])
+
+    add_command("mirror", help="Mirror the repository (default).")
+
+    add_command("usage", help=(
+        "Show exclusive and shared disk usage per snapshot and per branch."))
+
+    filter_test_parser = add_command("filter-test", help=(
+        "Evaluate filter rules against a local tree or a manifest and show "
+        "what would be included and excluded."))
+    filter_test_parser.add_argument("--tree", type=Path, default=SUPPRESS, help=(
+        "Local tree to evaluate. Defaults: the published branch snapshot."))
+    filter_test_parser.add_argument("--manifest", type=Path, default=SUPPRESS, help=(
+        'Manifest file: "rsync --list-only -r" output or "<size> <path>" lines.'))
+    filter_test_parser.add_argument(
+        "--show", choices=("included", "excluded"), default=SUPPRESS,
+        help="List included or excluded paths.")
+
+    add_command("serve", help=(
+        "Serve the mirror over HTTP, fetching missing files from upstream into "
+        "a size-limited cache."))
+
+    stats_parser = add_command("stats", help=(
+        "Show run history percentiles and trends and suggest a schedule window."))
+    stats_parser.add_argument("--days", type=int, default=SUPPRESS, help=(
+        f"History period in days. Defaults: {DEFAULT_HISTORY_DAYS}."))
+
+    export_parser = add_command("export", help=(
+        "Export snapshots as single-file images for offline sites: a full image, "
+        "or a delta image of the files changed since a base snapshot."))
+    export_parser.add_argument("-o", "--output", type=Path, required=True, help=(
+        "Directory for the image and its index."))
+    export_parser.add_argument("--snapshot", default=SUPPRESS, help=(
+        "Snapshot name to export. Defaults: the latest snapshot of each branch."))
+    export_parser.add_argument("--base", default=SUPPRESS, help=(
+        "Base snapshot name for a delta image."))
+
+    import_parser = add_command("import", help=(
+        "Rebuild snapshots from exported images and publish the latest ones."))
+    import_parser.add_argument("images", type=Path, nargs="+", help=(
+        "Image files, applied in snapshot order: a full image, then deltas."))
+
+    analyze_parser = add_command("analyze-logs", help=(
+        "Aggregate rsyncd and nginx access logs, recommend arch_list and "
+        "exclude_files and write the most requested paths to a hot list."))
+    analyze_parser.add_argument("logs", type=Path, nargs="+", help=(
+        "Access log files, rotated and gzipped ones included."))
+    analyze_parser.add_argument("--hot-list", type=Path, default=SUPPRESS, help=(
+        "Write the most requested package paths to this file, synchronized "
+        "first by later runs."))
+    analyze_parser.add_argument("--top", type=int, default=SUPPRESS, help=(
+        f"Hot list size. Defaults: {DEFAULT_HOT_LIST_SIZE}."))
+    analyze_parser.add_argument("--min-requests", type=int, default=SUPPRESS, help=(
+        "Recommend removing arches and directories with at most this many "
+        "requests. Defaults: 0."))
+
     cli_options = vars(parser.parse_args(args))
+    if cli_options.get("command") is None:
+        cli_options.pop("command", None)
+    check_cli_options(cli_options)
+    return cli_options  # type: ignore[return-value]
 
+
+def check_cli_options(cli_options: dict[str, Any]) -> None:
     linkdest_list: list[Path] = cli_options.get("linkdest_list", [])
     for linkdest in linkdest_list:
         if not linkdest.exists():
@@ -87,6 +167,23 @@ def handle_cli_options(
             )
             raise CommandError(msg)
 
+    source_url = cli_options.get("source_url")
+    if source_url is not None and urlparse(source_url).scheme not in SOURCE_URL_SCHEMES:
+        msg = (
+            "CLI option -s / --source-url: URL must have rsync://, http:// or "
+            f"https:// scheme. Got: {source_url}."
+        )
+        raise CommandError(msg)
+
+    peer_urls: list[str] = cli_options.get("peer_urls", [])
+    for peer_url in peer_urls:
+        if urlparse(peer_url).scheme != "rsync":
+            msg = (
+                "CLI option -P / --peer-urls: URL must have rsync:// scheme. "
+                f"Got: {peer_url}."
+            )
+            raise CommandError(msg)
+
     snapshot_limit = cli_options.get("snapshot_limit")
     if isinstance(snapshot_limit, int) and snapshot_limit < 1:
         msg = (
@@ -104,20 +201,18 @@ def handle_cli_options(
         )
         raise CommandError(msg)
 
-    conn_timeout = cli_options.get("conn_timeout")
-    if isinstance(conn_timeout, int) and conn_timeout < 0:
-        msg = (
-            "CLI option --conn-timeout must be >= 0. "
-            f"Got: {conn_timeout}."
-        )
-        raise CommandError(msg)
-
-    io_timeout = cli_options.get("io_timeout")
-    if isinstance(io_timeout, int) and io_timeout < 0:
-        msg = (
-            "CLI option --io-timeout must be >= 0. "
-            f"Got: {io_timeout}."
-        )
-        raise CommandError(msg)
-
-    return cli_options  # type: ignore[return-value]
+    for option_name, min_value in (
+        ("conn_timeout", 0),
+        ("io_timeout", 0),
+        ("sync_timeout", 0),
+        ("days", 1),
+        ("top", 1),
+        ("min_requests", 0),
+    ):
+        value = cli_options.get(option_name)
+        if isinstance(value, int) and value < min_value:
+            msg = (
+                f"CLI option --{option_name.replace('_', '-')} "
+                f"must be >= {min_value}. Got: {value}."
+            )
+            raise CommandError(msg)
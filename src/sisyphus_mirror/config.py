@@ -1,3 +1,4 @@
+import re
 from collections.abc import Callable, Sequence
 from dataclasses import dataclass
 from functools import partial
@@ -6,12 +7,17 @@ from tomllib import load as toml_load
 from typing import Any, cast
 from urllib.parse import urlparse
 
-from sisyphus_mirror.checks import is_rsync_rate_limit
+from sisyphus_mirror.checks import is_io_max, is_rsync_rate_limit, is_size
 from sisyphus_mirror.consts import (
     ARCH_LIST,
     BRANCH_LIST,
     DEFAULT_CONF_PATH,
     DEFAULT_SNAPSHOTS_LIMIT,
+    FANOUT_ROLE_LIST,
+    IO_CLASS_LIST,
+    PHASE_LIST,
+    SOURCE_URL_SCHEMES,
+    SPLIT_PART_LIST,
 )
 from sisyphus_mirror.errors import ConfigError
 from sisyphus_mirror.typedefs import ConfigKW
@@ -22,13 +28,73 @@ class ConfigHandler:
     config_path: Path = DEFAULT_CONF_PATH
 
     def __post_init__(self) -> None:
+        self.retention_validator_map: dict[str, Callable[..., None]] = {
+            "keep_last": partial(
+                self.validate_min_integer, min_value=DEFAULT_SNAPSHOTS_LIMIT),
+            "keep_daily": partial(self.validate_min_integer, min_value=0),
+            "keep_weekly": partial(self.validate_min_integer, min_value=0),
+            "keep_monthly": partial(self.validate_min_integer, min_value=0),
+            "max_age_days": partial(self.validate_min_integer, min_value=0),
+            "min_free_space": self.validate_size,
+            "min_free_inodes": partial(self.validate_min_integer, min_value=0),
+        }
+        self.package_filter_validator_map: dict[str, Callable[..., None]] = {
+            "include_names": self.validate_regex_list,
+            "exclude_names": self.validate_regex_list,
+            "exclude_groups": self.validate_string_list,
+            "max_size": self.validate_size,
+            "closure_of": self.validate_string_list,
+            "closure_of_file": self.validate_exist_path,
+        }
+        self.phase_priority_validator_map: dict[str, Callable[..., None]] = {
+            "nice": partial(self.validate_min_integer, min_value=-20, max_value=19),
+            "io_class": partial(self.validate_literal_string, choices=IO_CLASS_LIST),
+            "io_level": partial(self.validate_min_integer, min_value=0, max_value=7),
+            "cpu_weight": partial(
+                self.validate_min_integer, min_value=1, max_value=10000),
+            "io_max": self.validate_io_max,
+        }
+        self.priority_validator_map: dict[str, Callable[..., None]] = {
+            phase: partial(
+                self.validate_table, validator_map=self.phase_priority_validator_map)
+            for phase in PHASE_LIST
+        }
+        self.fanout_validator_map: dict[str, Callable[..., None]] = {
+            "role": partial(self.validate_literal_string, choices=FANOUT_ROLE_LIST),
+            "batch_dir": self.validate_exist_path,
+            "keep_batches": partial(self.validate_min_integer, min_value=1),
+        }
+        self.proxy_validator_map: dict[str, Callable[..., None]] = {
+            "bind": self.validate_string,
+            "port": partial(self.validate_min_integer, min_value=1, max_value=65535),
+            "upstream_url": self.validate_http_url,
+            "cache_size": self.validate_size,
+            "lazy_arch_list": partial(
+                self.validate_literal_string_list, choices=ARCH_LIST),
+        }
+        self.split_part_validator_map: dict[str, Callable[..., None]] = {
+            "name": partial(self.validate_literal_string, choices=SPLIT_PART_LIST),
+            "min_interval": partial(self.validate_min_integer, min_value=0),
+            "keep_last": partial(self.validate_min_integer, min_value=1),
+        }
+        self.split_arch_validator_map: dict[str, Callable[..., None]] = {
+            "enabled": self.validate_boolean,
+            "min_interval": partial(self.validate_min_integer, min_value=0),
+            "keep_last": partial(self.validate_min_integer, min_value=1),
+            "parts": partial(
+                self.validate_table_list,
+                validator_map=self.split_part_validator_map,
+                required=("name",),
+            ),
+        }
         self.validator_map: dict[str, Callable[..., None]] = {
             "debug": self.validate_boolean,
             "dry_run": self.validate_boolean,
             "verbose": self.validate_boolean,
             "branch_list": partial(
                 self.validate_literal_string_list, choices=BRANCH_LIST),
-            "source_url": self.validate_rsync_url,
+            "source_url": self.validate_source_url,
+            "peer_urls": self.validate_rsync_url_list,
             "working_dir": self.validate_exist_path,
             "arch_list": partial(
                 self.validate_literal_string_list, choices=ARCH_LIST),
@@ -40,6 +106,23 @@ class ConfigHandler:
             "rate_limit": self.validate_rsync_rate_limit,
             "conn_timeout": partial(self.validate_min_integer, min_value=0),
             "io_timeout": partial(self.validate_min_integer, min_value=0),
+            "sync_timeout": partial(self.validate_min_integer, min_value=0),
+            "retention": partial(
+                self.validate_table, validator_map=self.retention_validator_map),
+            "package_filter": partial(
+                self.validate_table, validator_map=self.package_filter_validator_map),
+            "warm_paths": self.validate_string_list,
+            "warm_workers": partial(self.validate_min_integer, min_value=0),
+            "http_workers": partial(self.validate_min_integer, min_value=1),
+            "priority": partial(
+                self.validate_table, validator_map=self.priority_validator_map),
+            "fanout": partial(
+                self.validate_table, validator_map=self.fanout_validator_map),
+            "proxy": partial(
+                self.validate_table, validator_map=self.proxy_validator_map),
+            "split_arch": partial(
+                self.validate_table, validator_map=self.split_arch_validator_map),
+            "hot_list": self.validate_path,
         }
 
     def run(self) -> ConfigKW:
@@ -81,10 +164,39 @@ class ConfigHandler:
         options = {key.replace("-", "_"): value for key,value in options.items()}
         if working_dir := options.get("working_dir"):
             options["working_dir"] = Path(working_dir)
+        if hot_list := options.get("hot_list"):
+            options["hot_list"] = Path(hot_list)
         if linkdest_list := options.get("linkdest_list"):
             options["linkdest_list"] = [Path(linkdest) for linkdest in linkdest_list]
+        for table_name in (
+            "retention", "package_filter", "priority", "fanout", "proxy",
+            "split_arch",
+        ):
+            if isinstance(table := options.get(table_name), dict):
+                options[table_name] = self.normalize_table(table)
+        package_filter = options.get("package_filter")
+        if isinstance(package_filter, dict) and (
+            closure_of_file := package_filter.get("closure_of_file")
+        ):
+            package_filter["closure_of_file"] = Path(closure_of_file)
+        fanout = options.get("fanout")
+        if isinstance(fanout, dict) and (batch_dir := fanout.get("batch_dir")):
+            fanout["batch_dir"] = Path(batch_dir)
         return options
 
+    def normalize_table(self, table: dict[str, Any]) -> dict[str, Any]:
+        return {
+            key.replace("-", "_"): self.normalize_value(value)
+            for key, value in table.items()
+        }
+
+    def normalize_value(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            return self.normalize_table(value)
+        if isinstance(value, list):  # arrays of tables
+            return [self.normalize_value(item) for item in value]
+        return value
+
     def validate_options(self, options: dict[str, Any]) -> ConfigKW:
         for option_name, option_value in options.items():
             if (validator := self.validator_map.get(option_name)):
@@ -103,7 +215,7 @@ class ConfigHandler:
             )
             raise ConfigError(msg)
 
-    def validate_exist_path(self, option_name: str, option_value: Any) -> None:
+    def validate_path(self, option_name: str, option_value: Any) -> None:
         if not isinstance(option_value, Path):
             msg = (
                 f'{self.config_path}: option "{option_name}". '
@@ -111,6 +223,9 @@ class ConfigHandler:
                 f"Got: {option_value}."
             )
             raise ConfigError(msg)
+
+    def validate_exist_path(self, option_name: str, option_value: Any) -> None:
+        self.validate_path(option_name, option_value)
         if not option_value.exists():
             msg = (
                 f'{self.config_path}: option "{option_name}". '
@@ -175,11 +290,27 @@ class ConfigHandler:
                 )
                 raise ConfigError(msg)
 
+    def validate_literal_string(
+        self,
+        option_name: str,
+        option_value: Any,
+        choices: Sequence[Any],
+    ) -> None:
+        if option_value not in choices:
+            allowed_values = '", "'.join(choices)
+            msg = (
+                f'{self.config_path}: option "{option_name}". '
+                f'Value must be one of "{allowed_values}". '
+                f"Got: {option_value}."
+            )
+            raise ConfigError(msg)
+
     def validate_min_integer(
         self,
         option_name: str,
         option_value: Any,
         min_value: int = 1,
+        max_value: int | None = None,
     ) -> None:
         if not isinstance(option_value, int):
             msg = (
@@ -195,6 +326,22 @@ class ConfigHandler:
                 f"Got: {option_value}."
             )
             raise ConfigError(msg)
+        if max_value is not None and option_value > max_value:
+            msg = (
+                f'{self.config_path}: option "{option_name}". '
+                f"Value must be <= {max_value}. "
+                f"Got: {option_value}."
+            )
+            raise ConfigError(msg)
+
+    def validate_string(self, option_name: str, option_value: Any) -> None:
+        if not isinstance(option_value, str):
+            msg = (
+                f'{self.config_path}: option "{option_name}". '
+                "Type must be string. "
+                f"Got: {option_value}."
+            )
+            raise ConfigError(msg)
 
     def validate_string_list(self, option_name: str, option_value: Any) -> None:
         if not isinstance(option_value, list):
@@ -213,6 +360,28 @@ class ConfigHandler:
                 )
                 raise ConfigError(msg)
 
+    def validate_regex_list(self, option_name: str, option_value: Any) -> None:
+        self.validate_string_list(option_name, option_value)
+        for index, item in enumerate(option_value):
+            try:
+                re.compile(item)
+            except re.error as error:
+                msg = (
+                    f'{self.config_path}: option "{option_name}". '
+                    f"Item #{index} must be a regular expression ({error}). "
+                    f"Got: {item}."
+                )
+                raise ConfigError(msg) from error
+
+    def validate_io_max(self, option_name: str, option_value: Any) -> None:
+        if not is_io_max(option_value):
+            msg = (
+                f'{self.config_path}: option "{option_name}". '
+                'Must be cgroup v2 io.max limits ("wbps=52428800 riops=max"). '
+                f"Got: {option_value}."
+            )
+            raise ConfigError(msg)
+
     def validate_rsync_rate_limit(self, option_name: str, option_value: Any) -> None:
         if not is_rsync_rate_limit(option_value):
             msg = (
@@ -222,6 +391,16 @@ class ConfigHandler:
             )
             raise ConfigError(msg)
 
+    def validate_http_url(self, option_name: str, option_value: Any) -> None:
+        self.validate_string(option_name, option_value)
+        if urlparse(option_value).scheme not in ("http", "https"):
+            msg = (
+                f'{self.config_path}: option "{option_name}". '
+                "Value must have http:// or https:// URL scheme. "
+                f"Got: {option_value}."
+            )
+            raise ConfigError(msg)
+
     def validate_rsync_url(self, option_name: str, option_value: Any) -> None:
         if not isinstance(option_value, str):
             msg = (
@@ -238,3 +417,69 @@ class ConfigHandler:
                 f'Example: "rsync://example.com/path".'
             )
             raise ConfigError(msg)
+
+    def validate_source_url(self, option_name: str, option_value: Any) -> None:
+        self.validate_string(option_name, option_value)
+        if urlparse(option_value).scheme not in SOURCE_URL_SCHEMES:
+            msg = (
+                f'{self.config_path}: option "{option_name}". '
+                "Value must have rsync://, http:// or https:// URL scheme. "
+                f"Got: {option_value}."
+            )
+            raise ConfigError(msg)
+
+    def validate_rsync_url_list(self, option_name: str, option_value: Any) -> None:
+        self.validate_string_list(option_name, option_value)
+        for index, item in enumerate(option_value):
+            self.validate_rsync_url(f"{option_name}[{index}]", item)
+
+    def validate_size(self, option_name: str, option_value: Any) -> None:
+        if not is_size(option_value):
+            msg = (
+                f'{self.config_path}: option "{option_name}". '
+                'Must be integer bytes (1073741824) or string ("1G"). '
+                f"Got: {option_value}."
+            )
+            raise ConfigError(msg)
+
+    def validate_table(
+        self,
+        option_name: str,
+        option_value: Any,
+        validator_map: dict[str, Callable[..., None]],
+    ) -> None:
+        if not isinstance(option_value, dict):
+            msg = (
+                f'{self.config_path}: option "{option_name}". '
+                "Type must be TOML table. "
+                f"Got: {option_value}."
+            )
+            raise ConfigError(msg)
+        for key, value in option_value.items():
+            if (validator := validator_map.get(key)):
+                validator(f"{option_name}.{key}", value)
+            else:
+                msg = f"{self.config_path}: unexpected option {option_name}.{key}"
+                raise ConfigError(msg)
+
+    def validate_table_list(
+        self,
+        option_name: str,
+        option_value: Any,
+        validator_map: dict[str, Callable[..., None]],
+        required: Sequence[str] = (),
+    ) -> None:
+        if not isinstance(option_value, list):
+            msg = (
+                f'{self.config_path}: option "{option_name}". '
+                "Type must be array of TOML tables. "
+                f"Got: {option_value}."
+            )
+            raise ConfigError(msg)
+        for index, table in enumerate(option_value):
+            table_name = f"{option_name}[{index}]"
+            self.validate_table(table_name, table, validator_map=validator_map)
+            for key in required:
+                if key not in table:
+                    msg = f"{self.config_path}: missing option {table_name}.{key}"
+                    raise ConfigError(msg)
@@ -1,13 +1,19 @@
 from pathlib import Path
 from typing import get_args
 
-from sisyphus_mirror.typedefs import ArchT, BranchT
+from sisyphus_mirror.typedefs import ArchT, BranchT, FanoutRoleT, IOClassT, PhaseT
 
 APP_NAME = "Sysiphus Mirror"
 ARCH_LIST = get_args(ArchT)
 BRANCH_LIST = get_args(BranchT)
+IO_CLASS_LIST = get_args(IOClassT)
+PHASE_LIST = get_args(PhaseT)
+FANOUT_ROLE_LIST = get_args(FanoutRoleT)
+COMMON_PART = "common"  # everything outside the arch directories
+SPLIT_PART_LIST = (COMMON_PART, *ARCH_LIST)
 DEFAULT_CONF_PATH = Path("/etc/sisyphus-mirror/default.toml")
 DEFAULT_SOURCE = "rsync://ftp.altlinux.org/ALTLinux"
+SOURCE_URL_SCHEMES = ("rsync", "http", "https")
 DEFAULT_HOME_PATH = Path("/srv/mirrors/altlinux")
 DEFAULT_ARCH: list[ArchT] = ["noarch", "x86_64", "x86_64-i586"]
 DEFAULT_INCLUDE_FILES = ["list/**", ".timestamp"]
@@ -16,3 +22,20 @@ DEFAULT_SNAPSHOTS_LIMIT = 1
 DEFAULT_RATE_LIMIT: int | str = "5m"
 DEFAULT_CONN_TIMEOUT: int = 60
 DEFAULT_IO_TIMEOUT: int = 600
+DEFAULT_SYNC_TIMEOUT: int = 0
+DEFAULT_WARM_PATHS = [
+    "branch/*/base/pkglist.*",
+    "branch/*/base/release*",
+    "branch/list/**/*",
+]
+DEFAULT_WARM_WORKERS: int = 4
+DEFAULT_HTTP_WORKERS: int = 8
+DEFAULT_HISTORY_DAYS: int = 90
+DEFAULT_HOT_LIST_SIZE: int = 1000
+DEFAULT_KEEP_BATCHES: int = 3
+DEFAULT_PART_MIN_INTERVAL: int = 0
+DEFAULT_PART_KEEP_LAST: int = 1
+DEFAULT_PROXY_BIND = "127.0.0.1"
+DEFAULT_PROXY_PORT: int = 8080
+DEFAULT_PROXY_UPSTREAM = "https://ftp.altlinux.org/pub/distributions/ALTLinux"
+DEFAULT_PROXY_CACHE_SIZE: int | str = "50G"
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import shutil
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+
+from sisyphus_mirror.snapshots import SNAPSHOT_DATETIME_FORMAT
+
+BATCH_SUFFIXES = (".batch", ".batch.sh", ".rules", ".json")
+
+
+def tree_fingerprint(root: Path | None) -> str:
+    # directory mtimes differ between replicas, files and symlinks do not
+    digest = hashlib.sha256()
+    if root is None:
+        return digest.hexdigest()
+    entries: list[str] = []
+    stack = [""]
+    while stack:
+        relative_dir = stack.pop()
+        with os.scandir(root/relative_dir) as scan:
+            for entry in scan:
+                path = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(path)
+                elif entry.is_symlink():
+                    entries.append(f"{path}\0->{Path(entry.path).readlink()}")
+                else:
+                    stat = entry.stat(follow_symlinks=False)
+                    entries.append(f"{path}\0{stat.st_size}\0{int(stat.st_mtime)}")
+    for line in sorted(entries):
+        digest.update(f"{line}\n".encode())
+    return digest.hexdigest()
+
+
+def filter_digest(options: dict[str, object]) -> str:
+    return hashlib.sha256(
+        json.dumps(options, sort_keys=True, default=str).encode()).hexdigest()
+
+
+@dataclass
+class BatchInfo:
+    name: str
+    branch: str
+    base: str | None
+    base_fingerprint: str
+    filter_digest: str
+
+
+@dataclass
+class BatchStore:
+    batch_dir: Path
+
+    def new_batch(
+        self,
+        branch: str,
+        base: Path | None,
+        digest: str,
+    ) -> BatchInfo:
+        return BatchInfo(
+            name=f"{branch}-{datetime.now().strftime(SNAPSHOT_DATETIME_FORMAT)}",
+            branch=branch,
+            base=base.name if base else None,
+            base_fingerprint=tree_fingerprint(base),
+            filter_digest=digest,
+        )
+
+    def path(self, info: BatchInfo, suffix: str = ".batch") -> Path:
+        return self.batch_dir/f"{info.name}{suffix}"
+
+    def publish(self, info: BatchInfo, filter_path: Path) -> None:
+        shutil.copyfile(filter_path, self.path(info, ".rules"))
+        # the sidecar is written last: replicas ignore batches without it
+        tmp_path = self.batch_dir/f".{info.name}.json.tmp"
+        tmp_path.write_text(json.dumps(asdict(info), indent=2))
+        tmp_path.replace(self.path(info, ".json"))
+
+    def discard(self, info: BatchInfo) -> None:
+        for suffix in BATCH_SUFFIXES:
+            self.path(info, suffix).unlink(missing_ok=True)
+
+    def find_batches(self, branch: str) -> list[BatchInfo]:
+        batches: list[BatchInfo] = []
+        for path in sorted(self.batch_dir.glob(f"{branch}-*.json")):
+            try:
+                batches.append(BatchInfo(**json.loads(path.read_text())))
+            except (OSError, TypeError, ValueError):
+                continue
+        return batches  # oldest first
+
+    def find_applicable(
+        self,
+        branch: str,
+        base: Path | None,
+        digest: str,
+    ) -> BatchInfo | None:
+        candidates = [
+            info for info in self.find_batches(branch)
+            if info.filter_digest == digest
+        ]
+        if not candidates:
+            return None
+        fingerprint = tree_fingerprint(base)
+        for info in reversed(candidates):
+            if info.base_fingerprint == fingerprint:
+                return info
+        return None
+
+    def prune(self, branch: str, keep: int) -> list[BatchInfo]:
+        batches = self.find_batches(branch)
+        expired = batches[:-keep]
+        for info in expired:
+            self.discard(info)
+        return expired
@@ -0,0 +1,254 @@
+import os
+import re
+import sys
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Literal, Unpack
+
+from sisyphus_mirror.consts import (
+    DEFAULT_ARCH,
+    DEFAULT_EXCLUDE_FILES,
+    DEFAULT_HOME_PATH,
+    DEFAULT_INCLUDE_FILES,
+)
+from sisyphus_mirror.packages import Package, PackageSelector, read_branch_packages
+from sisyphus_mirror.snapshots import BRANCH_SUBDIR
+from sisyphus_mirror.typedefs import FilterTestKW
+from sisyphus_mirror.units import format_size
+
+CATCH_ALL_PATTERNS = ("*", "**", "***")
+LIST_ONLY_RE = re.compile(
+    r"^(?P<mode>\S{10})\s+(?P<size>[\d,.]+)\s+\S+\s+\S+\s+(?P<name>.+)$")
+
+type ActionT = Literal["+", "-"]
+
+
+@dataclass(frozen=True)
+class FilterRule:
+    action: ActionT
+    pattern: str
+
+    def __str__(self) -> str:
+        return f"{self.action} {self.pattern}"
+
+
+def compile_rules(rules: Iterable[FilterRule]) -> list[FilterRule]:
+    compiled: list[FilterRule] = []
+    seen_patterns: set[str] = set()
+    for rule in rules:
+        # the first matching rule wins, so a repeated pattern is unreachable
+        if rule.pattern in seen_patterns:
+            continue
+        seen_patterns.add(rule.pattern)
+        compiled.append(rule)
+        if rule.pattern in CATCH_ALL_PATTERNS:
+            break  # nothing after a catch-all can match
+    return compiled
+
+
+def build_filter_rules(
+    exclude_files: Iterable[str] = DEFAULT_EXCLUDE_FILES,
+    include_files: Iterable[str] = DEFAULT_INCLUDE_FILES,
+    arch_list: Iterable[str] = DEFAULT_ARCH,
+    packages: Iterable[Package] | None = None,
+    lazy_arch_list: Iterable[str] = (),
+) -> list[FilterRule]:
+    rules = [
+        *[FilterRule("-", pattern) for pattern in exclude_files],
+        *[FilterRule("+", pattern) for pattern in include_files],
+    ]
+    if packages is not None:
+        rules.extend(
+            FilterRule("+", f"/{BRANCH_SUBDIR}/{package.path}")
+            for package in packages
+        )
+        rules.append(FilterRule("-", "*.rpm"))
+    rules.extend([
+        *[FilterRule("+", f"{pattern}/**") for pattern in arch_list],
+        # packages of lazy arches are fetched on demand by the proxy
+        *[FilterRule("+", f"{pattern}/base/**") for pattern in lazy_arch_list],
+        FilterRule("+", "*/"),
+        FilterRule("-", "*"),
+    ])
+    return compile_rules(rules)
+
+
+def write_filter_file(rules: Iterable[FilterRule], path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text("".join(f"{rule}\n" for rule in rules))
+    tmp_path.replace(path)
+
+
+def glob_to_regex(pattern: str) -> str:
+    regex = ""
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**", index):
+            regex += ".*"
+            index += 2
+            continue
+        if char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[" and (end := pattern.find("]", index + 2)) != -1:
+            regex += pattern[index:end + 1].replace("[!", "[^")
+            index = end
+        elif char == "\\" and index + 1 < len(pattern):
+            index += 1
+            regex += re.escape(pattern[index])
+        else:
+            regex += re.escape(char)
+        index += 1
+    return regex
+
+
+def compile_matcher(pattern: str) -> Callable[[str, bool], bool]:
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    anchored = pattern.startswith("/")
+    pattern = pattern.lstrip("/")
+
+    suffix = ""
+    if pattern.endswith("/***"):
+        pattern = pattern.removesuffix("/***")
+        suffix = "(?:/.*)?"
+
+    # rsync matches patterns with "/" or "**" against the full path,
+    # other patterns against the final path component only
+    full_path = anchored or "/" in pattern or "**" in pattern or bool(suffix)
+    prefix = "" if anchored or not full_path else "(?:.*/)?"
+    regex = re.compile(f"{prefix}{glob_to_regex(pattern)}{suffix}")
+
+    def matcher(path: str, is_dir: bool) -> bool:  # noqa: FBT001
+        if dir_only and not is_dir:
+            return False
+        subject = path if full_path else path.rsplit("/", 1)[-1]
+        return regex.fullmatch(subject) is not None
+
+    return matcher
+
+
+class FilterEvaluator:
+    def __init__(self, rules: Iterable[FilterRule]) -> None:
+        self.matchers = [
+            (rule.action == "+", compile_matcher(rule.pattern)) for rule in rules]
+        self.dir_cache: dict[str, bool] = {}
+
+    def matches(self, path: str, *, is_dir: bool) -> bool:
+        for include, matcher in self.matchers:
+            if matcher(path, is_dir):
+                return include
+        return True
+
+    def is_included(self, path: str, *, is_dir: bool = False) -> bool:
+        # an excluded directory hides everything below it
+        parts = path.split("/")
+        for depth in range(1, len(parts)):
+            parent = "/".join(parts[:depth])
+            if (included := self.dir_cache.get(parent)) is None:
+                included = self.matches(parent, is_dir=True)
+                self.dir_cache[parent] = included
+            if not included:
+                return False
+        return self.matches(path, is_dir=is_dir)
+
+
+@dataclass
+class FilterReport:
+    included_files: int = 0
+    included_bytes: int = 0
+    excluded_files: int = 0
+    excluded_bytes: int = 0
+    paths: list[str] = field(default_factory=list)
+
+    def format(self) -> str:
+        return "".join([
+            *[f"{path}\n" for path in self.paths],
+            (
+                f"Included: {self.included_files} files, "
+                f"{format_size(self.included_bytes)}\n"
+            ),
+            (
+                f"Excluded: {self.excluded_files} files, "
+                f"{format_size(self.excluded_bytes)}\n"
+            ),
+        ])
+
+
+def iter_tree(root: Path) -> Iterator[tuple[str, int, bool]]:
+    stack = [""]
+    while stack:
+        relative_dir = stack.pop()
+        with os.scandir(root/relative_dir) as entries:
+            for entry in entries:
+                path = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_dir:
+                    stack.append(path)
+                    yield path, 0, True
+                else:
+                    yield path, entry.stat(follow_symlinks=False).st_size, False
+
+
+def iter_manifest(manifest: Path) -> Iterator[tuple[str, int, bool]]:
+    # `rsync --list-only -r` output or "<size> <path>" lines
+    with manifest.open() as file:
+        for line in file:
+            if match := LIST_ONLY_RE.match(line.rstrip("\n")):
+                size = int(match["size"].replace(",", "").replace(".", ""))
+                yield match["name"], size, match["mode"].startswith("d")
+            elif len(fields := line.rstrip("\n").split(maxsplit=1)) == 2:  # noqa: PLR2004
+                path = fields[1]
+                yield path.rstrip("/"), int(fields[0]), path.endswith("/")
+
+
+def evaluate_entries(
+    entries: Iterable[tuple[str, int, bool]],
+    evaluator: FilterEvaluator,
+    show: str | None = None,
+) -> FilterReport:
+    report = FilterReport()
+    for path, size, is_dir in entries:
+        if is_dir:
+            continue
+        included = evaluator.is_included(path)
+        if included:
+            report.included_files += 1
+            report.included_bytes += size
+        else:
+            report.excluded_files += 1
+            report.excluded_bytes += size
+        if show == ("included" if included else "excluded"):
+            report.paths.append(path)
+    return report
+
+
+def filter_test(**kwargs: Unpack[FilterTestKW]) -> None:
+    if not (branch_list := kwargs.get("branch_list")):
+        msg = "You must set branches in CLI arguments or config options."
+        raise ValueError(msg)
+    working_dir = kwargs.get("working_dir", DEFAULT_HOME_PATH)
+    arch_list = kwargs.get("arch_list", DEFAULT_ARCH)
+    for branch in branch_list:
+        tree = kwargs.get("tree", working_dir/branch)
+        packages = None
+        if package_filter := kwargs.get("package_filter"):
+            packages = PackageSelector(**package_filter).select(
+                read_branch_packages(tree/BRANCH_SUBDIR, arch_list))
+        rules = build_filter_rules(
+            exclude_files=kwargs.get("exclude_files", DEFAULT_EXCLUDE_FILES),
+            include_files=kwargs.get("include_files", DEFAULT_INCLUDE_FILES),
+            arch_list=arch_list,
+            packages=packages,
+            lazy_arch_list=kwargs.get("proxy", {}).get("lazy_arch_list", []),
+        )
+        if manifest := kwargs.get("manifest"):
+            entries = iter_manifest(manifest)
+        else:
+            entries = iter_tree(tree)
+        report = evaluate_entries(entries, FilterEvaluator(rules), kwargs.get("show"))
+        sys.stdout.write(f"Branch {branch}:\n{report.format()}")
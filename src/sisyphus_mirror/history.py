@@ -0,0 +1,366 @@
+import math
+import re
+import sqlite3
+import statistics
+import sys
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import closing, contextmanager
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime
+from pathlib import Path
+from typing import Unpack
+
+from sisyphus_mirror.consts import DEFAULT_HISTORY_DAYS, DEFAULT_HOME_PATH
+from sisyphus_mirror.typedefs import StatsKW
+from sisyphus_mirror.units import format_duration, format_size
+
+HISTORY_DB_NAME = ".history.sqlite3"
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    branch TEXT NOT NULL,
+    snapshot TEXT NOT NULL DEFAULT '',
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT NOT NULL DEFAULT '',
+    retries INTEGER NOT NULL DEFAULT 0,
+    files INTEGER NOT NULL DEFAULT 0,
+    files_transferred INTEGER NOT NULL DEFAULT 0,
+    total_size INTEGER NOT NULL DEFAULT 0,
+    transferred_size INTEGER NOT NULL DEFAULT 0,
+    bytes_received INTEGER NOT NULL DEFAULT 0,
+    bytes_sent INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS runs_branch_started ON runs (branch, started_at);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (run_id, name)
+);
+CREATE TABLE IF NOT EXISTS peer_sources (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    url TEXT NOT NULL,
+    bytes_received INTEGER NOT NULL,
+    PRIMARY KEY (run_id, url)
+);
+"""
+RSYNC_OUTPUT_TAIL = 64 * 1024
+RSYNC_STATS_RE = {
+    "files": re.compile(r"^Number of files: [\d,.]+ \(reg: ([\d,.]+)", re.MULTILINE),
+    "files_transferred": re.compile(
+        r"^Number of regular files transferred: ([\d,.]+)", re.MULTILINE),
+    "total_size": re.compile(r"^Total file size: ([\d,.]+)", re.MULTILINE),
+    "transferred_size": re.compile(
+        r"^Total transferred file size: ([\d,.]+)", re.MULTILINE),
+    "bytes_received": re.compile(r"^Total bytes received: ([\d,.]+)", re.MULTILINE),
+    "bytes_sent": re.compile(r"^Total bytes sent: ([\d,.]+)", re.MULTILINE),
+}
+TREND_PERIOD = 30 * 24 * 3600
+SCHEDULE_MIN_RUNS = 2
+
+
+@dataclass
+class TransferStats:
+    files: int = 0
+    files_transferred: int = 0
+    total_size: int = 0
+    transferred_size: int = 0
+    bytes_received: int = 0
+    bytes_sent: int = 0
+
+    def add(self, other: "TransferStats") -> None:
+        for stats_field in fields(self):
+            name = stats_field.name
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+def parse_rsync_stats(output: str) -> TransferStats:
+    stats = TransferStats()
+    for name, regex in RSYNC_STATS_RE.items():
+        if match := regex.search(output):
+            # thousands separators depend on the locale
+            setattr(stats, name, int(re.sub(r"[,.]", "", match[1])))
+    return stats
+
+
+class RsyncOutput:
+    def __init__(self) -> None:
+        self.tail = b""
+
+    def feed(self, chunk: bytes) -> None:
+        # still shown to the user, the tail is kept for --stats parsing
+        sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+        self.tail = (self.tail + chunk)[-RSYNC_OUTPUT_TAIL:]
+
+    @property
+    def stats(self) -> TransferStats:
+        return parse_rsync_stats(self.tail.decode(errors="replace"))
+
+
+@dataclass
+class RunRecord:
+    branch: str
+    snapshot: str = ""
+    started_at: float = field(default_factory=time.time)
+    finished_at: float = 0
+    status: str = "running"
+    error: str = ""
+    retries: int = 0
+    stats: TransferStats = field(default_factory=TransferStats)
+    phases: dict[str, float] = field(default_factory=dict)
+    peer_bytes: dict[str, int] = field(default_factory=dict)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.monotonic() - start
+
+    def finish(self, status: str, error: str = "") -> None:
+        self.finished_at = time.time()
+        self.status = status
+        self.error = error
+
+    @property
+    def duration(self) -> float:
+        return self.finished_at - self.started_at
+
+    @property
+    def link_dest_ratio(self) -> float | None:
+        # files not transferred into an empty destination were hard-linked
+        if not self.stats.files:
+            return None
+        return 1 - self.stats.files_transferred / self.stats.files
+
+    @property
+    def throughput(self) -> float | None:
+        if not (seconds := self.phases.get("sync")) or not self.stats.bytes_received:
+            return None
+        return self.stats.bytes_received / seconds
+
+
+@dataclass
+class RunHistory:
+    path: Path
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.executescript(HISTORY_SCHEMA)
+        return connection
+
+    def connect_read_only(self) -> sqlite3.Connection:
+        # readers never create the database or upgrade its schema
+        return sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True)
+
+    def append(self, record: RunRecord) -> int:
+        row = {
+            "branch": record.branch,
+            "snapshot": record.snapshot,
+            "started_at": record.started_at,
+            "finished_at": record.finished_at,
+            "status": record.status,
+            "error": record.error,
+            "retries": record.retries,
+            **asdict(record.stats),
+        }
+        with closing(self.connect()) as connection, connection:
+            cursor = connection.execute(
+                f"INSERT INTO runs ({', '.join(row)}) "  # noqa: S608
+                f"VALUES ({', '.join(f':{name}' for name in row)})",
+                row,
+            )
+            run_id = cursor.lastrowid or 0
+            connection.executemany(
+                "INSERT INTO phases (run_id, name, seconds) VALUES (?, ?, ?)",
+                [(run_id, name, seconds) for name, seconds in record.phases.items()],
+            )
+            connection.executemany(
+                "INSERT INTO peer_sources (run_id, url, bytes_received) "
+                "VALUES (?, ?, ?)",
+                [(run_id, url, size) for url, size in record.peer_bytes.items()],
+            )
+        return run_id
+
+    def load(
+        self,
+        branch_list: Iterable[str] | None = None,
+        since: float = 0,
+    ) -> list[RunRecord]:
+        if not self.path.exists():
+            return []
+        with closing(self.connect_read_only()) as connection:
+            connection.row_factory = sqlite3.Row
+            # tables of an older schema are only created by the next run
+            tables = {row[0] for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if "runs" not in tables:
+                return []
+            rows = connection.execute(
+                "SELECT * FROM runs WHERE started_at >= ? ORDER BY started_at",
+                (since,),
+            ).fetchall()
+            phase_rows = connection.execute(
+                "SELECT run_id, name, seconds FROM phases WHERE run_id IN "
+                "(SELECT id FROM runs WHERE started_at >= ?)",
+                (since,),
+            ).fetchall() if "phases" in tables else []
+            peer_rows = connection.execute(
+                "SELECT run_id, url, bytes_received FROM peer_sources WHERE run_id IN "
+                "(SELECT id FROM runs WHERE started_at >= ?)",
+                (since,),
+            ).fetchall() if "peer_sources" in tables else []
+        phases: dict[int, dict[str, float]] = {}
+        for run_id, name, seconds in phase_rows:
+            phases.setdefault(run_id, {})[name] = seconds
+        peer_bytes: dict[int, dict[str, int]] = {}
+        for run_id, url, size in peer_rows:
+            peer_bytes.setdefault(run_id, {})[url] = size
+        branches = set(branch_list) if branch_list else None
+        stats_names = [stats_field.name for stats_field in fields(TransferStats)]
+        return [
+            RunRecord(
+                branch=row["branch"],
+                snapshot=row["snapshot"],
+                started_at=row["started_at"],
+                finished_at=row["finished_at"],
+                status=row["status"],
+                error=row["error"],
+                retries=row["retries"],
+                stats=TransferStats(**{name: row[name] for name in stats_names}),
+                phases=phases.get(row["id"], {}),
+                peer_bytes=peer_bytes.get(row["id"], {}),
+            )
+            for row in rows
+            if branches is None or row["branch"] in branches
+        ]
+
+
+def format_count(value: float) -> str:
+    return f"{value:.0f}"
+
+
+def format_ratio(value: float) -> str:
+    return f"{value:.1%}"
+
+
+def format_rate(value: float) -> str:
+    return f"{format_size(value)}/s"
+
+
+type MetricT = tuple[str, Callable[[RunRecord], float | None], Callable[[float], str]]
+
+STATS_METRICS: list[MetricT] = [
+    ("duration", lambda record: record.duration, format_duration),
+    ("sync phase", lambda record: record.phases.get("sync"), format_duration),
+    ("warmup phase", lambda record: record.phases.get("warmup"), format_duration),
+    ("delete phase", lambda record: record.phases.get("delete"), format_duration),
+    ("received", lambda record: record.stats.bytes_received, format_size),
+    (
+        "peer received",
+        lambda record: sum(record.peer_bytes.values()) if record.peer_bytes else None,
+        format_size,
+    ),
+    ("files changed", lambda record: record.stats.files_transferred, format_count),
+    ("snapshot size", lambda record: record.stats.total_size, format_size),
+    ("link-dest hits", lambda record: record.link_dest_ratio, format_ratio),
+    ("throughput", lambda record: record.throughput, format_rate),
+]
+
+
+def percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def trend(points: list[tuple[float, float]]) -> float | None:
+    # relative change of the fitted value per TREND_PERIOD
+    if len(points) < 2 or len({x for x, _ in points}) < 2:  # noqa: PLR2004
+        return None
+    times, values = zip(*points, strict=True)
+    if not (mean := statistics.fmean(values)):
+        return None
+    slope, _ = statistics.linear_regression(times, values)
+    return slope * TREND_PERIOD / mean
+
+
+def best_schedule_hour(records: list[RunRecord]) -> tuple[int, float, int] | None:
+    hourly: dict[int, list[float]] = {}
+    for record in records:
+        if record.status == "ok" and (throughput := record.throughput):
+            hour = datetime.fromtimestamp(record.started_at).hour  # noqa: DTZ006
+            hourly.setdefault(hour, []).append(throughput)
+    candidates = [
+        (statistics.median(values), hour, len(values))
+        for hour, values in hourly.items()
+        if len(values) >= SCHEDULE_MIN_RUNS
+    ]
+    if not candidates:
+        return None
+    throughput, hour, runs = max(candidates)
+    return hour, throughput, runs
+
+
+def format_metric(
+    title: str,
+    points: list[tuple[float, float]],
+    formatter: Callable[[float], str],
+) -> str:
+    values = [value for _, value in points]
+    line = f"  {title:<16}" + "".join(
+        f" p{percent} {formatter(percentile(values, percent)):>10}"
+        for percent in (50, 90, 99)
+    )
+    if (change := trend(points)) is not None:
+        line += f"  trend {change:+.1%} / 30 days"
+    return line
+
+
+def format_branch_stats(branch: str, records: list[RunRecord]) -> str:
+    succeeded = [record for record in records if record.status == "ok"]
+    lines = [(
+        f"Branch {branch}: {len(records)} runs, {len(succeeded)} succeeded, "
+        f"{len(records) - len(succeeded)} failed, "
+        f"{sum(record.retries for record in records)} retries"
+    )]
+    for title, getter, formatter in STATS_METRICS:
+        points = [
+            (record.started_at, value) for record in succeeded
+            if (value := getter(record)) is not None
+        ]
+        if points:
+            lines.append(format_metric(title, points, formatter))
+    if best := best_schedule_hour(records):
+        hour, throughput, runs = best
+        lines.append(
+            f"  Suggested schedule window: {hour:02d}:00-{(hour + 1) % 24:02d}:00 "
+            f"(median {format_size(throughput)}/s over {runs} runs, "
+            f"OnCalendar=*-*-* {hour:02d}:00:00)")
+    return "\n".join(lines) + "\n"
+
+
+def show_stats(**kwargs: Unpack[StatsKW]) -> None:
+    working_dir = kwargs.get("working_dir", DEFAULT_HOME_PATH)
+    days = kwargs.get("days", DEFAULT_HISTORY_DAYS)
+    history = RunHistory(working_dir/HISTORY_DB_NAME)
+    if not history.path.exists():
+        sys.stdout.write("No runs recorded.\n")
+        return
+    records = history.load(kwargs.get("branch_list"), time.time() - days * 24 * 3600)
+    branch_records: dict[str, list[RunRecord]] = {}
+    for record in records:
+        branch_records.setdefault(record.branch, []).append(record)
+    if not branch_records:
+        sys.stdout.write(f"No runs recorded in the last {days} days.\n")
+        return
+    sys.stdout.write("\n".join(
+        format_branch_stats(branch, branch_records[branch])
+        for branch in sorted(branch_records)
+    ))
@@ -0,0 +1,354 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import stat
+import sys
+import tarfile
+import zlib
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass, field
+from logging import Logger
+from pathlib import Path
+from typing import Any, BinaryIO, Unpack
+
+from sisyphus_mirror.consts import BRANCH_LIST, DEFAULT_HOME_PATH
+from sisyphus_mirror.logger import get_logger
+from sisyphus_mirror.snapshots import SNAPSHOTS_SUBDIR, find_snapshots, publish_snapshot
+from sisyphus_mirror.typedefs import ExportKW, ImportKW
+from sisyphus_mirror.units import format_size
+
+IMAGE_INDEX_VERSION = 1
+IMAGE_SUFFIX = ".tar.gz"
+INDEX_SUFFIX = ".json"  # the index of p11-1.tar.gz is p11-1.tar.gz.json
+IMAGE_FRAME_SIZE = 4 * 1024 * 1024  # uncompressed tar bytes per gzip member
+IMAGE_LEVEL = 6
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def iter_snapshot(snapshot: Path) -> Iterator[tuple[str, Path]]:
+    yield from iter_directory(snapshot.parent.resolve(), snapshot, "")
+
+
+def iter_directory(
+    snapshots_dir: Path,
+    directory: Path,
+    relative_dir: str,
+) -> Iterator[tuple[str, Path]]:
+    with os.scandir(directory) as scan:
+        names = sorted(entry.name for entry in scan)
+    for name in names:
+        relative = f"{relative_dir}/{name}" if relative_dir else name
+        path = directory/name
+        if path.is_symlink() and is_part_link(snapshots_dir, path):
+            path = path.resolve()
+        yield relative, path
+        if path.is_dir() and not path.is_symlink():
+            yield from iter_directory(snapshots_dir, path, relative)
+
+
+def is_part_link(snapshots_dir: Path, path: Path) -> bool:
+    # split_arch views link part snapshots, the image gets their contents:
+    # arch directories and top-level files of the common part
+    if not path.exists():
+        return False
+    # the link itself, not a chain ending there: local links stay links
+    target = Path(os.path.normpath(path.parent.resolve()/path.readlink()))
+    try:
+        target_snapshot = target.relative_to(snapshots_dir).parts[0]
+        link_snapshot = path.parent.resolve().relative_to(snapshots_dir).parts[0]
+    except ValueError:
+        return False
+    return target_snapshot != link_snapshot
+
+
+def is_same_file(stat_result: os.stat_result, base_stat: os.stat_result) -> bool:
+    # hard-linked by link-dest, or copied with the upstream mtime
+    return (stat_result.st_dev, stat_result.st_ino) == (
+        base_stat.st_dev, base_stat.st_ino,
+    ) or (
+        stat.S_ISREG(base_stat.st_mode)
+        and stat_result.st_size == base_stat.st_size
+        and int(stat_result.st_mtime) == int(base_stat.st_mtime)
+    )
+
+
+class FrameWriter:
+    # gzip members are valid as one stream ("tar -xzf") and readable one by one
+    def __init__(self, file: BinaryIO, level: int = IMAGE_LEVEL) -> None:
+        self.file = file
+        self.level = level
+        self.compressor: Any = None
+        self.position = 0  # uncompressed
+        self.compressed = 0
+        self.digest = hashlib.sha256()
+        self.frames: list[list[int]] = []  # compressed offset, size, tar offset
+
+    def tell(self) -> int:
+        return self.position
+
+    def frame_size(self) -> int:
+        return self.position - self.frames[-1][2] if self.compressor else 0
+
+    def write(self, data: bytes) -> int:
+        if self.compressor is None:
+            self.compressor = zlib.compressobj(
+                self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.frames.append([self.compressed, 0, self.position])
+        self.output(self.compressor.compress(data))
+        self.position += len(data)
+        return len(data)
+
+    def cut(self) -> None:
+        if self.compressor is None:
+            return
+        self.output(self.compressor.flush())
+        self.compressor = None
+        self.frames[-1][1] = self.compressed - self.frames[-1][0]
+
+    def output(self, data: bytes) -> None:
+        self.file.write(data)
+        self.digest.update(data)
+        self.compressed += len(data)
+
+
+class HashingReader:
+    def __init__(self, file: BinaryIO) -> None:
+        self.file = file
+        self.digest = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.digest.update(data)
+        return data
+
+    def drain(self) -> None:
+        while self.read(READ_CHUNK_SIZE):
+            pass
+
+
+@dataclass
+class ImageIndex:
+    name: str  # snapshot name
+    image: str  # image file name
+    base: str | None = None  # base snapshot name of a delta image
+    size: int = 0
+    sha256: str = ""
+    frames: list[list[int]] = field(default_factory=list)
+    # lists instead of objects: hundreds of thousands of entries
+    files: list[list[Any]] = field(default_factory=list)  # path, size, frame, offset
+    base_files: list[list[Any]] = field(default_factory=list)  # path, size
+    version: int = IMAGE_INDEX_VERSION
+
+    @classmethod
+    def load(cls, path: Path) -> "ImageIndex":
+        data = json.loads(path.read_text())
+        if data.get("version") != IMAGE_INDEX_VERSION:
+            msg = f"Unsupported image index version in {path}"
+            raise ValueError(msg)
+        return cls(**data)
+
+    def save(self, path: Path) -> None:
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with tmp_path.open("w") as file:
+            json.dump(asdict(self), file, separators=(",", ":"))
+        tmp_path.replace(path)
+
+    def read_file(self, image_path: Path, path: str) -> bytes:
+        # random access: only the frame holding the file is decompressed
+        locations = {entry[0]: entry[1:] for entry in self.files}
+        if (location := locations.get(path)) is None:
+            raise FileNotFoundError(path)
+        size, frame, offset = location
+        frame_offset, frame_size, _ = self.frames[frame]
+        with image_path.open("rb") as file:
+            file.seek(frame_offset)
+            compressed = file.read(frame_size)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return decompressor.decompress(compressed, offset + size)[offset:]
+
+
+def index_path_of(image_path: Path) -> Path:
+    return image_path.with_name(f"{image_path.name}{INDEX_SUFFIX}")
+
+
+def export_snapshot(
+    snapshot: Path,
+    output_dir: Path,
+    base: Path | None = None,
+    frame_size: int = IMAGE_FRAME_SIZE,
+    logger: Logger = get_logger(__name__),
+) -> ImageIndex:
+    suffix = f".delta{IMAGE_SUFFIX}" if base else IMAGE_SUFFIX
+    image_path = output_dir/f"{snapshot.name}{suffix}"
+    index = ImageIndex(
+        name=snapshot.name,
+        image=image_path.name,
+        base=base.name if base else None,
+    )
+    base_paths = dict(iter_snapshot(base)) if base else {}
+    logger.info(f"Export {snapshot} to {image_path}")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = image_path.with_name(f".{image_path.name}.tmp")
+    with tmp_path.open("wb") as file:
+        writer = FrameWriter(file)
+        with tarfile.open(
+            fileobj=writer, mode="w", format=tarfile.PAX_FORMAT,  # type: ignore[call-overload]
+        ) as tar:
+            locations: dict[str, list[Any]] = {}
+            for relative, path in iter_snapshot(snapshot):
+                stat_result = path.lstat()
+                base_path = base_paths.get(relative)
+                if (
+                    stat.S_ISREG(stat_result.st_mode)
+                    and base_path is not None
+                    and is_same_file(stat_result, base_path.lstat())
+                ):
+                    index.base_files.append([relative, stat_result.st_size])
+                    continue
+                if writer.frame_size() >= frame_size:
+                    writer.cut()  # members never span frames
+                tarinfo = tar.gettarinfo(path, relative)
+                if not tarinfo.isreg():
+                    tar.addfile(tarinfo)
+                    if tarinfo.islnk() and tarinfo.linkname in locations:
+                        index.files.append([relative, *locations[tarinfo.linkname]])
+                    continue
+                with path.open("rb") as source:
+                    tar.addfile(tarinfo, source)
+                frame = len(writer.frames) - 1
+                blocks = -(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                offset = writer.tell() - blocks - writer.frames[frame][2]
+                locations[relative] = [tarinfo.size, frame, offset]
+                index.files.append([relative, *locations[relative]])
+        writer.cut()
+    tmp_path.replace(image_path)
+
+    index.size = writer.compressed
+    index.sha256 = writer.digest.hexdigest()
+    index.frames = writer.frames
+    # the index is written last: an image without it is incomplete
+    index.save(index_path_of(image_path))
+    logger.info(
+        f"Exported {len(index.files)} files, {len(index.base_files)} linked from "
+        f"base, image size {format_size(index.size)}")
+    return index
+
+
+def import_image(
+    image_path: Path,
+    working_dir: Path,
+    logger: Logger = get_logger(__name__),
+) -> Path:
+    index = ImageIndex.load(index_path_of(image_path))
+    snapshots_dir = working_dir/SNAPSHOTS_SUBDIR
+    snapshot = snapshots_dir/index.name
+    if snapshot.exists():
+        logger.info(f"Snapshot {snapshot} already exists, skip {image_path}")
+        return snapshot
+    base = snapshots_dir/index.base if index.base else None
+    if base is not None and not base.is_dir():
+        msg = f"Base snapshot {base} of image {image_path} not found"
+        raise RuntimeError(msg)
+
+    logger.info(f"Import {image_path} to {snapshot}")
+    tmp_dir = snapshots_dir/f"__{index.name}_IMPORT__"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    try:
+        extract_image(image_path, index, tmp_dir)
+        if base is not None:
+            link_base_files(base, tmp_dir, index.base_files)
+        tmp_dir.rename(snapshot)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    logger.info(
+        f"Imported {len(index.files)} files, {len(index.base_files)} linked from "
+        f"{base}")
+    return snapshot
+
+
+def extract_image(image_path: Path, index: ImageIndex, dest_dir: Path) -> None:
+    with image_path.open("rb") as file:
+        reader = HashingReader(file)
+        with (
+            gzip.GzipFile(fileobj=reader, mode="rb") as stream,  # type: ignore[call-overload]
+            tarfile.open(fileobj=stream, mode="r|") as tar,
+        ):
+            tar.extractall(dest_dir, filter="tar")
+        reader.drain()  # tar stops at the end-of-archive blocks
+    if reader.digest.hexdigest() != index.sha256:
+        msg = f"Image {image_path} checksum mismatch"
+        raise ValueError(msg)
+
+
+def link_base_files(base: Path, dest_dir: Path, base_files: list[list[Any]]) -> None:
+    for relative, size in base_files:
+        source = base/relative
+        if source.lstat().st_size != size:
+            msg = f"Base snapshot {base} differs from the image base: {relative}"
+            raise RuntimeError(msg)
+        dest = dest_dir/relative
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        os.link(source, dest)
+
+
+def resolve_snapshot(working_dir: Path, name: str) -> Path:
+    snapshot = working_dir/SNAPSHOTS_SUBDIR/name
+    if not snapshot.is_dir():
+        msg = f"Snapshot {snapshot} not found"
+        raise ValueError(msg)
+    return snapshot
+
+
+def export_images(**kwargs: Unpack[ExportKW]) -> None:
+    logger = kwargs.get("logger", get_logger(__name__))
+    working_dir = kwargs.get("working_dir", DEFAULT_HOME_PATH)
+    output_dir = kwargs.get("output", Path())
+    if name := kwargs.get("snapshot"):
+        snapshots = [resolve_snapshot(working_dir, name)]
+    else:
+        if not (branch_list := kwargs.get("branch_list")):
+            msg = "You must set branches in CLI arguments or config options."
+            raise ValueError(msg)
+        snapshots = [
+            branch_snapshots[-1] for branch in branch_list
+            if (branch_snapshots := find_snapshots(working_dir, branch))
+        ]
+    base = None
+    if base_name := kwargs.get("base"):
+        if len(snapshots) != 1:
+            msg = "A base snapshot needs exactly one snapshot to export."
+            raise ValueError(msg)
+        base = resolve_snapshot(working_dir, base_name)
+    if kwargs.get("dry_run", False):
+        for snapshot in snapshots:
+            logger.info(f"Would export {snapshot} to {output_dir}")
+        return
+    for snapshot in snapshots:
+        index = export_snapshot(snapshot, output_dir, base, logger=logger)
+        sys.stdout.write(f"{output_dir/index.image}\n")
+
+
+def import_images(**kwargs: Unpack[ImportKW]) -> None:
+    logger = kwargs.get("logger", get_logger(__name__))
+    working_dir = kwargs.get("working_dir", DEFAULT_HOME_PATH)
+    # snapshot names sort by time, so bases are imported before their deltas
+    images = sorted(
+        kwargs.get("images", []),
+        key=lambda image_path: ImageIndex.load(index_path_of(image_path)).name,
+    )
+    if kwargs.get("dry_run", False):
+        for image_path in images:
+            logger.info(f"Would import {image_path}")
+        return
+    imported = [import_image(image_path, working_dir, logger) for image_path in images]
+    for branch in {snapshot.name.rsplit("-", 1)[0] for snapshot in imported}:
+        if branch not in BRANCH_LIST:
+            continue  # split_arch parts are not published
+        latest = find_snapshots(working_dir, branch)[-1]
+        logger.info(f"Publish {latest} as {working_dir/branch}")
+        publish_snapshot(working_dir, branch, latest)
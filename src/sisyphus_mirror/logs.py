@@ -0,0 +1,380 @@
+import gzip
+import heapq
+import os
+import re
+import statistics
+import sys
+import time
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Unpack
+from urllib.parse import unquote, urlsplit
+
+from sisyphus_mirror.consts import (
+    ARCH_LIST,
+    BRANCH_LIST,
+    COMMON_PART,
+    DEFAULT_ARCH,
+    DEFAULT_EXCLUDE_FILES,
+    DEFAULT_HISTORY_DAYS,
+    DEFAULT_HOME_PATH,
+    DEFAULT_HOT_LIST_SIZE,
+    DEFAULT_RATE_LIMIT,
+)
+from sisyphus_mirror.history import HISTORY_DB_NAME, RunHistory
+from sisyphus_mirror.packages import read_branch_packages
+from sisyphus_mirror.snapshots import BRANCH_SUBDIR
+from sisyphus_mirror.typedefs import AnalyzeLogsKW, ArchT
+from sisyphus_mirror.units import format_duration, format_size, parse_rate_limit
+
+# nginx "combined" and "main" formats: "GET /path HTTP/1.1" status size
+NGINX_RE = re.compile(
+    r'"(?:GET|HEAD) (?P<path>\S+) HTTP/[\d.]+" (?P<status>\d{3}) (?P<size>\d+|-)')
+# rsyncd "transfer logging" with the default "%o %h [%a] %m (%u) %f %l"
+RSYNCD_RE = re.compile(
+    r"\] send \S+ \[[^\]]*\] \S+ \([^)]*\) (?P<path>.+) (?P<size>\d+)$")
+SUCCESS_STATUSES = ("200", "206", "304")
+DIRECTORY_CAPACITY = 1000
+PACKAGE_CAPACITY = 10000
+REPORT_TOP = 20
+
+
+@dataclass(frozen=True)
+class LogRequest:
+    branch: str
+    path: str  # relative to {branch}/branch
+    size: int
+
+    @property
+    def arch(self) -> str:
+        arch = self.path.split("/", 1)[0]
+        return arch if arch in ARCH_LIST else COMMON_PART
+
+    @property
+    def directory(self) -> str:
+        return self.path.rsplit("/", 1)[0] if "/" in self.path else ""
+
+    @property
+    def package(self) -> str | None:
+        # N-V-R.A.rpm: one key for all versions of a package
+        directory, _, filename = self.path.rpartition("/")
+        if not filename.endswith(".rpm") or filename.count("-") < 2:  # noqa: PLR2004
+            return None
+        return f"{directory}/{filename.rsplit('-', 2)[0]}"
+
+
+def split_request_path(request_path: str) -> tuple[str, str] | None:
+    # /pub/distributions/ALTLinux/p11/branch/x86_64/... or p11/branch/x86_64/...
+    parts = unquote(urlsplit(request_path).path).split("/")
+    for index, part in enumerate(parts[:-1]):
+        if part in BRANCH_LIST and parts[index + 1] == BRANCH_SUBDIR:
+            return part, "/".join(parts[index + 2:])
+    return None
+
+
+def parse_log_line(line: str) -> LogRequest | None:
+    if match := NGINX_RE.search(line):
+        if match["status"] not in SUCCESS_STATUSES:
+            return None
+        size = 0 if match["size"] == "-" else int(match["size"])
+    elif match := RSYNCD_RE.search(line.rstrip("\n")):
+        size = int(match["size"])
+    else:
+        return None
+    if (split := split_request_path(match["path"])) is None:
+        return None
+    branch, path = split
+    if not path or path.endswith("/"):
+        return None  # directory listings
+    return LogRequest(branch, path, size)
+
+
+def iter_log_lines(path: Path) -> Iterator[str]:
+    # rotated logs: access.log.1, access.log.2.gz, ...
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", errors="replace") as file:
+        yield from file
+
+
+class SpaceSaving:
+    # Metwally et al. "Efficient Computation of Frequent and Top-k Elements in
+    # Data Streams": counts are overestimated by at most the evicted minimum
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.counts: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        self.values: dict[str, str] = {}
+        self.heap: list[tuple[int, str]] = []  # lazily updated minimum
+
+    def add(self, key: str, value: str = "") -> None:
+        if key in self.counts:
+            self.counts[key] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = 1
+            self.errors[key] = 0
+        else:
+            minimum = self.pop_minimum()
+            self.counts[key] = minimum + 1
+            self.errors[key] = minimum
+        self.values[key] = value
+        heapq.heappush(self.heap, (self.counts[key], key))
+        if len(self.heap) > 2 * self.capacity:
+            self.heap = [(count, key) for key, count in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def pop_minimum(self) -> int:
+        while True:
+            count, key = heapq.heappop(self.heap)
+            if self.counts.get(key) == count:
+                del self.counts[key], self.errors[key], self.values[key]
+                return count
+
+    def upper_bound(self, key: str) -> int:
+        # an untracked key was seen at most as often as the tracked minimum
+        if key in self.counts:
+            return self.counts[key]
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def top(self, limit: int) -> list[tuple[str, int, int]]:
+        ordered = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return [(key, count, self.errors[key]) for key, count in ordered[:limit]]
+
+
+@dataclass
+class LogAnalysis:
+    lines: int = 0
+    requests: int = 0
+    arch_requests: Counter[tuple[str, str]] = field(default_factory=Counter)
+    arch_bytes: Counter[tuple[str, str]] = field(default_factory=Counter)
+    directories: SpaceSaving = field(
+        default_factory=lambda: SpaceSaving(DIRECTORY_CAPACITY))
+    packages: SpaceSaving = field(default_factory=lambda: SpaceSaving(PACKAGE_CAPACITY))
+
+    def feed(self, lines: Iterable[str]) -> None:
+        for line in lines:
+            self.lines += 1
+            if (request := parse_log_line(line)) is None:
+                continue
+            self.requests += 1
+            self.arch_requests[request.branch, request.arch] += 1
+            self.arch_bytes[request.branch, request.arch] += request.size
+            self.directories.add(f"{request.branch}/{request.directory}")
+            if package := request.package:
+                self.packages.add(f"{request.branch}/{package}", request.path)
+
+    def branches(self) -> list[str]:
+        return sorted({branch for branch, _ in self.arch_requests})
+
+
+def tree_size(path: Path) -> int:
+    # hard-linked files are counted once
+    inodes: dict[int, int] = {}
+    for root, _, files in os.walk(path):
+        for name in files:
+            stat = Path(root, name).lstat()
+            inodes[stat.st_ino] = stat.st_size
+    return sum(inodes.values())
+
+
+@dataclass
+class Recommendation:
+    arch_list: list[ArchT]
+    exclude_files: list[str]
+    saved_bytes: int = 0
+    unmirrored: dict[str, int] = field(default_factory=dict)  # requested arches
+
+
+@dataclass
+class Recommender:
+    # arch_list and exclude_files apply to all branches, so a path is
+    # recommended for removal only when it is unused in every branch
+    analysis: LogAnalysis
+    branch_list: list[str]
+    branch_trees: dict[str, Path]  # published snapshots, for sizes
+    min_requests: int = 0
+
+    def requests(self, arch: str) -> int:
+        return sum(
+            self.analysis.arch_requests[branch, arch] for branch in self.branch_list)
+
+    def has_requests(self) -> bool:
+        # without requests every arch looks unused, e.g. an unknown log format
+        return any(
+            count for (branch, _), count in self.analysis.arch_requests.items()
+            if branch in self.branch_list)
+
+    def size(self, relative: str) -> int:
+        return sum(
+            tree_size(tree/BRANCH_SUBDIR/relative)
+            for tree in self.branch_trees.values())
+
+    def kept_arches(self, arch_list: list[ArchT]) -> list[ArchT]:
+        kept = [arch for arch in arch_list if self.requests(arch) > self.min_requests]
+        if any(arch != "noarch" for arch in kept):
+            # arch packages depend on noarch ones
+            kept = [arch for arch in arch_list if arch in kept or arch == "noarch"]
+        return kept
+
+    def unused_components(self, arch_list: list[ArchT]) -> list[str]:
+        components: set[str] = set()
+        for tree in self.branch_trees.values():
+            for arch in arch_list:
+                components.update(
+                    f"{arch}/{path.name}"
+                    for path in (tree/BRANCH_SUBDIR/arch).glob("RPMS.*")
+                    if path.is_dir())
+        return [
+            component for component in sorted(components)
+            if all(
+                self.analysis.directories.upper_bound(f"{branch}/{component}")
+                <= self.min_requests
+                for branch in self.branch_list
+            )
+        ]
+
+    def recommend(
+        self,
+        arch_list: list[ArchT],
+        exclude_files: list[str],
+    ) -> Recommendation:
+        kept = self.kept_arches(arch_list)
+        recommendation = Recommendation(
+            arch_list=kept,
+            exclude_files=list(exclude_files),
+            saved_bytes=sum(self.size(arch) for arch in arch_list if arch not in kept),
+            unmirrored={
+                arch: count for arch in ARCH_LIST
+                if arch not in arch_list and (count := self.requests(arch))
+            },
+        )
+        for component in self.unused_components(kept):
+            recommendation.exclude_files.append(f"/{BRANCH_SUBDIR}/{component}/")
+            recommendation.saved_bytes += self.size(component)
+        return recommendation
+
+
+def hot_paths(
+    analysis: LogAnalysis,
+    branch_trees: dict[str, Path],
+    arch_list: list[ArchT],
+    limit: int,
+) -> list[str]:
+    # requested versions may be gone, the published package lists name the
+    # current files; paths are relative to the source URL like rsync sees them
+    current: dict[str, str] = {}
+    for branch, tree in branch_trees.items():
+        for package in read_branch_packages(tree/BRANCH_SUBDIR, arch_list):
+            current[f"{branch}/{package.arch}/{package.directory}/{package.name}"] = (
+                package.path)
+    paths: list[str] = []
+    for key, _, _ in analysis.packages.top(limit):
+        branch = key.split("/", 1)[0]
+        path = current.get(key, analysis.packages.values.get(key, ""))
+        paths.append(f"{branch}/{BRANCH_SUBDIR}/{path}")
+    return paths
+
+
+def estimate_throughput(working_dir: Path, rate_limit: int | str) -> float | None:
+    # the observed median, or the rate limit when nothing is recorded yet
+    if (history_path := working_dir/HISTORY_DB_NAME).exists():
+        since = time.time() - DEFAULT_HISTORY_DAYS * 24 * 3600
+        throughputs = [
+            throughput for record in RunHistory(history_path).load(since=since)
+            if (throughput := record.throughput)
+        ]
+        if throughputs:
+            return statistics.median(throughputs)
+    return parse_rate_limit(rate_limit) or None
+
+
+def format_analysis(analysis: LogAnalysis) -> str:
+    lines = [
+        f"Parsed {analysis.requests} repository requests of {analysis.lines} lines"]
+    for branch in analysis.branches():
+        total = sum(
+            count for (name, _), count in analysis.arch_requests.items()
+            if name == branch)
+        lines.append(f"Branch {branch}:")
+        lines.append(f"  {'ARCH':<16} {'REQUESTS':>10} {'SHARE':>7} {'SERVED':>12}")
+        lines.extend(
+            f"  {arch:<16} {count:>10} {count / total:>7.1%} "
+            f"{format_size(analysis.arch_bytes[branch, arch]):>12}"
+            for (name, arch), count in analysis.arch_requests.most_common()
+            if name == branch
+        )
+        for title, counter in (
+            ("directories", analysis.directories),
+            ("packages", analysis.packages),
+        ):
+            top = [
+                (key, count, error) for key, count, error in counter.top(len(
+                    counter.counts)) if key.startswith(f"{branch}/")
+            ][:REPORT_TOP]
+            lines.append(f"  Top {title}:")
+            lines.extend(
+                f"    {count:>10}  {key.removeprefix(f'{branch}/')}"
+                + (f" (+/- {error})" if error else "")
+                for key, count, error in top
+            )
+    return "\n".join(lines) + "\n"
+
+
+def format_recommendation(
+    recommendation: Recommendation,
+    throughput: float | None,
+) -> str:
+    lines = ["Recommended settings:"]
+    lines.append(f"  arch_list = {recommendation.arch_list}".replace("'", '"'))
+    lines.append(f"  exclude_files = {recommendation.exclude_files}".replace("'", '"'))
+    saved = f"  Saves {format_size(recommendation.saved_bytes)} per full snapshot"
+    if throughput:
+        saved += (
+            f", {format_duration(recommendation.saved_bytes / throughput)} "
+            f"of transfer at {format_size(throughput)}/s")
+    lines.append(saved)
+    lines.extend(
+        f"  Requested but not mirrored: {arch} ({count} requests)"
+        for arch, count in recommendation.unmirrored.items()
+    )
+    return "\n".join(lines) + "\n"
+
+
+def analyze_logs(**kwargs: Unpack[AnalyzeLogsKW]) -> None:
+    working_dir = kwargs.get("working_dir", DEFAULT_HOME_PATH)
+    arch_list = kwargs.get("arch_list", DEFAULT_ARCH)
+    analysis = LogAnalysis()
+    for path in kwargs.get("logs", []):
+        analysis.feed(iter_log_lines(path))
+    sys.stdout.write(format_analysis(analysis))
+
+    branch_list: list[str] = [*kwargs.get("branch_list", [])] or analysis.branches()
+    # the published snapshots give the sizes and the current package files
+    branch_trees = {
+        branch: working_dir/branch for branch in branch_list
+        if (working_dir/branch).is_dir()
+    }
+    recommender = Recommender(
+        analysis, branch_list, branch_trees, kwargs.get("min_requests", 0))
+    if recommender.has_requests():
+        recommendation = recommender.recommend(
+            arch_list, kwargs.get("exclude_files", DEFAULT_EXCLUDE_FILES))
+        throughput = estimate_throughput(
+            working_dir, kwargs.get("rate_limit", DEFAULT_RATE_LIMIT))
+        sys.stdout.write(format_recommendation(recommendation, throughput))
+    else:
+        sys.stdout.write(
+            f"No repository requests for branches {', '.join(branch_list) or '-'}"
+            ", no settings recommended\n")
+
+    if hot_list := kwargs.get("hot_list"):
+        paths = hot_paths(
+            analysis, branch_trees, arch_list,
+            kwargs.get("top", DEFAULT_HOT_LIST_SIZE))
+        tmp_path = hot_list.with_name(f".{hot_list.name}.tmp")
+        tmp_path.write_text("".join(f"{path}\n" for path in paths))
+        tmp_path.replace(hot_list)
+        sys.stdout.write(f"Wrote {len(paths)} most requested paths to {hot_list}\n")
@@ -1,33 +1,112 @@
+import asyncio
 import shutil
-import subprocess
-from dataclasses import dataclass, field
+import sqlite3
+from collections.abc import Callable
+from dataclasses import dataclass, field, replace
 from datetime import datetime
+from functools import partial
 from logging import Logger, getLogger
 from os import chdir
 from pathlib import Path
-from typing import Unpack
+from tempfile import TemporaryDirectory
+from typing import Unpack, cast
 
 from sisyphus_mirror.consts import (
+    COMMON_PART,
     DEFAULT_ARCH,
     DEFAULT_CONN_TIMEOUT,
     DEFAULT_EXCLUDE_FILES,
     DEFAULT_HOME_PATH,
+    DEFAULT_HTTP_WORKERS,
     DEFAULT_INCLUDE_FILES,
     DEFAULT_IO_TIMEOUT,
+    DEFAULT_KEEP_BATCHES,
     DEFAULT_RATE_LIMIT,
     DEFAULT_SNAPSHOTS_LIMIT,
     DEFAULT_SOURCE,
+    DEFAULT_SYNC_TIMEOUT,
+    DEFAULT_WARM_PATHS,
+    DEFAULT_WARM_WORKERS,
+    PHASE_LIST,
+)
+from sisyphus_mirror.fanout import BatchInfo, BatchStore, filter_digest
+from sisyphus_mirror.filters import (
+    FilterEvaluator,
+    FilterRule,
+    build_filter_rules,
+    compile_rules,
+    write_filter_file,
+)
+from sisyphus_mirror.history import (
+    HISTORY_DB_NAME,
+    RsyncOutput,
+    RunHistory,
+    RunRecord,
+    TransferStats,
 )
 from sisyphus_mirror.logger import get_logger
-from sisyphus_mirror.typedefs import ArchT, BranchT, RepoMirrorKW
+from sisyphus_mirror.packages import (
+    Package,
+    PackageSelector,
+    read_branch_packages,
+    rewrite_indexes,
+)
+from sisyphus_mirror.priority import PhasePriority
+from sisyphus_mirror.process import cancel_on_signals, run_blocking, run_process
+from sisyphus_mirror.retention import RetentionPolicy, select_pressure_victim
+from sisyphus_mirror.snapshots import (
+    BRANCH_SUBDIR,
+    SNAPSHOT_DATETIME_FORMAT,
+    find_snapshots,
+    publish_snapshot,
+)
+from sisyphus_mirror.split import (
+    PartStore,
+    list_fingerprint,
+    part_filter_rules,
+    part_listing_rules,
+    split_part_list,
+    view_parts,
+)
+from sisyphus_mirror.transport import (
+    HttpTransport,
+    RemoteFile,
+    is_http_url,
+)
+from sisyphus_mirror.typedefs import (
+    ArchT,
+    BranchT,
+    FanoutKW,
+    PackageFilterKW,
+    PhasePriorityKW,
+    PhaseT,
+    PriorityKW,
+    ProxyKW,
+    RepoMirrorKW,
+    RetentionKW,
+    SplitArchKW,
+)
+from sisyphus_mirror.units import format_size, parse_rate_limit
+from sisyphus_mirror.usage import UsageAccounting
+from sisyphus_mirror.warmup import cool_down, warm_up
 
+SYNC_ATTEMPTS = 3
 
-def repo_mirroring(**kwargs: Unpack[RepoMirrorKW]) -> None:
-    logger = kwargs.get("logger", getLogger(__name__))
 
+def repo_mirroring(**kwargs: Unpack[RepoMirrorKW]) -> None:
     if working_dir := kwargs.get("working_dir"):
         chdir(working_dir)
 
+    try:
+        asyncio.run(cancel_on_signals(mirror_repo(**kwargs)))
+    except asyncio.CancelledError as error:
+        msg = "Mirroring cancelled"
+        raise RuntimeError(msg) from error
+
+
+async def mirror_repo(**kwargs: Unpack[RepoMirrorKW]) -> list[Path]:
+    logger = kwargs.get("logger", getLogger(__name__))
+
     if not (branch_list := kwargs.get("branch_list")):
         msg = (
             "You must set branches in CLI arguments or config options.\n\n"
@@ -39,13 +118,22 @@ def repo_mirroring(**kwargs: Unpack[RepoMirrorKW]) -> None:
         )
         raise ValueError(msg)
 
+    new_snapshots: list[Path] = []
     for branch in branch_list:
         logger.info(f"{branch=} synchronization started.")
-        branch_sync = BranchMirror(
-            branch=branch,
-            **kwargs,
-        )
-        branch_sync.run()
+        if new_snapshot := await mirror_branch(branch, **kwargs):
+            new_snapshots.append(new_snapshot)
+    return new_snapshots
+
+
+async def mirror_branch(
+    branch: BranchT,
+    **kwargs: Unpack[RepoMirrorKW],
+) -> Path | None:
+    options: RepoMirrorKW = {"branch_list": [branch], **kwargs}
+    branch_sync = BranchMirror(branch=branch, **options)
+    await branch_sync.run()
+    return branch_sync.new_snapshot
 
 
 @dataclass()
@@ -56,6 +144,7 @@ class BranchMirror:
     verbose: bool = False
     debug: bool = False
     source_url: str = DEFAULT_SOURCE
+    peer_urls: list[str] = field(default_factory=list)
     working_dir: Path = DEFAULT_HOME_PATH
     arch_list: list[ArchT] = field(default_factory=lambda: DEFAULT_ARCH)
     linkdest_list: list[Path] = field(default_factory=list)
@@ -65,32 +154,126 @@ class BranchMirror:
     rate_limit: int | str = DEFAULT_RATE_LIMIT
     conn_timeout: int = DEFAULT_CONN_TIMEOUT
     io_timeout: int = DEFAULT_IO_TIMEOUT
+    sync_timeout: int = DEFAULT_SYNC_TIMEOUT
+    retention: RetentionKW = field(default_factory=RetentionKW)
+    package_filter: PackageFilterKW = field(default_factory=PackageFilterKW)
+    warm_paths: list[str] = field(default_factory=lambda: DEFAULT_WARM_PATHS)
+    warm_workers: int = DEFAULT_WARM_WORKERS
+    http_workers: int = DEFAULT_HTTP_WORKERS
+    priority: PriorityKW = field(default_factory=PriorityKW)
+    fanout: FanoutKW = field(default_factory=FanoutKW)
+    proxy: ProxyKW = field(default_factory=ProxyKW)
+    split_arch: SplitArchKW = field(default_factory=SplitArchKW)
+    hot_list: Path | None = None
+    part: str | None = None  # a split_arch part synchronized on its own
     logger: Logger = get_logger(__name__)
     new_snapshot: Path | None = field(init=False)
 
     def __post_init__(self) -> None:
+        # snapshot name prefix: "p11" or "p11.noarch" for a part
+        self.name = f"{self.branch}.{self.part}" if self.part else self.branch
         self.flag = self.working_dir/f".snapshots/__{self.branch}_IN_PROCESS__"
         self.last_symlink = self.working_dir/self.branch
-        self.partial_dir = self.working_dir/".partial"/self.branch
+        self.partial_dir = self.working_dir/".partial"/self.name
         self.snapshots_dir = self.working_dir/".snapshots"
-        self.dest_dir = self.snapshots_dir/f"__{self.branch}_UNCOMPLETE__"
+        self.dest_dir = self.snapshots_dir/f"__{self.name}_UNCOMPLETE__"
         self.new_snapshot = None
-
-    def run(self) -> None:
+        retention: RetentionKW = {"keep_last": self.snapshot_limit, **self.retention}
+        self.retention_policy = RetentionPolicy(**retention)
+        self.package_selector = (
+            PackageSelector(**self.package_filter) if self.package_filter else None)
+        self.packages: list[Package] = []
+        self.selected_packages: list[Package] | None = None
+        self.filter_path = self.working_dir/".filters"/f"{self.name}.rules"
+        self.upstream_fingerprint: str | None = None
+        self.record = RunRecord(branch=self.branch)
+        self.batch_store: BatchStore | None = None
+        self.write_batch: Path | None = None
+        if self.fanout:
+            if "role" not in self.fanout or "batch_dir" not in self.fanout:
+                msg = "Fan-out mode requires both role and batch_dir options."
+                raise ValueError(msg)
+            self.batch_store = BatchStore(self.fanout["batch_dir"])
+        self.part_store: PartStore | None = None
+        if self.split_arch.get("enabled"):
+            if self.batch_store is not None:
+                msg = "Fan-out mode does not support split_arch snapshots."
+                raise ValueError(msg)
+            self.part_store = PartStore(
+                self.working_dir, self.branch, self.split_arch, self.logger)
+        priority = cast("dict[PhaseT, PhasePriorityKW]", self.priority)
+        self.phase_priority = {
+            phase: PhasePriority(**priority.get(phase, {}), logger=self.logger)
+            for phase in PHASE_LIST
+        }
+
+    async def run(self) -> None:
         self.logger.info(f"Branch {self.branch} mirror run")
         try:
-            if not self.dry_run:
-                self.check_or_make_subdirs()
-                self.check_branch_lock()
-                self.set_branch_lock()
-            self.sync_with_source()
-            if not self.dry_run:
-                self.complete_snapshot()
-                self.update_stable_link()
-                self.delete_old_snapshots()
+            await self.run_phases()
+        except asyncio.CancelledError:
+            self.record.finish("cancelled")
+            raise
+        except Exception as error:
+            self.record.finish("failed", str(error))
+            raise
+        else:
+            self.record.finish("ok")
         finally:
             if not self.dry_run:
                 self.unset_branch_lock()
+                self.save_history()
+
+    async def run_phases(self) -> None:
+        if not self.dry_run:
+            self.check_or_make_subdirs()
+            self.check_branch_lock()
+            self.set_branch_lock()
+            with self.record.phase("delete"):
+                await run_blocking(self.free_space, initializer=self.delete_initializer)
+        with self.record.phase("sync"):
+            if self.part_store is not None:
+                await self.sync_parts()
+            else:
+                await self.sync_with_source()
+        if self.dry_run:
+            return
+        previous_snapshots = self.snapshot_map[self.branch]
+        if self.part_store is not None:
+            if not self.compose_view():
+                return
+        else:
+            self.complete_snapshot()
+        with self.record.phase("warmup"):
+            await run_blocking(
+                self.warm_up_snapshot, initializer=self.warmup_initializer)
+        self.update_stable_link()
+        with self.record.phase("delete"):
+            await run_blocking(
+                self.delete_old_snapshots, initializer=self.delete_initializer)
+            await run_blocking(self.free_space, initializer=self.delete_initializer)
+        if previous_snapshots:
+            with self.record.phase("warmup"):
+                await run_blocking(
+                    self.cool_down_snapshot,
+                    previous_snapshots[-1],
+                    initializer=self.warmup_initializer,
+                )
+
+    def save_history(self) -> None:
+        history = RunHistory(self.working_dir/HISTORY_DB_NAME)
+        try:
+            history.append(self.record)
+        except sqlite3.Error as error:
+            self.logger.warning(f"Cannot save run history to {history.path}: {error}")
+
+    @property
+    def warmup_initializer(self) -> Callable[[], None] | None:
+        return self.phase_priority["warmup"].thread_initializer()
+
+    @property
+    def delete_initializer(self) -> Callable[[], None] | None:
+        return self.phase_priority["delete"].thread_initializer()
 
     def check_or_make_subdirs(self) -> None:
         self.logger.info("Check or make subdirectories.")
@@ -120,21 +303,25 @@ class BranchMirror:
     def snapshot_map(self) -> dict[BranchT, list[Path]]:
         snapshot_map: dict[BranchT, list[Path]] = {}
         for branch in self.branch_list:
-            branch_snapshots = [
-                path for path in self.working_dir.glob(f".snapshots/{branch}-*")
-                if path.is_dir()
-            ]
-            oldest_first = sorted(branch_snapshots)
-            snapshot_map[branch] = oldest_first
+            snapshot_map[branch] = find_snapshots(self.working_dir, branch)
         return snapshot_map
 
     @property
     def link_dest_paths(self) -> list[Path]:
         paths: list[Path] = []
 
+        if self.part and (
+            part_snapshots := find_snapshots(self.working_dir, self.name)
+        ):
+            paths.append(part_snapshots[-1])
+
+        # a split_arch view is followed through its symlinks
         if current_snapshots := self.snapshot_map.get(self.branch):
             paths.append(current_snapshots[-1])
 
+        if self.batch_store is not None:
+            return paths  # a batch is replayed against the branch snapshot only
+
         paths.extend(self.linkdest_list)
 
         for other_branch in self.branch_list:
@@ -144,7 +331,7 @@ class BranchMirror:
 
         return paths[:20]
 
-    def prepare_rsync_cmd(self) -> list[str]:
+    def prepare_rsync_cmd(self, peer_url: str | None = None) -> list[str]:
         rsync_cmd = [
             "rsync",
             "-rltmvH",
@@ -152,11 +339,7 @@ class BranchMirror:
             "--delete-excluded",
             "--stats",
             "--chmod=Du+w",  # permissions for self.delete_old_snapshots()
-            *[f"--exclude={pattern}" for pattern in self.exclude_files],
-            *[f"--include={pattern}" for pattern in self.include_files],
-            *[f"--include={pattern}/**" for pattern in self.arch_list],
-            "--include=*/",
-            "--exclude=*",
+            f"--filter=merge {self.filter_path}",  # see self.filter_rules()
         ]
         if self.dry_run:
             rsync_cmd.append("--dry-run")
@@ -164,14 +347,8 @@ class BranchMirror:
         if self.verbose:
             rsync_cmd.append("--progress")
 
-        if self.rate_limit:
-            rsync_cmd.append(f"--bwlimit={self.rate_limit}")
-
-        if self.conn_timeout:
-            rsync_cmd.append(f"--contimeout={self.conn_timeout}")
-
-        if self.io_timeout:
-            rsync_cmd.append(f"--timeout={self.io_timeout}")
+        # a LAN peer is not rate limited
+        rsync_cmd.extend(self.transfer_options(rate_limit=peer_url is None))
 
         if not self.dry_run:
             rsync_cmd.extend([
@@ -180,7 +357,11 @@ class BranchMirror:
             ])
             rsync_cmd.append(f"--partial-dir={self.partial_dir}")
 
-        rsync_cmd.append(f"{self.source_url}/{self.branch}/branch")
+        if self.write_batch is not None and peer_url is None:
+            rsync_cmd.append(f"--write-batch={self.write_batch}")
+
+        source_url = peer_url or self.source_url
+        rsync_cmd.append(f"{source_url}/{self.branch}/{BRANCH_SUBDIR}")
 
         if not self.dry_run:
             rsync_cmd.append(f"{self.dest_dir}/")
@@ -189,23 +370,466 @@ class BranchMirror:
 
         return rsync_cmd
 
-    def sync_with_source(self) -> None:
-        rsync_cmd = self.prepare_rsync_cmd()
-        self.logger.info("rsync process start")
-        for _ in range(3):
-            result = subprocess.run(rsync_cmd, check=False, text=True)
-            if result.returncode == 0:
-                break
-        else:
-            msg = "Synchronization failed"
+    def transfer_options(self, *, rate_limit: bool = True) -> list[str]:
+        options: list[str] = []
+
+        if rate_limit and self.rate_limit:
+            options.append(f"--bwlimit={self.rate_limit}")
+
+        if self.conn_timeout:
+            options.append(f"--contimeout={self.conn_timeout}")
+
+        if self.io_timeout:
+            options.append(f"--timeout={self.io_timeout}")
+
+        return options
+
+    def filter_rules(self) -> list[FilterRule]:
+        return compile_rules([
+            *part_filter_rules(self.part),
+            *build_filter_rules(
+                exclude_files=self.exclude_files,
+                include_files=self.include_files,
+                arch_list=self.arch_list,
+                packages=self.selected_packages,
+                lazy_arch_list=self.proxy.get("lazy_arch_list", []),
+            ),
+        ])
+
+    def part_arches(self, arch_list: list[ArchT]) -> list[ArchT]:
+        return [arch for arch in arch_list if self.part in (None, arch)]
+
+    def prepare_metadata_rsync_cmd(self, metadata_dir: Path) -> list[str]:
+        rsync_cmd = [
+            "rsync",
+            "-rltm",
+            "--chmod=Du+w",
+            *[f"--exclude={pattern}" for pattern in self.exclude_files],
+            *[
+                f"--include={pattern}/base/**"
+                for pattern in self.part_arches(self.arch_list)
+            ],
+            "--include=*/",
+            "--exclude=*",
+            *self.transfer_options(),
+        ]
+        if not self.dry_run:
+            rsync_cmd.extend([
+                f"--link-dest={link_dest}"
+                for link_dest in self.link_dest_paths
+            ])
+        rsync_cmd.append(f"{self.source_url}/{self.branch}/{BRANCH_SUBDIR}")
+        rsync_cmd.append(f"{metadata_dir}/")
+        return rsync_cmd
+
+    def select_packages(self, metadata_dir: Path) -> None:
+        if self.package_selector is None:
+            return
+        self.packages = read_branch_packages(
+            metadata_dir/BRANCH_SUBDIR, self.part_arches(self.arch_list))
+        self.selected_packages = self.package_selector.select(self.packages)
+        selected_size = sum(package.size for package in self.selected_packages)
+        total_size = sum(package.size for package in self.packages)
+        self.logger.info(
+            f"Selected {len(self.selected_packages)} of {len(self.packages)} "
+            f"packages ({format_size(selected_size)} of {format_size(total_size)})")
+
+    async def sync_with_source(self) -> None:
+        if (
+            self.fanout.get("role") == "replica" and not self.dry_run
+            and await self.apply_batch()
+        ):
+            await self.rewrite_package_indexes(reselect=True)
+            return
+        if is_http_url(self.source_url):
+            await self.sync_over_http()
+            return
+        batch = self.prepare_batch()
+        with TemporaryDirectory(prefix="sisyphus-mirror-") as tmp_dir:
+            self.use_tmp_filter_path(Path(tmp_dir))
+            if self.package_selector:
+                # a batch must record the metadata transfer too
+                use_tmp = self.dry_run or batch is not None
+                metadata_dir = Path(tmp_dir) if use_tmp else self.dest_dir
+                self.logger.info("rsync metadata process start")
+                await self.run_rsync(self.prepare_metadata_rsync_cmd(metadata_dir))
+                await run_blocking(self.select_packages, metadata_dir)
+            filter_rules = self.filter_rules()
+            self.logger.info(
+                f"Write {len(filter_rules)} filter rules to {self.filter_path}")
+            write_filter_file(filter_rules, self.filter_path)
+            if self.peer_urls and not self.dry_run and batch is None:
+                await self.seed_from_peers()
+            if not self.dry_run and batch is None:
+                await self.sync_hot_paths(Path(tmp_dir))
+            self.logger.info("rsync process start")
+            try:
+                stats = await self.run_batch_rsync(batch)
+            except BaseException:
+                self.discard_batch(batch)
+                raise
+            self.record.stats.add(stats)
+            self.report_sources()
+        self.publish_batch(batch)
+        await self.rewrite_package_indexes()
+
+    def use_tmp_filter_path(self, tmp_dir: Path) -> None:
+        # a dry run leaves the working directory untouched
+        if self.dry_run:
+            self.filter_path = tmp_dir/self.filter_path.name
+
+    def prepare_http_transport(self, tmp_dir: Path) -> HttpTransport:
+        root = tmp_dir if self.dry_run else self.dest_dir
+        return HttpTransport(
+            base_url=f"{self.source_url}/{self.branch}/{BRANCH_SUBDIR}",
+            dest_dir=root/BRANCH_SUBDIR,
+            partial_dir=tmp_dir/".partial" if self.dry_run else self.partial_dir,
+            link_dest_dirs=[path/BRANCH_SUBDIR for path in self.link_dest_paths],
+            workers=self.http_workers,
+            timeout=self.io_timeout or None,
+            rate_limit=parse_rate_limit(self.rate_limit),
+            attempts=SYNC_ATTEMPTS,
+            dry_run=self.dry_run,
+            initializer=self.phase_priority["sync"].thread_initializer(),
+            logger=self.logger,
+        )
+
+    async def sync_over_http(self) -> None:
+        if self.fanout.get("role") == "primary":
+            self.logger.warning("rsync batches are not written for HTTP sources")
+        with TemporaryDirectory(prefix="sisyphus-mirror-") as tmp_dir:
+            self.use_tmp_filter_path(Path(tmp_dir))
+            transport = self.prepare_http_transport(Path(tmp_dir))
+            try:
+                async with asyncio.timeout(self.sync_timeout or None):
+                    await self.run_http_transfer(transport)
+            except TimeoutError as error:
+                msg = f"Synchronization timed out after {self.sync_timeout}s"
+                raise RuntimeError(msg) from error
+            finally:
+                transport.close()
+                self.record.retries += transport.retries
+            stats = transport.stats
+            self.logger.info(
+                f"HTTP transfer: {stats.files_transferred} of {stats.files} files, "
+                f"{format_size(stats.transferred_size)} of "
+                f"{format_size(stats.total_size)}")
+            self.record.stats.add(stats)
+            self.report_sources()
+        await self.rewrite_package_indexes()
+
+    async def run_http_transfer(self, transport: HttpTransport) -> None:
+        if self.peer_urls and not self.dry_run:
+            # before any download: rsync from a peer deletes unknown files
+            write_filter_file(self.filter_rules(), self.filter_path)
+            await self.seed_from_peers()
+        transfer = partial(run_blocking, on_cancel=transport.stop)
+        metadata_arch_list = self.part_arches(
+            [*self.arch_list, *self.proxy.get("lazy_arch_list", [])])
+        releases = [transport.release_file(arch) for arch in metadata_arch_list]
+        self.logger.info(f"HTTP metadata download from {transport.base_url}")
+        await transfer(partial(transport.sync, releases, metadata=True))
+        evaluator = FilterEvaluator(self.filter_rules())
+        metadata = [
+            remote for arch in metadata_arch_list
+            for remote in transport.release_files(arch)
+            if evaluator.is_included(f"{BRANCH_SUBDIR}/{remote.path}")
+        ]
+        await transfer(partial(transport.sync, metadata, metadata=True))
+
+        root = transport.dest_dir.parent
+        await run_blocking(self.select_packages, root)
+        packages = self.packages or await run_blocking(
+            read_branch_packages, root/BRANCH_SUBDIR, self.part_arches(self.arch_list))
+        filter_rules = self.filter_rules()
+        write_filter_file(filter_rules, self.filter_path)
+        evaluator = FilterEvaluator(filter_rules)
+        package_files = [
+            RemoteFile.from_package(package) for package in packages
+            if evaluator.is_included(f"{BRANCH_SUBDIR}/{package.path}")
+        ]
+        if hot_paths := self.load_hot_paths():
+            # the pool starts downloads in submission order
+            rank = {path: index for index, path in enumerate(hot_paths)}
+            package_files.sort(key=lambda remote: rank.get(remote.path, len(rank)))
+        extra_files, skipped = await run_blocking(
+            transport.include_files, self.include_files)
+        extra_files = [
+            remote for remote in extra_files
+            if evaluator.is_included(f"{BRANCH_SUBDIR}/{remote.path}")
+        ]
+        for pattern in skipped:
+            self.logger.warning(
+                f"Include pattern {pattern} skipped: no upstream directory listing")
+        self.logger.info(
+            f"HTTP download of {len(package_files)} packages "
+            f"with {transport.workers} connections")
+        await transfer(partial(transport.sync, package_files))
+        await transfer(partial(transport.sync, extra_files, optional=True))
+
+        if not self.dry_run:
+            wanted = {
+                remote.path
+                for remote in (*releases, *metadata, *package_files, *extra_files)
+            }
+            # files of skipped patterns may come from peers or link-dest
+            keep = FilterEvaluator([
+                *[FilterRule("+", pattern) for pattern in skipped],
+                FilterRule("-", "*"),
+            ])
+            for path in await run_blocking(
+                transport.prune,
+                wanted,
+                lambda relative: keep.matches(
+                    f"{BRANCH_SUBDIR}/{relative}", is_dir=False),
+            ):
+                self.logger.info(f"Delete {path}: not found upstream")
+
+    async def rewrite_package_indexes(self, *, reselect: bool = False) -> None:
+        if not self.package_selector or self.dry_run:
+            return
+        if reselect:
+            await run_blocking(self.select_packages, self.dest_dir)
+        rewritten = await run_blocking(
+            rewrite_indexes,
+            self.dest_dir/BRANCH_SUBDIR,
+            self.packages,
+            self.selected_packages or [],
+        )
+        for path in rewritten:
+            self.logger.info(f"Rewrite filtered package index {path}")
+
+    @property
+    def batch_filter_digest(self) -> str:
+        return filter_digest({
+            "exclude_files": self.exclude_files,
+            "include_files": self.include_files,
+            "arch_list": self.arch_list,
+            "package_filter": self.package_filter,
+            "lazy_arch_list": self.proxy.get("lazy_arch_list", []),
+        })
+
+    def prepare_batch(self) -> BatchInfo | None:
+        if (
+            self.batch_store is None or self.fanout.get("role") != "primary"
+            or self.dry_run
+        ):
+            return None
+        if any(self.dest_dir.iterdir()):
+            self.logger.warning(
+                f"{self.dest_dir} is not empty, skip writing a batch for replicas")
+            return None
+        current_snapshots = self.snapshot_map[self.branch]
+        batch = self.batch_store.new_batch(
+            self.branch,
+            current_snapshots[-1] if current_snapshots else None,
+            self.batch_filter_digest,
+        )
+        self.write_batch = self.batch_store.path(batch)
+        self.logger.info(f"Write rsync batch {self.write_batch} (base {batch.base})")
+        return batch
+
+    async def run_batch_rsync(self, batch: BatchInfo | None) -> TransferStats:
+        if batch is None:
+            return await self.run_rsync(self.prepare_rsync_cmd())
+        # a retry would record only the rest of the transfer, not the whole
+        # delta from the batch base, so it runs without a batch
+        try:
+            return await self.run_rsync(self.prepare_rsync_cmd(), attempts=1)
+        except RuntimeError:
+            self.logger.warning("rsync batch write failed, retry without a batch")
+            self.discard_batch(batch)
+        self.record.retries += 1
+        return await self.run_rsync(
+            self.prepare_rsync_cmd(), attempts=SYNC_ATTEMPTS - 1)
+
+    def publish_batch(self, batch: BatchInfo | None) -> None:
+        if self.batch_store is None or batch is None or self.write_batch is None:
+            return  # discarded
+        self.batch_store.publish(batch, self.filter_path)
+        self.write_batch = None
+        keep = self.fanout.get("keep_batches", DEFAULT_KEEP_BATCHES)
+        for expired in self.batch_store.prune(self.branch, keep):
+            self.logger.info(f"Delete old rsync batch {expired.name}")
+
+    def discard_batch(self, batch: BatchInfo | None) -> None:
+        if self.batch_store is None or batch is None:
+            return
+        self.batch_store.discard(batch)
+        self.write_batch = None
+
+    def prepare_read_batch_cmd(self, batch: BatchInfo) -> list[str]:
+        if self.batch_store is None:
+            msg = "Fan-out mode is not configured"
             raise RuntimeError(msg)
+        return [
+            "rsync",
+            "-rltmvH",
+            "--delete-delay",
+            "--delete-excluded",
+            "--stats",
+            "--chmod=Du+w",
+            f"--filter=merge {self.batch_store.path(batch, '.rules')}",
+            f"--read-batch={self.batch_store.path(batch)}",
+            *[f"--link-dest={link_dest}" for link_dest in self.link_dest_paths],
+            f"{self.dest_dir}/",
+        ]
+
+    async def apply_batch(self) -> bool:
+        if self.batch_store is None:
+            return False
+        current_snapshots = self.snapshot_map[self.branch]
+        batch = await run_blocking(
+            self.batch_store.find_applicable,
+            self.branch,
+            current_snapshots[-1] if current_snapshots else None,
+            self.batch_filter_digest,
+        )
+        if batch is None:
+            self.logger.warning(
+                "No rsync batch matches the base snapshot and filters, "
+                "fall back to a normal synchronization")
+            return False
+        if any(self.dest_dir.iterdir()):
+            self.logger.warning(
+                f"{self.dest_dir} is not empty, fall back to a normal synchronization")
+            return False
+        self.logger.info(f"Apply rsync batch {batch.name} (base {batch.base})")
+        try:
+            stats = await self.run_rsync(self.prepare_read_batch_cmd(batch), attempts=1)
+        except RuntimeError:
+            self.logger.warning(
+                f"rsync batch {batch.name} failed, "
+                "fall back to a normal synchronization")
+            return False
+        self.record.stats.add(stats)
+        return True
+
+    async def seed_from_peers(self) -> None:
+        for peer_url in self.peer_urls:
+            self.logger.info(f"rsync seeding from peer {peer_url} start")
+            try:
+                stats = await self.run_rsync(
+                    self.prepare_rsync_cmd(peer_url), attempts=1)
+            except RuntimeError:
+                self.logger.warning(f"Seeding from peer {peer_url} failed")
+                continue
+            self.record.peer_bytes[peer_url] = stats.bytes_received
+            return
+        self.logger.warning("No peer available, synchronize from upstream only")
+
+    def load_hot_paths(self) -> list[str]:
+        # written by analyze-logs, most requested first
+        if self.hot_list is None or not self.hot_list.exists():
+            return []
+        prefix = f"{self.branch}/{BRANCH_SUBDIR}/"
+        return [
+            line.removeprefix(prefix) for line in self.hot_list.read_text().splitlines()
+            if line.startswith(prefix)
+        ]
+
+    def prepare_hot_rsync_cmd(self, files_from: Path) -> list[str]:
+        rsync_cmd = [
+            "rsync",
+            "-ltH",
+            "--stats",
+            "--chmod=Du+w",
+            f"--filter=merge {self.filter_path}",
+            f"--files-from={files_from}",
+            "--ignore-missing-args",  # replaced package versions
+            *self.transfer_options(),
+            *[f"--link-dest={link_dest}" for link_dest in self.link_dest_paths],
+            f"--partial-dir={self.partial_dir}",
+            f"{self.source_url}/{self.branch}/",
+            f"{self.dest_dir}/",
+        ]
+        self.logger.debug(f"rsync command:\n{' \\\n    '.join(rsync_cmd)}")
+        return rsync_cmd
+
+    async def sync_hot_paths(self, tmp_dir: Path) -> None:
+        if not (hot_paths := self.load_hot_paths()):
+            return
+        files_from = tmp_dir/"hot-list"
+        files_from.write_text(
+            "".join(f"{BRANCH_SUBDIR}/{path}\n" for path in hot_paths))
+        self.logger.info(f"rsync of {len(hot_paths)} most requested paths start")
+        try:
+            stats = await self.run_rsync(
+                self.prepare_hot_rsync_cmd(files_from), attempts=1)
+        except RuntimeError:
+            self.logger.warning("Hot list transfer failed, continue with the full one")
+            return
+        self.record.stats.bytes_received += stats.bytes_received
+
+    def report_sources(self) -> None:
+        if not self.record.peer_bytes:
+            return
+        peer_bytes = sum(self.record.peer_bytes.values())
+        upstream_bytes = self.record.stats.bytes_received
+        for peer_url, received in self.record.peer_bytes.items():
+            self.logger.info(f"Received from peer {peer_url}: {format_size(received)}")
+        self.logger.info(
+            f"Received from upstream {self.source_url}: {format_size(upstream_bytes)} "
+            f"({peer_bytes / ((peer_bytes + upstream_bytes) or 1):.1%} "
+            "of the transfer served by peers)")
+
+    async def run_rsync(
+        self,
+        rsync_cmd: list[str],
+        attempts: int = SYNC_ATTEMPTS,
+    ) -> TransferStats:
+        sync_priority = self.phase_priority["sync"]
+        cgroup_procs = sync_priority.prepare_cgroup("sync", self.working_dir)
+        preexec_fn = sync_priority.child_preexec(cgroup_procs)
+        for attempt in range(1, attempts + 1):
+            output = RsyncOutput()
+            try:
+                async with asyncio.timeout(self.sync_timeout or None):
+                    returncode = await run_process(
+                        rsync_cmd,
+                        logger=self.logger,
+                        output=output.feed,
+                        preexec_fn=preexec_fn,
+                    )
+            except TimeoutError:
+                self.logger.warning(
+                    f"rsync attempt {attempt} timed out after {self.sync_timeout}s")
+                continue
+            if returncode == 0:
+                self.record.retries += attempt - 1
+                return output.stats
+            self.logger.warning(
+                f"rsync attempt {attempt} failed with exit code {returncode}")
+        self.record.retries += attempts - 1
+        msg = "Synchronization failed"
+        raise RuntimeError(msg)
 
     def complete_snapshot(self) -> None:
         if self.dest_dir.exists():
-            datetime_string = datetime.now().strftime("%Y%m%d%H%M%S%f")
-            self.new_snapshot = self.snapshots_dir/f"{self.branch}-{datetime_string}"
+            datetime_string = datetime.now().strftime(SNAPSHOT_DATETIME_FORMAT)
+            self.new_snapshot = self.snapshots_dir/f"{self.name}-{datetime_string}"
             self.logger.info(f"complete snapshot {self.new_snapshot}")
             self.dest_dir.rename(self.new_snapshot)
+            self.record.snapshot = self.new_snapshot.name
+
+    def warm_up_snapshot(self) -> None:
+        if not (self.warm_workers and self.warm_paths and self.new_snapshot):
+            return
+        files, warmed = warm_up(self.new_snapshot, self.warm_paths, self.warm_workers)
+        self.logger.info(
+            f"Page cache warmed: {files} files, {format_size(warmed)} "
+            f"from {self.new_snapshot}")
+
+    def cool_down_snapshot(self, old_snapshot: Path) -> None:
+        if not (
+            self.warm_workers and self.warm_paths and self.new_snapshot
+            and old_snapshot.exists()
+        ):
+            return
+        files, dropped = cool_down(old_snapshot, self.new_snapshot, self.warm_paths)
+        self.logger.info(
+            f"Page cache dropped: {files} files, {format_size(dropped)} "
+            f"from {old_snapshot}")
 
     def update_stable_link(self) -> None:
         self.logger.info(
@@ -223,8 +847,7 @@ class BranchMirror:
                 f"is not a last snapshot {last_snapshot}"
             )
             raise RuntimeError(msg)
-        relative_path = Path(".snapshots") / self.new_snapshot.name  # for rsyncd chroot
-        subprocess.run(["ln", "-nsf", relative_path, self.last_symlink], check=True)
+        publish_snapshot(self.working_dir, self.branch, self.new_snapshot)
 
     def delete_old_snapshots(self) -> None:
         if self.snapshot_limit < 1:
@@ -234,11 +857,116 @@ class BranchMirror:
             )
             raise ValueError(msg)
         oldest_first = self.snapshot_map[self.branch]
-        stop_delete = 0 - self.snapshot_limit  # negative stop index
-        snapshots_to_delete = oldest_first[:stop_delete]
+        snapshots_to_delete = self.retention_policy.select_expired(oldest_first)
         for dir_ in snapshots_to_delete:
             self.logger.info(f"Delete old snapshot: {dir_}")
             shutil.rmtree(dir_)
+        if self.part_store is not None:
+            self.part_store.delete_old_parts(self.snapshot_map[self.branch])
+
+    def free_space(self) -> None:
+        if not self.retention_policy.is_under_pressure(self.snapshots_dir):
+            return
+        accounting = UsageAccounting(working_dir=self.working_dir, logger=self.logger)
+        accounting.update()
+        candidates = {
+            snapshot.name: snapshot
+            for snapshots in self.snapshot_map.values()
+            for snapshot in snapshots[:-1]  # keep published snapshots
+        }
+        if self.part_store is not None:
+            candidates.update(
+                self.part_store.pressure_candidates(self.snapshot_map[self.branch]))
+        while candidates and self.retention_policy.is_under_pressure(
+            self.snapshots_dir,
+        ):
+            snapshot_usage, _ = accounting.compute()
+            name = select_pressure_victim(snapshot_usage, candidates)
+            self.logger.warning(
+                f"Low free space, delete snapshot: {candidates[name]} "
+                f"(exclusive bytes: {snapshot_usage[name].exclusive_bytes})")
+            shutil.rmtree(candidates.pop(name))
+            del accounting.snapshot_inodes[name]
+            # views linking a deleted part are broken
+            for view_name, view in list(candidates.items()):
+                if name in view_parts(view):
+                    self.logger.warning(f"Delete snapshot of a deleted part: {view}")
+                    shutil.rmtree(candidates.pop(view_name))
+                    del accounting.snapshot_inodes[view_name]
+        if self.retention_policy.is_under_pressure(self.snapshots_dir):
+            self.logger.warning(
+                "Free space target is not reached, no snapshots left to delete.")
+
+    @property
+    def part_list(self) -> list[str]:
+        return split_part_list([*self.arch_list, *self.proxy.get("lazy_arch_list", [])])
+
+    async def sync_parts(self) -> None:
+        for part in self.part_list:
+            part_mirror = replace(self, part=part)
+            if await part_mirror.is_part_current():
+                continue
+            self.logger.info(f"Part {part_mirror.name} synchronization started.")
+            await part_mirror.sync_part()
+            self.record.stats.add(part_mirror.record.stats)
+            self.record.retries += part_mirror.record.retries
+            for peer_url, received in part_mirror.record.peer_bytes.items():
+                self.record.peer_bytes[peer_url] = (
+                    self.record.peer_bytes.get(peer_url, 0) + received)
+
+    async def is_part_current(self) -> bool:
+        if self.part_store is None or self.part is None:
+            return False
+        if self.part_store.is_recent(self.part):
+            return True
+        if is_http_url(self.source_url):
+            return False  # no listing without rsync, rely on hard links
+        # listed before the first sync too, the next run compares with it
+        self.upstream_fingerprint = await self.list_upstream()
+        return self.part_store.is_unchanged(self.part, self.upstream_fingerprint)
+
+    async def sync_part(self) -> None:
+        if not self.dry_run:
+            self.check_or_make_subdirs()
+        await self.sync_with_source()
+        if self.dry_run or self.part_store is None or self.part is None:
+            return
+        self.complete_snapshot()
+        if self.new_snapshot is not None and self.upstream_fingerprint is not None:
+            self.part_store.save_fingerprint(
+                self.part, self.new_snapshot, self.upstream_fingerprint)
+
+    def prepare_list_cmd(self) -> list[str]:
+        rules = part_listing_rules(
+            self.part or COMMON_PART, self.exclude_files, self.filter_rules())
+        return [
+            "rsync",
+            "-r",
+            "--list-only",
+            *[f"--filter={rule}" for rule in rules],
+            *self.transfer_options(),
+            f"{self.source_url}/{self.branch}/{BRANCH_SUBDIR}",
+        ]
+
+    async def list_upstream(self) -> str | None:
+        fingerprint = await list_fingerprint(
+            self.prepare_list_cmd(), self.sync_timeout, self.logger)
+        if fingerprint is None:
+            self.logger.warning(f"Part {self.name}: upstream listing failed")
+        return fingerprint
+
+    def compose_view(self) -> bool:
+        if self.part_store is None:
+            return False
+        current_snapshots = self.snapshot_map[self.branch]
+        if not self.part_store.compose_view(
+            self.dest_dir,
+            self.part_list,
+            current_snapshots[-1] if current_snapshots else None,
+        ):
+            return False
+        self.complete_snapshot()
+        return True
 
     def unset_branch_lock(self) -> None:
         if self.flag.exists():
@@ -0,0 +1,305 @@
+import bz2
+import gzip
+import hashlib
+import lzma
+import os
+import re
+import struct
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+
+from sisyphus_mirror.units import parse_size
+
+HEADER_MAGIC = b"\x8e\xad\xe8\x01\x00\x00\x00\x00"
+HEADER_PREFIX = struct.Struct(">8sII")
+HEADER_ENTRY = struct.Struct(">IIII")
+
+RPM_INT32_TYPE = 4
+RPM_INT64_TYPE = 5
+RPM_STRING_TYPE = 6
+RPM_STRING_ARRAY_TYPE = 8
+RPM_I18NSTRING_TYPE = 9
+
+RPMTAG_NAME = 1000
+RPMTAG_SIZE = 1009
+RPMTAG_GROUP = 1016
+RPMTAG_PROVIDENAME = 1047
+RPMTAG_REQUIRENAME = 1049
+# apt-rpm extension tags written by genpkglist
+CRPMTAG_FILENAME = 1000000
+CRPMTAG_FILESIZE = 1000001
+CRPMTAG_MD5 = 1000005
+CRPMTAG_DIRECTORY = 1000010
+
+type CodecT = Callable[[bytes], bytes]
+
+# suffix -> (decompress, compress)
+PKGLIST_CODECS: dict[str, tuple[CodecT, CodecT]] = {
+    "": (bytes, bytes),
+    ".xz": (lzma.decompress, lzma.compress),
+    ".bz2": (bz2.decompress, bz2.compress),
+    ".gz": (gzip.decompress, partial(gzip.compress, mtime=0)),  # reproducible
+}
+RELEASE_HASHES = {
+    "MD5Sum": "md5",
+    "SHA1": "sha1",
+    "SHA256": "sha256",
+    "BLAKE2b": "blake2b",
+}
+RELEASE_HASH_STRENGTH = ("md5", "sha1", "sha256", "blake2b")
+
+
+@dataclass(frozen=True)
+class Package:
+    name: str
+    arch: str
+    component: str
+    directory: str
+    filename: str
+    group: str = ""
+    size: int = 0
+    md5: str = ""
+    requires: tuple[str, ...] = ()
+    provides: tuple[str, ...] = ()
+    header: bytes = field(default=b"", repr=False, compare=False)
+
+    @property
+    def path(self) -> str:
+        return f"{self.arch}/{self.directory}/{self.filename}"
+
+
+def iter_headers(data: bytes) -> Iterator[bytes]:
+    offset = 0
+    while offset < len(data):
+        magic, entries, data_size = HEADER_PREFIX.unpack_from(data, offset)
+        if magic != HEADER_MAGIC:
+            msg = f"Bad RPM header magic at offset {offset}"
+            raise ValueError(msg)
+        end = offset + HEADER_PREFIX.size + entries * HEADER_ENTRY.size + data_size
+        yield data[offset:end]
+        offset = end
+
+
+def parse_header(header: bytes) -> dict[int, list[str] | list[int]]:
+    _, entries, _ = HEADER_PREFIX.unpack_from(header)
+    store = HEADER_PREFIX.size + entries * HEADER_ENTRY.size
+    tags: dict[int, list[str] | list[int]] = {}
+    for index in range(entries):
+        tag, type_, offset, count = HEADER_ENTRY.unpack_from(
+            header, HEADER_PREFIX.size + index * HEADER_ENTRY.size)
+        position = store + offset
+        if type_ in (RPM_STRING_TYPE, RPM_STRING_ARRAY_TYPE, RPM_I18NSTRING_TYPE):
+            strings: list[str] = []
+            for _ in range(1 if type_ == RPM_STRING_TYPE else count):
+                end = header.index(b"\0", position)
+                strings.append(header[position:end].decode(errors="replace"))
+                position = end + 1
+            tags[tag] = strings
+        elif type_ == RPM_INT32_TYPE:
+            tags[tag] = list(struct.unpack_from(f">{count}I", header, position))
+        elif type_ == RPM_INT64_TYPE:
+            tags[tag] = list(struct.unpack_from(f">{count}Q", header, position))
+    return tags
+
+
+def read_pkglist_file(path: Path) -> bytes:
+    decompress, _ = PKGLIST_CODECS.get(path.suffix, PKGLIST_CODECS[""])
+    return decompress(path.read_bytes())
+
+
+def find_pkglists(base_dir: Path) -> dict[str, Path]:
+    # component name -> the cheapest pkglist file variant to read
+    pkglists: dict[str, Path] = {}
+    for suffix in PKGLIST_CODECS:
+        for path in sorted(base_dir.glob(f"pkglist.*{suffix}")):
+            component = path.name.removeprefix("pkglist.").removesuffix(suffix)
+            if "." not in component:
+                pkglists.setdefault(component, path)
+    return pkglists
+
+
+def tag_value(tags: dict[int, list[str] | list[int]], tag: int) -> str:
+    return str(tags[tag][0]) if tags.get(tag) else ""
+
+
+def read_packages(base_dir: Path, arch: str) -> list[Package]:
+    packages: list[Package] = []
+    for component, path in find_pkglists(base_dir).items():
+        for header in iter_headers(read_pkglist_file(path)):
+            tags = parse_header(header)
+            size = tag_value(tags, CRPMTAG_FILESIZE) or tag_value(tags, RPMTAG_SIZE)
+            packages.append(Package(
+                name=tag_value(tags, RPMTAG_NAME),
+                arch=arch,
+                component=component,
+                directory=tag_value(tags, CRPMTAG_DIRECTORY) or f"RPMS.{component}",
+                filename=tag_value(tags, CRPMTAG_FILENAME),
+                group=tag_value(tags, RPMTAG_GROUP),
+                size=int(size or 0),
+                md5=tag_value(tags, CRPMTAG_MD5),
+                requires=tuple(map(str, tags.get(RPMTAG_REQUIRENAME, []))),
+                provides=tuple(map(str, tags.get(RPMTAG_PROVIDENAME, []))),
+                header=header,
+            ))
+    return packages
+
+
+def read_branch_packages(branch_dir: Path, arch_list: Iterable[str]) -> list[Package]:
+    packages: list[Package] = []
+    for arch in arch_list:
+        packages.extend(read_packages(branch_dir/arch/"base", arch))
+    return packages
+
+
+@dataclass
+class PackageSelector:
+    include_names: list[str] = field(default_factory=list)
+    exclude_names: list[str] = field(default_factory=list)
+    exclude_groups: list[str] = field(default_factory=list)
+    max_size: int | str = 0  # 0 - unlimited
+    closure_of: list[str] = field(default_factory=list)
+    closure_of_file: Path | None = None
+
+    def __post_init__(self) -> None:
+        self.include_re = [re.compile(pattern) for pattern in self.include_names]
+        self.exclude_re = [re.compile(pattern) for pattern in self.exclude_names]
+        self.max_bytes = parse_size(self.max_size)
+        self.closure_seeds = set(self.closure_of)
+        if self.closure_of_file:
+            self.closure_seeds.update(
+                line.strip() for line in self.closure_of_file.read_text().splitlines()
+                if line.strip() and not line.startswith("#"))
+
+    def is_excluded(self, package: Package) -> bool:
+        return (
+            any(regex.search(package.name) for regex in self.exclude_re)
+            or any(
+                package.group == group or package.group.startswith(f"{group}/")
+                for group in self.exclude_groups
+            )
+            or bool(self.max_bytes and package.size > self.max_bytes)
+        )
+
+    def select(self, packages: list[Package]) -> list[Package]:
+        if self.include_re or self.closure_seeds:
+            # included packages bring their dependencies, as closure_of ones do
+            seeds = self.closure_seeds | {
+                package.name for package in packages
+                if any(regex.search(package.name) for regex in self.include_re)
+            }
+            selected = dependency_closure(packages, seeds)
+        else:
+            selected = set(packages)
+        return [
+            package for package in packages
+            if package in selected and not self.is_excluded(package)
+        ]
+
+
+def dependency_closure(packages: list[Package], seeds: set[str]) -> set[Package]:
+    providers: dict[str, list[Package]] = {}
+    for package in packages:
+        for capability in (package.name, *package.provides):
+            providers.setdefault(capability, []).append(package)
+
+    selected: set[Package] = set()
+    queue = [package for package in packages if package.name in seeds]
+    while queue:
+        package = queue.pop()
+        if package in selected:
+            continue
+        selected.add(package)
+        for capability in package.requires:
+            if capability.startswith("rpmlib("):
+                continue
+            queue.extend(providers.get(capability, []))
+    return selected
+
+
+def rewrite_indexes(
+    branch_dir: Path,
+    packages: list[Package],
+    selected: list[Package],
+) -> list[Path]:
+    selected_set = set(selected)
+    components = sorted({(package.arch, package.component) for package in packages})
+    rewritten: list[Path] = []
+    for arch in sorted({arch for arch, _ in components}):
+        base_dir = branch_dir/arch/"base"
+        arch_rewritten: list[Path] = []
+        for component in [name for arch_, name in components if arch_ == arch]:
+            component_packages = [
+                package for package in packages
+                if (package.arch, package.component) == (arch, component)
+            ]
+            kept = [
+                package for package in component_packages if package in selected_set]
+            if len(kept) == len(component_packages):
+                continue  # keep upstream files untouched
+            content = b"".join(package.header for package in kept)
+            for suffix, (_, compress) in PKGLIST_CODECS.items():
+                variant = base_dir/f"pkglist.{component}{suffix}"
+                if variant.exists():
+                    replace_file(variant, compress(content))
+                    arch_rewritten.append(variant)
+        update_release(base_dir/"release", arch_rewritten)
+        rewritten.extend(arch_rewritten)
+    return rewritten
+
+
+@dataclass(frozen=True)
+class ReleaseEntry:
+    size: int
+    hash_name: str
+    digest: str
+
+
+def read_release(release_path: Path) -> dict[str, ReleaseEntry]:
+    # "base/pkglist.classic" -> the strongest checksum listed for it
+    entries: dict[str, ReleaseEntry] = {}
+    hash_name = None
+    for line in release_path.read_text().splitlines():
+        if not line.startswith(" "):
+            hash_name = RELEASE_HASHES.get(line.split(":", 1)[0])
+            continue
+        fields = line.split()
+        if not hash_name or len(fields) != 3:  # noqa: PLR2004
+            continue
+        known = entries.get(fields[2])
+        if known is None or (
+            RELEASE_HASH_STRENGTH.index(hash_name)
+            > RELEASE_HASH_STRENGTH.index(known.hash_name)
+        ):
+            entries[fields[2]] = ReleaseEntry(int(fields[1]), hash_name, fields[0])
+    return entries
+
+
+def replace_file(path: Path, content: bytes) -> None:
+    # never write in place: the inode may be hard-linked to older snapshots
+    stat = path.stat()
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_bytes(content)
+    # the upstream mtime keeps rewritten trees identical between replicas
+    os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    tmp_path.replace(path)
+
+
+def update_release(release_path: Path, changed: list[Path]) -> None:
+    if not release_path.exists() or not changed:
+        return
+    changed_map = {
+        f"{path.parent.name}/{path.name}": path.read_bytes() for path in changed}
+    lines = release_path.read_text().splitlines(keepends=True)
+    hash_name = None
+    for index, line in enumerate(lines):
+        if not line.startswith(" "):
+            hash_name = RELEASE_HASHES.get(line.split(":", 1)[0])
+            continue
+        fields = line.split()
+        if hash_name and len(fields) == 3 and fields[2] in changed_map:  # noqa: PLR2004
+            content = changed_map[fields[2]]
+            digest = hashlib.new(hash_name, content).hexdigest()
+            lines[index] = f" {digest} {len(content)} {fields[2]}\n"
+    replace_file(release_path, "".join(lines).encode())
@@ -0,0 +1,165 @@
+import ctypes
+import errno
+import os
+import platform
+from collections.abc import Callable
+from contextlib import suppress
+from dataclasses import dataclass
+from functools import cache
+from logging import Logger
+from pathlib import Path
+
+from sisyphus_mirror.logger import get_logger
+from sisyphus_mirror.typedefs import IOClassT
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+CGROUP_MAIN_LEAF = "sisyphus-mirror"
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASSES: dict[IOClassT, int] = {
+    "none": 0,
+    "realtime": 1,
+    "best-effort": 2,
+    "idle": 3,
+}
+IOPRIO_SET_SYSCALLS = {
+    "aarch64": 30,
+    "armv7l": 314,
+    "i686": 289,
+    "loongarch64": 30,
+    "ppc64le": 273,
+    "riscv64": 30,
+    "s390x": 282,
+    "x86_64": 251,
+}
+
+
+@cache
+def get_ioprio_setter() -> Callable[[int], int]:
+    # resolved in the parent, a forked child must not call the dynamic loader
+    number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if number is None:
+        msg = f"ioprio_set is not supported on {platform.machine()}"
+        raise OSError(errno.ENOSYS, msg)
+    syscall = ctypes.CDLL(None, use_errno=True).syscall
+
+    def ioprio_set(value: int) -> int:
+        # who 0 - the calling thread
+        return int(syscall(number, IOPRIO_WHO_PROCESS, 0, value))
+
+    return ioprio_set
+
+
+def set_ioprio(value: int) -> None:
+    if get_ioprio_setter()(value) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+def current_cgroup() -> Path | None:
+    for line in Path("/proc/self/cgroup").read_text().splitlines():
+        if line.startswith("0::"):
+            return CGROUP_ROOT/line.removeprefix("0::").lstrip("/")
+    return None
+
+
+def block_device(path: Path) -> str:
+    st_dev = path.stat().st_dev
+    device = f"{os.major(st_dev)}:{os.minor(st_dev)}"
+    sys_block = Path("/sys/dev/block")/device
+    if (sys_block/"partition").exists():
+        # io.max accepts whole disks only
+        return (sys_block.resolve().parent/"dev").read_text().strip()
+    return device
+
+
+@dataclass
+class PhasePriority:
+    nice: int | None = None
+    io_class: IOClassT | None = None
+    io_level: int = 4
+    cpu_weight: int | None = None
+    io_max: str | None = None
+    logger: Logger = get_logger(__name__)
+
+    @property
+    def ioprio(self) -> int | None:
+        if self.io_class is None:
+            return None
+        level = self.io_level if self.io_class in ("best-effort", "realtime") else 0
+        return (IOPRIO_CLASSES[self.io_class] << IOPRIO_CLASS_SHIFT) | level
+
+    def apply(self) -> None:
+        # affects the calling thread only, threads it starts inherit it
+        try:
+            if self.nice is not None:
+                os.setpriority(os.PRIO_PROCESS, 0, self.nice)
+            if (ioprio := self.ioprio) is not None:
+                set_ioprio(ioprio)
+        except OSError as error:
+            self.logger.warning(f"Cannot set scheduling priority: {error}")
+
+    def thread_initializer(self) -> Callable[[], None] | None:
+        if self.nice is None and self.io_class is None:
+            return None
+        return self.apply
+
+    def prepare_cgroup(self, phase: str, device_path: Path) -> Path | None:
+        if self.cpu_weight is None and not self.io_max:
+            return None
+        try:
+            if (cgroup := current_cgroup()) is None:
+                self.logger.warning("Not a cgroup v2 hierarchy, skip cgroup limits.")
+                return None
+            if cgroup.name == CGROUP_MAIN_LEAF:
+                cgroup = cgroup.parent
+            if not os.access(cgroup/"cgroup.procs", os.W_OK):
+                self.logger.warning(
+                    f"cgroup {cgroup} is not delegated, skip cgroup limits.")
+                return None
+            # no internal processes rule: move ourselves into a leaf first
+            main_leaf = cgroup/CGROUP_MAIN_LEAF
+            main_leaf.mkdir(exist_ok=True)
+            (main_leaf/"cgroup.procs").write_text(f"{os.getpid()}\n")
+            (cgroup/"cgroup.subtree_control").write_text("+cpu +io\n")
+
+            phase_cgroup = cgroup/f"{CGROUP_MAIN_LEAF}-{phase}"
+            phase_cgroup.mkdir(exist_ok=True)
+            if self.cpu_weight is not None:
+                (phase_cgroup/"cpu.weight").write_text(f"{self.cpu_weight}\n")
+            if self.io_max:
+                (phase_cgroup/"io.max").write_text(
+                    f"{block_device(device_path)} {self.io_max}\n")
+        except OSError as error:
+            self.logger.warning(f"Cannot prepare cgroup for {phase}: {error}")
+            return None
+        return phase_cgroup/"cgroup.procs"
+
+    def child_preexec(
+        self,
+        cgroup_procs: Path | None = None,
+    ) -> Callable[[], None] | None:
+        if self.nice is None and self.ioprio is None and cgroup_procs is None:
+            return None
+        nice, ioprio = self.nice, self.ioprio
+        ioprio_setter = None
+        if ioprio is not None:
+            try:
+                ioprio_setter = get_ioprio_setter()
+            except OSError as error:
+                self.logger.warning(f"Cannot set I/O priority: {error}")
+
+        def preexec() -> None:
+            # runs in the forked child: no logging, errors are ignored
+            if nice is not None:
+                with suppress(OSError):
+                    os.setpriority(os.PRIO_PROCESS, 0, nice)
+            if ioprio_setter is not None and ioprio is not None:
+                ioprio_setter(ioprio)
+            if cgroup_procs is not None:
+                with suppress(OSError):
+                    fd = os.open(cgroup_procs, os.O_WRONLY)
+                    os.write(fd, b"0\n")  # "0" - the writing process
+                    os.close(fd)
+
+        return preexec
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import signal
+from collections.abc import Callable, Coroutine, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from functools import partial
+from logging import Logger
+from typing import Any
+
+from sisyphus_mirror.logger import get_logger
+
+PROCESS_KILL_TIMEOUT = 30
+OUTPUT_CHUNK_SIZE = 64 * 1024
+CANCEL_SIGNALS = (signal.SIGTERM, signal.SIGHUP)
+
+
+async def run_process(
+    cmd: Sequence[str],
+    *,
+    logger: Logger = get_logger(__name__),
+    output: Callable[[bytes], None] | None = None,
+    **kwargs: Any,
+) -> int:
+    if output is not None:
+        kwargs["stdout"] = asyncio.subprocess.PIPE
+    # own session and process group, so the whole tree can be stopped
+    process = await asyncio.create_subprocess_exec(
+        *cmd, start_new_session=True, **kwargs)
+    logger.debug(f"Process {process.pid} started: {cmd[0]}")
+    try:
+        if output is not None and process.stdout is not None:
+            while chunk := await process.stdout.read(OUTPUT_CHUNK_SIZE):
+                output(chunk)
+        return await process.wait()
+    except asyncio.CancelledError:  # also raised by asyncio.timeout()
+        logger.warning(f"Process {process.pid} interrupted, terminate its group.")
+        await terminate_process_group(process)
+        raise
+
+
+async def terminate_process_group(
+    process: asyncio.subprocess.Process,
+    kill_timeout: float = PROCESS_KILL_TIMEOUT,
+) -> None:
+    with suppress(ProcessLookupError):
+        os.killpg(process.pid, signal.SIGTERM)
+        with suppress(TimeoutError):
+            await asyncio.wait_for(process.wait(), kill_timeout)
+        # leftovers of the group, including a leader that ignored SIGTERM
+        os.killpg(process.pid, signal.SIGKILL)
+    await process.wait()
+
+
+async def run_blocking[T](
+    func: Callable[..., T],
+    *args: Any,
+    initializer: Callable[[], None] | None = None,
+    on_cancel: Callable[[], None] | None = None,
+) -> T:
+    # a thread with an initializer is not reused: its priority may be changed
+    executor = ThreadPoolExecutor(1, initializer=initializer) if initializer else None
+    future = asyncio.get_running_loop().run_in_executor(executor, partial(func, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        # a thread cannot be interrupted, wait for it before any cleanup
+        if on_cancel is not None:
+            on_cancel()  # asks a cooperative function to return early
+        await future
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+async def cancel_on_signals[T](coro: Coroutine[Any, Any, T]) -> T:
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    if task is None:
+        return await coro
+    for sig in CANCEL_SIGNALS:
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        return await coro
+    finally:
+        for sig in CANCEL_SIGNALS:
+            loop.remove_signal_handler(sig)
@@ -0,0 +1,318 @@
+import os
+import posixpath
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import suppress
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import Logger
+from pathlib import Path, PurePosixPath
+from typing import Any, BinaryIO, Unpack
+from urllib.error import HTTPError
+from urllib.parse import quote, unquote, urlsplit
+from urllib.request import Request, urlopen
+from urllib.response import addinfourl
+
+from sisyphus_mirror.consts import (
+    DEFAULT_HOME_PATH,
+    DEFAULT_IO_TIMEOUT,
+    DEFAULT_PROXY_BIND,
+    DEFAULT_PROXY_CACHE_SIZE,
+    DEFAULT_PROXY_PORT,
+    DEFAULT_PROXY_UPSTREAM,
+)
+from sisyphus_mirror.logger import get_logger
+from sisyphus_mirror.typedefs import RepoMirrorKW
+from sisyphus_mirror.units import format_size, parse_size
+
+CACHE_SUBDIR = ".cache"
+COPY_CHUNK_SIZE = 1024 * 1024
+REVALIDATE_INTERVAL = 60  # seconds between upstream checks of a mutable file
+
+
+def is_immutable(relative: str) -> bool:
+    # a package file never changes under its name, indexes and lists do
+    return relative.endswith(".rpm")
+
+
+def is_directory_response(url: str, response: addinfourl) -> bool:
+    # a redirect to "{url}/" or an index page instead of a file
+    content_type = response.headers.get("Content-Type", "")
+    return response.geturl() != url or content_type.startswith("text/html")
+
+
+def normalize_request_path(request_path: str) -> str | None:
+    path = unquote(urlsplit(request_path).path)
+    if path.endswith("/"):
+        return None  # directory listings are not cached
+    # normpath of an absolute path drops all ".." components
+    normalized = posixpath.normpath(f"/{path}").lstrip("/")
+    if not normalized or normalized.startswith("."):
+        return None  # the root or working files: .snapshots, .cache, ...
+    return normalized
+
+
+class PullThroughCache:
+    def __init__(
+        self,
+        cache_dir: Path,
+        upstream_url: str,
+        max_bytes: int,
+        timeout: float | None = DEFAULT_IO_TIMEOUT,
+        logger: Logger = get_logger(__name__),
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.upstream_url = upstream_url.rstrip("/")
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, int] = OrderedDict()  # least recent first
+        self.total_bytes = 0
+        self.fetch_locks: dict[str, threading.Lock] = {}
+        self.validated: dict[str, float] = {}  # monotonic time of the last check
+
+    def load(self) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        found: list[tuple[float, str, int]] = []
+        for path in self.cache_dir.rglob("*"):
+            if path.is_file() and not path.name.startswith("."):
+                stat = path.stat()
+                relative = path.relative_to(self.cache_dir).as_posix()
+                found.append((stat.st_atime, relative, stat.st_size))
+            elif path.name.startswith(".") and path.name.endswith(".part"):
+                path.unlink()  # interrupted download
+        with self.lock:
+            self.entries.clear()
+            for _, relative, size in sorted(found):
+                self.entries[relative] = size
+            self.total_bytes = sum(self.entries.values())
+        self.logger.info(
+            f"Cache {self.cache_dir}: {len(self.entries)} files, "
+            f"{format_size(self.total_bytes)}")
+        self.evict()  # cache_size may have been reduced
+
+    def lookup(self, relative: str) -> Path | None:
+        with self.lock:
+            if relative not in self.entries:
+                return None
+            if not is_immutable(relative) and (
+                relative not in self.validated
+                or time.monotonic() - self.validated[relative] >= REVALIDATE_INTERVAL
+            ):
+                return None
+            self.entries.move_to_end(relative)
+        return self.cache_dir/relative
+
+    def get(self, relative: str) -> Path:
+        if path := self.lookup(relative):
+            return path
+        with self.lock:
+            fetch_lock = self.fetch_locks.setdefault(relative, threading.Lock())
+        # concurrent requests for one file wait for a single download
+        with fetch_lock:
+            try:
+                if path := self.lookup(relative):
+                    return path
+                return self.fetch(relative)
+            finally:
+                with self.lock:
+                    self.fetch_locks.pop(relative, None)
+
+    def fetch(self, relative: str) -> Path:
+        path = self.cache_dir/relative
+        if path.is_dir():
+            raise IsADirectoryError(relative)
+        with self.lock:
+            cached = path if relative in self.entries else None
+        tmp_path = path.with_name(f".{path.name}.part")
+        self.remove_parent_files(relative)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        url = f"{self.upstream_url}/{quote(relative)}"
+        self.logger.info(f"Revalidate {url}" if cached else f"Cache miss, fetch {url}")
+        try:
+            self.download(url, relative, tmp_path, cached)
+            tmp_path.replace(path)
+        except HTTPError as error:
+            tmp_path.unlink(missing_ok=True)
+            if cached is not None and error.code == HTTPStatus.NOT_MODIFIED:
+                return self.store(relative)
+            if error.code == HTTPStatus.NOT_FOUND:
+                self.discard(relative)  # removed upstream
+                raise FileNotFoundError(relative) from error
+            raise
+        except OSError as error:
+            tmp_path.unlink(missing_ok=True)
+            if cached is None or isinstance(error, IsADirectoryError):
+                raise
+            self.logger.warning(f"Revalidation of {relative} failed, serve cached")
+            return cached
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return self.store(relative)
+
+    def store(self, relative: str) -> Path:
+        path = self.cache_dir/relative
+        size = path.stat().st_size
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(relative, 0)
+            self.entries[relative] = size
+            if not is_immutable(relative):
+                self.validated[relative] = time.monotonic()
+        self.evict()
+        return path
+
+    def discard(self, relative: str) -> None:
+        with self.lock:
+            if (size := self.entries.pop(relative, None)) is not None:
+                self.total_bytes -= size
+            self.validated.pop(relative, None)
+        (self.cache_dir/relative).unlink(missing_ok=True)
+
+    def download(
+        self,
+        url: str,
+        relative: str,
+        tmp_path: Path,
+        cached: Path | None = None,
+    ) -> None:
+        headers: dict[str, str] = {}
+        if cached is not None:
+            headers["If-Modified-Since"] = formatdate(
+                cached.stat().st_mtime, usegmt=True)
+        request = Request(url, headers=headers)  # noqa: S310
+        with urlopen(request, timeout=self.timeout) as response:  # noqa: S310
+            if is_directory_response(url, response):
+                raise IsADirectoryError(relative)
+            with tmp_path.open("wb") as file:
+                shutil.copyfileobj(response, file, COPY_CHUNK_SIZE)
+            last_modified = response.headers.get("Last-Modified")
+        if last_modified:
+            with suppress(TypeError, ValueError):
+                modified = parsedate_to_datetime(last_modified).timestamp()
+                os.utime(tmp_path, (time.time(), modified))
+
+    def remove_parent_files(self, relative: str) -> None:
+        # a file cached where a directory is needed now, e.g. an index page
+        for parent in reversed(PurePosixPath(relative).parents[:-1]):
+            parent_path = self.cache_dir/parent
+            if parent_path.is_dir():
+                continue
+            if not parent_path.exists():
+                return
+            self.logger.warning(f"Remove cached file in place of directory: {parent}")
+            self.discard(parent.as_posix())
+            parent_path.unlink(missing_ok=True)
+            return
+
+    def evict(self) -> None:
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes or len(self.entries) <= 1:
+                    return
+                # the newest entry is never evicted, it is being served
+                relative, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                self.validated.pop(relative, None)
+            self.logger.info(f"Cache full, evict {relative} ({format_size(size)})")
+            (self.cache_dir/relative).unlink(missing_ok=True)
+
+
+class ProxyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        working_dir: Path,
+        cache: PullThroughCache,
+        logger: Logger = get_logger(__name__),
+    ) -> None:
+        super().__init__(address, ProxyRequestHandler)
+        self.working_dir = working_dir
+        self.cache = cache
+        self.logger = logger
+
+
+class ProxyRequestHandler(BaseHTTPRequestHandler):
+    server: ProxyServer
+    server_version = "sisyphus-mirror"
+
+    def do_GET(self) -> None:
+        self.send_file(with_body=True)
+
+    def do_HEAD(self) -> None:
+        self.send_file(with_body=False)
+
+    def open_file(self, relative: str) -> BinaryIO:
+        local_path = self.server.working_dir/relative
+        if local_path.is_file() and local_path.resolve().is_relative_to(
+            self.server.working_dir.resolve(),
+        ):
+            return local_path.open("rb")  # published snapshot
+        path = self.server.cache.get(relative)
+        try:
+            return path.open("rb")
+        except FileNotFoundError:
+            # evicted by another request between the lookup and the open
+            return self.server.cache.get(relative).open("rb")
+
+    def send_file(self, *, with_body: bool) -> None:
+        if (relative := normalize_request_path(self.path)) is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        try:
+            file = self.open_file(relative)
+        except (FileNotFoundError, IsADirectoryError):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        except OSError as error:
+            self.server.logger.warning(f"Upstream fetch of {relative} failed: {error}")
+            self.send_error(HTTPStatus.BAD_GATEWAY)
+            return
+        with file:
+            stat = os.fstat(file.fileno())
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(stat.st_size))
+            self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+            self.end_headers()
+            if with_body:
+                shutil.copyfileobj(file, self.wfile, COPY_CHUNK_SIZE)
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        self.server.logger.debug(f"{self.address_string()} {format % args}")
+
+
+def make_proxy_server(**kwargs: Unpack[RepoMirrorKW]) -> ProxyServer:
+    logger = kwargs.get("logger", get_logger(__name__))
+    working_dir = kwargs.get("working_dir", DEFAULT_HOME_PATH)
+    proxy = kwargs.get("proxy", {})
+    cache = PullThroughCache(
+        cache_dir=working_dir/CACHE_SUBDIR,
+        upstream_url=proxy.get("upstream_url", DEFAULT_PROXY_UPSTREAM),
+        max_bytes=parse_size(proxy.get("cache_size", DEFAULT_PROXY_CACHE_SIZE)),
+        timeout=kwargs.get("io_timeout", DEFAULT_IO_TIMEOUT) or None,
+        logger=logger,
+    )
+    cache.load()
+    address = (
+        proxy.get("bind", DEFAULT_PROXY_BIND),
+        proxy.get("port", DEFAULT_PROXY_PORT),
+    )
+    return ProxyServer(address, working_dir, cache, logger)
+
+
+def serve(**kwargs: Unpack[RepoMirrorKW]) -> None:
+    server = make_proxy_server(**kwargs)
+    host, port = server.server_address[:2]
+    server.logger.info(f"Serving {server.working_dir} on http://{host!s}:{port}")
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.logger.info("Serving stopped")
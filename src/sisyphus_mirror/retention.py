@@ -0,0 +1,95 @@
+import os
+from collections.abc import Collection
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sisyphus_mirror.consts import DEFAULT_SNAPSHOTS_LIMIT
+from sisyphus_mirror.snapshots import snapshot_datetime
+from sisyphus_mirror.units import parse_size
+from sisyphus_mirror.usage import UsageStats
+
+PERIOD_FORMATS = {
+    "keep_daily": "%Y-%m-%d",
+    "keep_weekly": "%G-%V",
+    "keep_monthly": "%Y-%m",
+}
+
+
+@dataclass
+class RetentionPolicy:
+    keep_last: int = DEFAULT_SNAPSHOTS_LIMIT
+    keep_daily: int = 0
+    keep_weekly: int = 0
+    keep_monthly: int = 0
+    max_age_days: int = 0  # 0 - unlimited
+    min_free_space: int | str = 0
+    min_free_inodes: int = 0
+
+    def __post_init__(self) -> None:
+        self.min_free_bytes = parse_size(self.min_free_space)
+
+    def select_expired(
+        self,
+        oldest_first: list[Path],
+        now: datetime | None = None,
+    ) -> list[Path]:
+        if not oldest_first:
+            return []
+        newest_first = oldest_first[::-1]
+
+        keep = set(newest_first[:self.keep_last])
+        for rule, period_format in PERIOD_FORMATS.items():
+            keep.update(select_periodic(
+                newest_first, getattr(self, rule), period_format))
+
+        if self.max_age_days:
+            min_datetime = (now or datetime.now()) - timedelta(days=self.max_age_days)
+            keep = {
+                snapshot for snapshot in keep
+                if snapshot_datetime(snapshot) >= min_datetime
+            }
+
+        keep.add(newest_first[0])  # published snapshot
+        return [snapshot for snapshot in oldest_first if snapshot not in keep]
+
+    def is_under_pressure(self, path: Path) -> bool:
+        if not (self.min_free_bytes or self.min_free_inodes):
+            return False
+        stat = os.statvfs(path)
+        return (
+            stat.f_bavail * stat.f_frsize < self.min_free_bytes
+            or stat.f_favail < self.min_free_inodes
+        )
+
+
+def select_periodic(
+    newest_first: list[Path],
+    count: int,
+    period_format: str,
+) -> list[Path]:
+    selected: list[Path] = []
+    seen_periods: set[str] = set()
+    for snapshot in newest_first:
+        if len(seen_periods) >= count:
+            break
+        period = snapshot_datetime(snapshot).strftime(period_format)
+        if period not in seen_periods:
+            seen_periods.add(period)
+            selected.append(snapshot)
+    return selected
+
+
+def select_pressure_victim(
+    snapshot_usage: dict[str, UsageStats],
+    candidates: Collection[str],
+) -> str:
+    # the snapshot whose deletion frees the most bytes, the oldest on a tie
+    return min(
+        candidates,
+        key=lambda name: (
+            -snapshot_usage[name].exclusive_bytes,
+            snapshot_datetime(Path(name)),
+            name,
+        ),
+    )
@@ -0,0 +1,29 @@
+from datetime import datetime
+from pathlib import Path
+
+SNAPSHOTS_SUBDIR = ".snapshots"
+BRANCH_SUBDIR = "branch"  # upstream {branch}/branch directory inside a snapshot
+SNAPSHOT_DATETIME_FORMAT = "%Y%m%d%H%M%S%f"
+
+
+def find_snapshots(working_dir: Path, name: str) -> list[Path]:
+    # a branch or a part of it with split_arch: "p11", "p11.noarch"
+    branch_snapshots = [
+        path for path in working_dir.glob(f"{SNAPSHOTS_SUBDIR}/{name}-*")
+        if path.is_dir() and path.name.removeprefix(f"{name}-").isdigit()
+    ]
+    return sorted(branch_snapshots)  # oldest first
+
+
+def snapshot_datetime(snapshot: Path) -> datetime:
+    datetime_string = snapshot.name.rsplit("-", 1)[-1]
+    return datetime.strptime(datetime_string, SNAPSHOT_DATETIME_FORMAT)  # noqa: DTZ007
+
+
+def publish_snapshot(working_dir: Path, branch: str, snapshot: Path) -> None:
+    last_symlink = working_dir/branch
+    relative_path = Path(SNAPSHOTS_SUBDIR)/snapshot.name  # for rsyncd chroot
+    tmp_symlink = last_symlink.with_name(f".{branch}.tmp")
+    tmp_symlink.unlink(missing_ok=True)
+    tmp_symlink.symlink_to(relative_path)
+    tmp_symlink.replace(last_symlink)  # atomic for clients
@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import json
+import shutil
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from logging import Logger
+from pathlib import Path
+from typing import Literal
+
+from sisyphus_mirror.consts import (
+    ARCH_LIST,
+    COMMON_PART,
+    DEFAULT_PART_KEEP_LAST,
+    DEFAULT_PART_MIN_INTERVAL,
+    SPLIT_PART_LIST,
+)
+from sisyphus_mirror.filters import FilterRule
+from sisyphus_mirror.logger import get_logger
+from sisyphus_mirror.process import run_process
+from sisyphus_mirror.retention import RetentionPolicy
+from sisyphus_mirror.snapshots import BRANCH_SUBDIR, find_snapshots, snapshot_datetime
+from sisyphus_mirror.typedefs import ArchT, SplitArchKW
+
+
+def split_part_list(arch_list: list[ArchT]) -> list[str]:
+    return [COMMON_PART, *dict.fromkeys(arch_list)]
+
+
+def part_filter_rules(part: str | None) -> list[FilterRule]:
+    if part is None:
+        return []
+    if part == COMMON_PART:
+        return [FilterRule("-", f"/{BRANCH_SUBDIR}/{arch}/") for arch in ARCH_LIST]
+    return [
+        FilterRule("+", f"/{BRANCH_SUBDIR}/"),
+        FilterRule("+", f"/{BRANCH_SUBDIR}/{part}/"),
+        FilterRule("-", f"/{BRANCH_SUBDIR}/*"),
+    ]
+
+
+def part_listing_rules(
+    part: str,
+    exclude_files: list[str],
+    filter_rules: list[FilterRule],
+) -> list[FilterRule]:
+    # an arch part changes with its base/ metadata, the common part is small
+    if part == COMMON_PART:
+        return filter_rules
+    return [
+        *[FilterRule("-", pattern) for pattern in exclude_files],
+        *part_filter_rules(part),
+        FilterRule("+", f"/{BRANCH_SUBDIR}/{part}/base/***"),
+        FilterRule("-", "*"),
+    ]
+
+
+async def list_fingerprint(
+    list_cmd: list[str],
+    sync_timeout: int,
+    logger: Logger = get_logger(__name__),
+) -> str | None:
+    digest = hashlib.sha256()
+    try:
+        async with asyncio.timeout(sync_timeout or None):
+            returncode = await run_process(
+                list_cmd, logger=logger, output=digest.update)
+    except TimeoutError:
+        returncode = None
+    return digest.hexdigest() if returncode == 0 else None
+
+
+def view_parts(view: Path) -> set[str]:
+    # part snapshot names the symlinks of a view point to
+    branch_dir = view/BRANCH_SUBDIR
+    if not branch_dir.is_dir():
+        return set()
+    return {
+        next(part for part in entry.readlink().parts if part != "..")
+        for entry in branch_dir.iterdir() if entry.is_symlink()
+    }
+
+
+@dataclass
+class PartStore:
+    working_dir: Path
+    branch: str
+    split_arch: SplitArchKW
+    logger: Logger = get_logger(__name__)
+
+    def name(self, part: str) -> str:
+        return f"{self.branch}.{part}"
+
+    def option(
+        self,
+        part: str,
+        key: Literal["min_interval", "keep_last"],
+        default: int,
+    ) -> int:
+        for part_options in self.split_arch.get("parts", []):
+            if part_options["name"] == part and key in part_options:
+                return part_options[key]
+        return self.split_arch.get(key, default)
+
+    def latest(self, part: str) -> Path | None:
+        part_snapshots = find_snapshots(self.working_dir, self.name(part))
+        return part_snapshots[-1] if part_snapshots else None
+
+    def is_recent(self, part: str) -> bool:
+        if (latest := self.latest(part)) is None:
+            return False
+        min_interval = self.option(part, "min_interval", DEFAULT_PART_MIN_INTERVAL)
+        if datetime.now() - snapshot_datetime(latest) >= timedelta(
+            minutes=min_interval,
+        ):
+            return False
+        self.logger.info(
+            f"Part {self.name(part)}: {latest.name} is younger than "
+            f"{min_interval} minutes, skip")
+        return True
+
+    def fingerprint_path(self, part: str) -> Path:
+        return self.working_dir/".filters"/f"{self.name(part)}.upstream.json"
+
+    def load_fingerprint(self, part: str, snapshot: Path) -> str | None:
+        try:
+            recorded = json.loads(self.fingerprint_path(part).read_text())
+        except (OSError, ValueError):
+            return None
+        if not isinstance(recorded, dict) or recorded.get("snapshot") != snapshot.name:
+            return None
+        fingerprint = recorded.get("fingerprint")
+        return fingerprint if isinstance(fingerprint, str) else None
+
+    def save_fingerprint(self, part: str, snapshot: Path, fingerprint: str) -> None:
+        self.fingerprint_path(part).write_text(json.dumps({
+            "snapshot": snapshot.name,
+            "fingerprint": fingerprint,
+        }))
+
+    def is_unchanged(self, part: str, fingerprint: str | None) -> bool:
+        latest = self.latest(part)
+        if latest is None or fingerprint is None:
+            return False
+        if fingerprint != self.load_fingerprint(part, latest):
+            return False
+        self.logger.info(
+            f"Part {self.name(part)}: upstream unchanged since {latest.name}")
+        return True
+
+    def compose_view(
+        self,
+        view_dir: Path,
+        part_list: list[str],
+        current_view: Path | None,
+    ) -> bool:
+        latest_parts: list[Path] = []
+        for part in part_list:
+            if (latest := self.latest(part)) is None:
+                msg = f"No snapshot of part {self.name(part)}"
+                raise RuntimeError(msg)
+            latest_parts.append(latest)
+        if current_view is not None and view_parts(current_view) == {
+            snapshot.name for snapshot in latest_parts
+        }:
+            self.logger.info(f"Branch {self.branch} view is up to date")
+            return False
+
+        shutil.rmtree(view_dir, ignore_errors=True)
+        (view_dir/BRANCH_SUBDIR).mkdir(parents=True)
+        for snapshot in latest_parts:
+            part_dir = snapshot/BRANCH_SUBDIR
+            if not part_dir.is_dir():
+                continue
+            for entry in sorted(part_dir.iterdir()):
+                # relative to .snapshots/{branch}-{ts}/branch, valid in rsyncd chroot
+                (view_dir/BRANCH_SUBDIR/entry.name).symlink_to(
+                    Path("..", "..", snapshot.name, BRANCH_SUBDIR, entry.name))
+        return True
+
+    def pressure_candidates(self, views: list[Path]) -> dict[str, Path]:
+        # older parts not referenced by the published view
+        published = view_parts(views[-1]) if views else set()
+        return {
+            snapshot.name: snapshot
+            for part in SPLIT_PART_LIST
+            for snapshot in find_snapshots(self.working_dir, self.name(part))[:-1]
+            if snapshot.name not in published
+        }
+
+    def delete_old_parts(self, views: list[Path]) -> None:
+        referenced: set[str] = set()
+        for view in views:
+            referenced.update(view_parts(view))
+        for part in SPLIT_PART_LIST:
+            keep_last = self.option(part, "keep_last", DEFAULT_PART_KEEP_LAST)
+            part_snapshots = find_snapshots(self.working_dir, self.name(part))
+            policy = RetentionPolicy(keep_last=keep_last)
+            for snapshot in policy.select_expired(part_snapshots):
+                if snapshot.name not in referenced:
+                    self.logger.info(f"Delete old part snapshot: {snapshot}")
+                    shutil.rmtree(snapshot)
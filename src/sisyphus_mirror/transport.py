@@ -0,0 +1,426 @@
+import hashlib
+import http.client
+import os
+import shutil
+import threading
+import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import suppress
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from html.parser import HTMLParser
+from http import HTTPStatus
+from logging import Logger
+from pathlib import Path
+from typing import BinaryIO
+from urllib.parse import quote, unquote, urlsplit
+
+from sisyphus_mirror.consts import DEFAULT_HTTP_WORKERS
+from sisyphus_mirror.history import TransferStats
+from sisyphus_mirror.logger import get_logger
+from sisyphus_mirror.packages import Package, read_release
+
+HTTP_SCHEMES = ("http", "https")
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_ATTEMPTS = 3
+GLOB_CHARS = ("*", "?", "[")
+
+
+def is_http_url(url: str) -> bool:
+    return urlsplit(url).scheme in HTTP_SCHEMES
+
+
+class IndexParser(HTMLParser):
+    # entries of an nginx, Apache or Python autoindex page: "name", "dir/"
+    def __init__(self) -> None:
+        super().__init__()
+        self.names: list[str] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag != "a":
+            return
+        href = unquote(dict(attrs).get("href") or "")
+        name = href.removesuffix("/")
+        if name and "/" not in name and not name.startswith(("?", "#", "..")):
+            self.names.append(href)
+
+
+def file_digest(
+    path: Path,
+    hash_name: str,
+    limit: int | None = None,
+) -> "hashlib._Hash":
+    digest = hashlib.new(hash_name)
+    with path.open("rb") as file:
+        remaining = limit
+        while chunk := file.read(
+            DOWNLOAD_CHUNK_SIZE if remaining is None
+            else min(DOWNLOAD_CHUNK_SIZE, remaining),
+        ):
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest
+
+
+@dataclass(frozen=True)
+class RemoteFile:
+    path: str  # relative to the upstream branch directory
+    size: int | None = None
+    hash_name: str | None = None
+    digest: str = ""
+    immutable: bool = False  # package file names are versioned
+
+    @classmethod
+    def from_package(cls, package: Package) -> "RemoteFile":
+        return cls(
+            path=package.path,
+            size=package.size or None,
+            hash_name="md5" if package.md5 else None,
+            digest=package.md5,
+            immutable=True,
+        )
+
+
+class RateLimiter:
+    def __init__(self, bytes_per_second: int) -> None:
+        self.bytes_per_second = bytes_per_second
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def consume(self, size: int) -> None:
+        if not self.bytes_per_second:
+            return
+        # one budget for all connections, like --bwlimit of a single rsync
+        with self.lock:
+            now = time.monotonic()
+            self.next_time = max(self.next_time, now) + size / self.bytes_per_second
+            delay = self.next_time - now
+        time.sleep(delay)
+
+
+@dataclass
+class HttpTransport:
+    base_url: str
+    dest_dir: Path
+    partial_dir: Path
+    link_dest_dirs: list[Path] = field(default_factory=list)
+    workers: int = DEFAULT_HTTP_WORKERS
+    timeout: float | None = None
+    rate_limit: int = 0  # bytes per second, 0 - unlimited
+    attempts: int = DOWNLOAD_ATTEMPTS
+    dry_run: bool = False
+    initializer: Callable[[], None] | None = None
+    logger: Logger = get_logger(__name__)
+
+    def __post_init__(self) -> None:
+        url = urlsplit(self.base_url)
+        self.connection_class = (
+            http.client.HTTPSConnection if url.scheme == "https"
+            else http.client.HTTPConnection)
+        self.netloc = url.netloc
+        self.base_path = url.path.rstrip("/")
+        self.limiter = RateLimiter(self.rate_limit)
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.connections: list[http.client.HTTPConnection] = []
+        self.stats = TransferStats()
+        self.retries = 0
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def close(self) -> None:
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for connection in connections:
+            connection.close()
+
+    def release_file(self, arch: str) -> RemoteFile:
+        # always downloaded: it lists the checksums of the other base files
+        return RemoteFile(f"{arch}/base/release")
+
+    def release_files(self, arch: str) -> list[RemoteFile]:
+        release_path = self.dest_dir/arch/"base"/"release"
+        if not release_path.exists():
+            return []
+        return [
+            RemoteFile(f"{arch}/{path}", entry.size, entry.hash_name, entry.digest)
+            for path, entry in read_release(release_path).items()
+        ]
+
+    def sync(
+        self,
+        files: Iterable[RemoteFile],
+        *,
+        metadata: bool = False,
+        optional: bool = False,
+    ) -> None:
+        with ThreadPoolExecutor(self.workers, initializer=self.initializer) as executor:
+            futures = [
+                executor.submit(
+                    self.sync_file, remote, metadata=metadata, optional=optional)
+                for remote in files
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                self.stop()
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def sync_file(
+        self,
+        remote: RemoteFile,
+        *,
+        metadata: bool = False,
+        optional: bool = False,
+    ) -> None:
+        if self.stopped.is_set():
+            return
+        dest_path = self.dest_dir/remote.path
+        if self.is_unchanged(dest_path, remote):
+            self.count(remote, dest_path.stat().st_size, transferred=False)
+            return
+        if link_source := self.find_link_source(remote):
+            dest_path.parent.mkdir(parents=True, exist_ok=True)
+            if not self.dry_run:
+                dest_path.unlink(missing_ok=True)
+                os.link(link_source, dest_path)
+            elif metadata:
+                shutil.copy2(link_source, dest_path)  # a dry run reads it
+            self.count(remote, link_source.stat().st_size, transferred=False)
+            return
+        if self.dry_run and not metadata:
+            # metadata is fetched in a dry run too, packages are only counted
+            self.count(remote, remote.size or 0, transferred=True)
+            return
+        try:
+            size = self.download_with_retries(remote)
+        except FileNotFoundError:
+            if not optional:
+                raise
+            self.logger.debug(f"Optional file {remote.path} not found upstream")
+            return
+        self.count(remote, size, transferred=True)
+
+    def count(self, remote: RemoteFile, size: int, *, transferred: bool) -> None:
+        with self.lock:
+            self.stats.files += 1
+            self.stats.total_size += size
+            if transferred:
+                self.stats.files_transferred += 1
+                self.stats.transferred_size += size
+        if transferred and not self.dry_run:
+            self.logger.debug(f"Downloaded {remote.path}")
+
+    def is_unchanged(self, path: Path, remote: RemoteFile) -> bool:
+        if remote.size is None or not path.is_file():
+            return False
+        if path.stat().st_size != remote.size:
+            return False
+        if remote.immutable:
+            return True
+        return bool(remote.hash_name) and file_digest(
+            path, remote.hash_name or "").hexdigest() == remote.digest
+
+    def find_link_source(self, remote: RemoteFile) -> Path | None:
+        for link_dest_dir in self.link_dest_dirs:
+            if self.is_unchanged(candidate := link_dest_dir/remote.path, remote):
+                return candidate
+        return None
+
+    def download_with_retries(self, remote: RemoteFile) -> int:
+        for attempt in range(1, self.attempts + 1):
+            try:
+                return self.download(remote)
+            except FileNotFoundError:
+                raise
+            except (OSError, http.client.HTTPException, ValueError) as error:
+                if self.stopped.is_set():
+                    raise
+                self.logger.warning(
+                    f"Download of {remote.path}, attempt {attempt} failed: {error}")
+                if attempt < self.attempts:
+                    with self.lock:
+                        self.retries += 1
+        msg = f"Download of {remote.path} failed"
+        raise RuntimeError(msg)
+
+    def download(self, remote: RemoteFile) -> int:
+        partial_path = self.partial_dir/remote.path
+        partial_path.parent.mkdir(parents=True, exist_ok=True)
+        offset = partial_path.stat().st_size if partial_path.exists() else 0
+        if remote.size is None or offset >= remote.size:
+            offset = 0  # nothing to resume
+
+        response, offset = self.open_response(remote, partial_path, offset)
+        try:
+            with partial_path.open("r+b" if offset else "wb") as file:
+                digest = (
+                    file_digest(partial_path, remote.hash_name, offset)
+                    if remote.hash_name else None)
+                file.seek(offset)
+                file.truncate()
+                self.receive(response, file, digest)
+                size = file.tell()
+        except BaseException:
+            if not response.isclosed():
+                self.close_connection()  # an unread body breaks keep-alive
+            raise
+
+        if (remote.size is not None and size != remote.size) or (
+            digest is not None and digest.hexdigest() != remote.digest
+        ):
+            partial_path.unlink()
+            msg = f"{remote.path}: size or checksum mismatch"
+            raise ValueError(msg)
+        if last_modified := response.headers.get("Last-Modified"):
+            with suppress(TypeError, ValueError):
+                modified = parsedate_to_datetime(last_modified).timestamp()
+                os.utime(partial_path, (time.time(), modified))
+        dest_path = self.dest_dir/remote.path
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        partial_path.replace(dest_path)
+        return size
+
+    def open_response(
+        self,
+        remote: RemoteFile,
+        partial_path: Path,
+        offset: int,
+    ) -> tuple[http.client.HTTPResponse, int]:
+        response = self.request(remote.path, offset)
+        if response.status == HTTPStatus.OK:
+            return response, 0  # the server ignored the range
+        if response.status == HTTPStatus.PARTIAL_CONTENT:
+            return response, offset
+        response.read()  # keeps the connection usable
+        if response.status == HTTPStatus.NOT_FOUND:
+            raise FileNotFoundError(remote.path)
+        if response.status == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE:
+            partial_path.unlink(missing_ok=True)
+        msg = f"HTTP {response.status} {response.reason}"
+        raise OSError(msg)
+
+    def receive(
+        self,
+        response: http.client.HTTPResponse,
+        file: BinaryIO,
+        digest: "hashlib._Hash | None",
+    ) -> None:
+        received = 0
+        try:
+            while chunk := response.read(DOWNLOAD_CHUNK_SIZE):
+                if self.stopped.is_set():
+                    msg = "Transfer stopped"
+                    raise InterruptedError(msg)
+                self.limiter.consume(len(chunk))
+                file.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)  # verified as it goes
+                received += len(chunk)
+        finally:
+            with self.lock:
+                self.stats.bytes_received += received
+
+    def connection(self) -> http.client.HTTPConnection:
+        if (connection := getattr(self.local, "connection", None)) is None:
+            connection = self.connection_class(self.netloc, timeout=self.timeout)
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    def close_connection(self) -> None:
+        if (connection := getattr(self.local, "connection", None)) is not None:
+            connection.close()
+            self.local.connection = None
+
+    def request(self, path: str, offset: int = 0) -> http.client.HTTPResponse:
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        url_path = f"{self.base_path}/{quote(path)}"
+        reused = getattr(self.local, "connection", None) is not None
+        try:
+            return self.send(url_path, headers)
+        except (BrokenPipeError, ConnectionResetError):
+            # the server may close an idle kept-alive connection at any time
+            if not reused:
+                raise
+        return self.send(url_path, headers)
+
+    def send(self, url_path: str, headers: dict[str, str]) -> http.client.HTTPResponse:
+        connection = self.connection()
+        try:
+            connection.request("GET", url_path, headers=headers)
+            return connection.getresponse()
+        except BaseException:
+            self.close_connection()
+            raise
+
+    def list_directory(self, path: str) -> list[str] | None:
+        response = self.request(f"{path}/")
+        body = response.read()
+        content_type = response.headers.get("Content-Type", "")
+        if response.status != HTTPStatus.OK or not content_type.startswith("text/html"):
+            return None
+        parser = IndexParser()
+        parser.feed(body.decode(errors="replace"))
+        return parser.names
+
+    def list_tree(self, directory: str) -> list[str] | None:
+        files: list[str] = []
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            if (names := self.list_directory(current)) is None:
+                return None
+            for name in names:
+                path = f"{current}/{name.removesuffix('/')}"
+                (stack if name.endswith("/") else files).append(path)
+        return sorted(files)
+
+    def include_files(
+        self,
+        include_files: Iterable[str],
+    ) -> tuple[list[RemoteFile], list[str]]:
+        # glob patterns are expanded from the directory listing of their
+        # literal prefix; patterns that cannot be listed are returned
+        files: dict[str, RemoteFile] = {}
+        skipped: list[str] = []
+        for pattern in include_files:
+            relative = pattern.lstrip("/")
+            glob_index = min(
+                (relative.find(char) for char in GLOB_CHARS if char in relative),
+                default=None,
+            )
+            if glob_index is None:
+                files.setdefault(relative, RemoteFile(relative))
+                continue
+            directory = relative[:glob_index].rpartition("/")[0]
+            if not directory or (tree := self.list_tree(directory)) is None:
+                skipped.append(pattern)
+                continue
+            files.update((path, RemoteFile(path)) for path in tree)
+        return list(files.values()), skipped
+
+    def prune(
+        self,
+        wanted: set[str],
+        keep: Callable[[str], bool] | None = None,
+    ) -> list[str]:
+        # files of an interrupted run or of a peer that upstream does not have
+        pruned: list[str] = []
+        if not self.dest_dir.exists():
+            return pruned
+        for path in sorted(self.dest_dir.rglob("*")):
+            relative = path.relative_to(self.dest_dir).as_posix()
+            if path.is_dir() or relative in wanted or (keep and keep(relative)):
+                continue
+            path.unlink()
+            pruned.append(relative)
+        return pruned
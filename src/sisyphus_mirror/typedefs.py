@@ -4,6 +4,69 @@ from typing import Literal, NotRequired, TypedDict
 
 BranchT = Literal["c10f2", "p10", "p11", "Sisyphus"]
 ArchT = Literal["aarch64", "armh", "i586", "noarch", "x86_64", "x86_64-i586"]
+PhaseT = Literal["sync", "warmup", "delete"]
+IOClassT = Literal["none", "realtime", "best-effort", "idle"]
+FanoutRoleT = Literal["primary", "replica"]
+
+
+class RetentionKW(TypedDict):
+    keep_last: NotRequired[int]
+    keep_daily: NotRequired[int]
+    keep_weekly: NotRequired[int]
+    keep_monthly: NotRequired[int]
+    max_age_days: NotRequired[int]
+    min_free_space: NotRequired[int | str]
+    min_free_inodes: NotRequired[int]
+
+
+class PackageFilterKW(TypedDict):
+    include_names: NotRequired[list[str]]
+    exclude_names: NotRequired[list[str]]
+    exclude_groups: NotRequired[list[str]]
+    max_size: NotRequired[int | str]
+    closure_of: NotRequired[list[str]]
+    closure_of_file: NotRequired[Path]
+
+
+class PhasePriorityKW(TypedDict):
+    nice: NotRequired[int]
+    io_class: NotRequired[IOClassT]
+    io_level: NotRequired[int]
+    cpu_weight: NotRequired[int]
+    io_max: NotRequired[str]
+
+
+class PriorityKW(TypedDict):
+    sync: NotRequired[PhasePriorityKW]
+    warmup: NotRequired[PhasePriorityKW]
+    delete: NotRequired[PhasePriorityKW]
+
+
+class FanoutKW(TypedDict):
+    role: NotRequired[FanoutRoleT]
+    batch_dir: NotRequired[Path]
+    keep_batches: NotRequired[int]
+
+
+class ProxyKW(TypedDict):
+    bind: NotRequired[str]
+    port: NotRequired[int]
+    upstream_url: NotRequired[str]
+    cache_size: NotRequired[int | str]
+    lazy_arch_list: NotRequired[list[ArchT]]
+
+
+class SplitPartKW(TypedDict):
+    name: str
+    min_interval: NotRequired[int]
+    keep_last: NotRequired[int]
+
+
+class SplitArchKW(TypedDict):
+    enabled: NotRequired[bool]
+    min_interval: NotRequired[int]
+    keep_last: NotRequired[int]
+    parts: NotRequired[list[SplitPartKW]]
 
 
 class CommonKW(TypedDict):
@@ -14,6 +77,7 @@ class CommonKW(TypedDict):
     branch_list: NotRequired[list[BranchT]]
     working_dir: NotRequired[Path]
     source_url: NotRequired[str]
+    peer_urls: NotRequired[list[str]]
     arch_list: NotRequired[list[ArchT]]
     linkdest_list: NotRequired[list[Path]]
 
@@ -24,12 +88,50 @@ class CommonKW(TypedDict):
     rate_limit: NotRequired[int | str]
     conn_timeout: NotRequired[int]
     io_timeout: NotRequired[int]
+    sync_timeout: NotRequired[int]
+    retention: NotRequired[RetentionKW]
+    package_filter: NotRequired[PackageFilterKW]
+    warm_paths: NotRequired[list[str]]
+    warm_workers: NotRequired[int]
+    http_workers: NotRequired[int]
+    priority: NotRequired[PriorityKW]
+    fanout: NotRequired[FanoutKW]
+    proxy: NotRequired[ProxyKW]
+    split_arch: NotRequired[SplitArchKW]
+    hot_list: NotRequired[Path]
 
     logger: NotRequired[Logger]
 
 
-class CLIArgsT(CommonKW):
+class FilterTestKW(CommonKW):
+    tree: NotRequired[Path]
+    manifest: NotRequired[Path]
+    show: NotRequired[Literal["included", "excluded"]]
+
+
+class StatsKW(CommonKW):
+    days: NotRequired[int]
+
+
+class ExportKW(CommonKW):
+    output: NotRequired[Path]
+    snapshot: NotRequired[str]
+    base: NotRequired[str]
+
+
+class ImportKW(CommonKW):
+    images: NotRequired[list[Path]]
+
+
+class AnalyzeLogsKW(CommonKW):
+    logs: NotRequired[list[Path]]
+    top: NotRequired[int]
+    min_requests: NotRequired[int]
+
+
+class CLIArgsT(FilterTestKW, StatsKW, ExportKW, ImportKW, AnalyzeLogsKW):
     config: NotRequired[Path]
+    command: NotRequired[str]
 
 
 class ConfigKW(CommonKW):
@@ -0,0 +1,37 @@
+SIZE_UNITS = ("B", "KiB", "MiB", "GiB", "TiB", "PiB")
+SIZE_SUFFIXES = {"k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+
+
+def format_size(value: float) -> str:
+    for unit in SIZE_UNITS[:-1]:
+        if abs(value) < 1024:  # noqa: PLR2004
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} {SIZE_UNITS[-1]}"
+
+
+def parse_size(value: int | str) -> int:
+    if isinstance(value, int):
+        return value
+    if multiplier := SIZE_SUFFIXES.get(value[-1:].lower()):
+        return int(value[:-1]) * multiplier
+    return int(value)
+
+
+def parse_rate_limit(value: int | str) -> int:
+    # rsync --bwlimit semantics: 1024-byte units unless a suffix is given
+    if isinstance(value, int):
+        return value * 1024
+    if multiplier := SIZE_SUFFIXES.get(value[-1:].lower()):
+        return int(float(value[:-1]) * multiplier)
+    return int(value) * 1024
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
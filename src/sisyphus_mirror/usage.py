@@ -0,0 +1,174 @@
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+from logging import Logger
+from pathlib import Path
+from typing import Unpack
+
+from sisyphus_mirror.consts import BRANCH_LIST, DEFAULT_HOME_PATH, SPLIT_PART_LIST
+from sisyphus_mirror.logger import get_logger
+from sisyphus_mirror.snapshots import SNAPSHOTS_SUBDIR, find_snapshots
+from sisyphus_mirror.typedefs import BranchT, RepoMirrorKW
+from sisyphus_mirror.units import format_size
+
+USAGE_INDEX_NAME = ".usage-index.json"
+USAGE_INDEX_VERSION = 1
+
+
+def scan_snapshot(snapshot: Path) -> dict[int, int]:
+    root_stat = snapshot.lstat()
+    inodes = {root_stat.st_ino: root_stat.st_blocks * 512}
+    stack = [str(snapshot)]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                stat = entry.stat(follow_symlinks=False)
+                inodes[stat.st_ino] = stat.st_blocks * 512
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+    return inodes
+
+
+@dataclass
+class UsageStats:
+    exclusive_bytes: int = 0
+    shared_bytes: int = 0
+    exclusive_inodes: int = 0
+    shared_inodes: int = 0
+
+    def add(self, size: int, *, exclusive: bool) -> None:
+        if exclusive:
+            self.exclusive_bytes += size
+            self.exclusive_inodes += 1
+        else:
+            self.shared_bytes += size
+            self.shared_inodes += 1
+
+
+@dataclass
+class UsageAccounting:
+    working_dir: Path = DEFAULT_HOME_PATH
+    logger: Logger = get_logger(__name__)
+    snapshot_inodes: dict[str, dict[int, int]] = field(init=False)
+    snapshot_branch: dict[str, BranchT] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.index_path = self.working_dir/USAGE_INDEX_NAME
+        self.snapshots_dir = self.working_dir/SNAPSHOTS_SUBDIR
+        self.snapshot_inodes = {}
+        self.snapshot_branch = {}
+
+    def load_index(self) -> dict[str, dict[int, int]]:
+        if not self.index_path.exists():
+            return {}
+        with self.index_path.open() as file:
+            index = json.load(file)
+        if (
+            index.get("version") != USAGE_INDEX_VERSION
+            or index.get("device") != self.snapshots_dir.stat().st_dev
+        ):
+            self.logger.info(f"Usage index {self.index_path} is outdated, rescan.")
+            return {}
+        return {
+            name: dict(zip(inodes[::2], inodes[1::2], strict=True))
+            for name, inodes in index["snapshots"].items()
+        }
+
+    def save_index(self) -> None:
+        index = {
+            "version": USAGE_INDEX_VERSION,
+            "device": self.snapshots_dir.stat().st_dev,
+            "snapshots": {
+                name: [value for pair in inodes.items() for value in pair]
+                for name, inodes in self.snapshot_inodes.items()
+            },
+        }
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with tmp_path.open("w") as file:
+            json.dump(index, file, separators=(",", ":"))
+        tmp_path.replace(self.index_path)
+
+    def branch_snapshots(self, branch: BranchT) -> list[Path]:
+        # split_arch views hold symlinks, the data is in their part snapshots
+        return [
+            snapshot
+            for name in (branch, *(f"{branch}.{part}" for part in SPLIT_PART_LIST))
+            for snapshot in find_snapshots(self.working_dir, name)
+        ]
+
+    def update(self) -> None:
+        # completed snapshots are immutable, so only new ones are scanned
+        cached = self.load_index()
+        self.snapshot_inodes = {}
+        self.snapshot_branch = {}
+        for branch in BRANCH_LIST:
+            for snapshot in self.branch_snapshots(branch):
+                if (inodes := cached.get(snapshot.name)) is None:
+                    self.logger.info(f"Scan snapshot {snapshot}")
+                    inodes = scan_snapshot(snapshot)
+                self.snapshot_inodes[snapshot.name] = inodes
+                self.snapshot_branch[snapshot.name] = branch
+        if self.snapshots_dir.exists():
+            self.save_index()
+
+    def compute(self) -> tuple[dict[str, UsageStats], dict[BranchT, UsageStats]]:
+        owners: dict[int, set[str]] = {}
+        sizes: dict[int, int] = {}
+        for name, inodes in self.snapshot_inodes.items():
+            for inode, size in inodes.items():
+                owners.setdefault(inode, set()).add(name)
+                sizes[inode] = size
+
+        snapshot_usage = {name: UsageStats() for name in self.snapshot_inodes}
+        branch_usage = {
+            branch: UsageStats() for branch in self.snapshot_branch.values()
+        }
+        for inode, names in owners.items():
+            size = sizes[inode]
+            for name in names:
+                snapshot_usage[name].add(size, exclusive=len(names) == 1)
+            branches = {self.snapshot_branch[name] for name in names}
+            for branch in branches:
+                branch_usage[branch].add(size, exclusive=len(branches) == 1)
+        return snapshot_usage, branch_usage
+
+
+def format_usage_report(
+    snapshot_usage: dict[str, UsageStats],
+    branch_usage: dict[BranchT, UsageStats],
+) -> str:
+    header = (
+        f"{'NAME':<40} {'EXCLUSIVE':>12} {'SHARED':>12} "
+        f"{'EXCL.INODES':>12} {'SHR.INODES':>12}"
+    )
+    rows = [
+        *sorted(snapshot_usage.items()),
+        *[(f"{branch} (branch)", stats) for branch, stats in branch_usage.items()],
+    ]
+    lines = [header]
+    lines.extend(
+        f"{name:<40} {format_size(stats.exclusive_bytes):>12} "
+        f"{format_size(stats.shared_bytes):>12} "
+        f"{stats.exclusive_inodes:>12} {stats.shared_inodes:>12}"
+        for name, stats in rows
+    )
+    return "\n".join(lines) + "\n"
+
+
+def report_usage(**kwargs: Unpack[RepoMirrorKW]) -> None:
+    accounting = UsageAccounting(
+        working_dir=kwargs.get("working_dir", DEFAULT_HOME_PATH),
+    )
+    accounting.update()
+    snapshot_usage, branch_usage = accounting.compute()
+    if branch_list := kwargs.get("branch_list"):
+        snapshot_usage = {
+            name: stats for name, stats in snapshot_usage.items()
+            if accounting.snapshot_branch[name] in branch_list
+        }
+        branch_usage = {
+            branch: stats for branch, stats in branch_usage.items()
+            if branch in branch_list
+        }
+    sys.stdout.write(format_usage_report(snapshot_usage, branch_usage))
@@ -0,0 +1,61 @@
+import os
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+WARM_CHUNK_SIZE = 1024 * 1024
+
+
+def find_hot_files(snapshot: Path, patterns: Iterable[str]) -> list[Path]:
+    files: set[Path] = set()
+    for pattern in patterns:
+        files.update(path for path in snapshot.glob(pattern) if path.is_file())
+    return sorted(files)
+
+
+def warm_file(path: Path) -> int:
+    buffer = bytearray(WARM_CHUNK_SIZE)
+    warmed = 0
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        # WILLNEED is only a hint, reading guarantees the pages are cached
+        while read := os.readv(fd, [buffer]):
+            warmed += read
+    finally:
+        os.close(fd)
+    return warmed
+
+
+def warm_up(snapshot: Path, patterns: Iterable[str], workers: int) -> tuple[int, int]:
+    files = find_hot_files(snapshot, patterns)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        warmed = sum(executor.map(warm_file, files))
+    return len(files), warmed
+
+
+def drop_file(path: Path) -> int:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        return os.fstat(fd).st_size
+    finally:
+        os.close(fd)
+
+
+def cool_down(
+    old_snapshot: Path,
+    new_snapshot: Path,
+    patterns: Iterable[str],
+) -> tuple[int, int]:
+    # hot files replaced in the new snapshot are not served anymore,
+    # files shared through hard links are still hot and kept cached
+    patterns = list(patterns)
+    new_inodes = {
+        path.stat().st_ino for path in find_hot_files(new_snapshot, patterns)}
+    cold_files = [
+        path for path in find_hot_files(old_snapshot, patterns)
+        if path.stat().st_ino not in new_inodes
+    ]
+    return len(cold_files), sum(map(drop_file, cold_files))
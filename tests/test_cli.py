@@ -72,3 +72,21 @@ def test_cli_io_timeout_invalid(io_timeout: str) -> None:
 def test_cli_conn_timeout_invalid(conn_timeout: str) -> None:
     with pytest.raises(CommandError):
         handle_cli_options(["--conn-timeout", conn_timeout])
+
+
+def test_cli_command() -> None:
+    assert handle_cli_options(["usage"]) == {"command": "usage"}
+    assert handle_cli_options(["usage", "-b", "p11"]) == {
+        "command": "usage", "branch_list": ["p11"]}
+    assert handle_cli_options(["stats", "--days", "30"]) == {
+        "command": "stats", "days": 30}
+    with pytest.raises(CommandError):
+        handle_cli_options(["stats", "--days", "0"])
+    assert handle_cli_options(["export", "-o", "images", "--base", "p11-1"]) == {
+        "command": "export", "output": Path("images"), "base": "p11-1"}
+    assert handle_cli_options(["import", "a.tar.gz", "b.delta.tar.gz"]) == {
+        "command": "import", "images": [Path("a.tar.gz"), Path("b.delta.tar.gz")]}
+    assert handle_cli_options(["analyze-logs", "a.log", "--hot-list", "hot.lst"]) == {
+        "command": "analyze-logs", "logs": [Path("a.log")], "hot_list": Path("hot.lst")}
+    with pytest.raises(CommandError):
+        handle_cli_options(["analyze-logs", "a.log", "--top", "0"])
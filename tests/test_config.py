@@ -28,10 +28,12 @@ def test_config_handler_normalize_options(config_handler: ConfigHandler) -> None
     unnormalized = {
         "working-dir": str(DEFAULT_HOME_PATH),
         "linkdest_list": ["user-snapshot-1", "user-snapshot-2"],
+        "hot-list": "/var/lib/sisyphus-mirror/hot.lst",
     }
     normalized = {
         "working_dir": DEFAULT_HOME_PATH,
         "linkdest_list": [Path("user-snapshot-1"), Path("user-snapshot-2")],
+        "hot_list": Path("/var/lib/sisyphus-mirror/hot.lst"),
     }
     result = config_handler.normalize_options(unnormalized)
     assert result == normalized
@@ -129,6 +131,22 @@ def test_config_handler_validate_rsync_url(config_handler: ConfigHandler) -> Non
             option_name="option_name", option_value="http://example.com",
         )
 
+def test_config_handler_validate_source_url(config_handler: ConfigHandler) -> None:
+    validate_source_url = config_handler.validator_map["source_url"]
+    for url in (DEFAULT_SOURCE, "https://ftp.altlinux.org/pub/distributions/ALTLinux"):
+        assert validate_source_url("source_url", url) is None
+    with pytest.raises(ConfigError):
+        validate_source_url("source_url", "ftp://ftp.altlinux.org/ALTLinux")
+
+def test_config_handler_validate_peer_urls(config_handler: ConfigHandler) -> None:
+    validate_peer_urls = config_handler.validator_map["peer_urls"]
+    assert validate_peer_urls("peer_urls", ["rsync://mirror.lan/ALTLinux"]) is None
+    with pytest.raises(ConfigError):
+        validate_peer_urls("peer_urls", ["http://mirror.lan/ALTLinux"])
+    with pytest.raises(ConfigError):
+        validate_peer_urls("peer_urls", "rsync://mirror.lan/ALTLinux")
+
+
 def test_config_handler_validate_string_list(config_handler: ConfigHandler) -> None:
     assert config_handler.validate_string_list(
         option_name="option_name", option_value=["a", "b", "c"],
@@ -141,3 +159,89 @@ def test_config_handler_validate_string_list(config_handler: ConfigHandler) -> N
         config_handler.validate_string_list(
             option_name="option_name", option_value=[None],
         )
+
+
+def test_config_handler_validate_retention(config_handler: ConfigHandler) -> None:
+    validate_retention = config_handler.validator_map["retention"]
+    assert validate_retention(
+        "retention", {"keep_last": 2, "keep_daily": 7, "min_free_space": "20G"},
+    ) is None
+    with pytest.raises(ConfigError):
+        validate_retention("retention", {"keep_last": 0})
+    with pytest.raises(ConfigError):
+        validate_retention("retention", {"min_free_space": "20X"})
+    with pytest.raises(ConfigError):
+        validate_retention("retention", {"unknown": 1})
+    with pytest.raises(ConfigError):
+        validate_retention("retention", 1)
+
+
+def test_config_handler_validate_priority(config_handler: ConfigHandler) -> None:
+    validate_priority = config_handler.validator_map["priority"]
+    assert validate_priority("priority", {
+        "sync": {"nice": 10, "io_class": "best-effort", "io_level": 7},
+        "delete": {"io_class": "idle", "cpu_weight": 10, "io_max": "wbps=1048576"},
+    }) is None
+    with pytest.raises(ConfigError):
+        validate_priority("priority", {"sync": {"nice": 20}})
+    with pytest.raises(ConfigError):
+        validate_priority("priority", {"sync": {"io_class": "low"}})
+    with pytest.raises(ConfigError):
+        validate_priority("priority", {"delete": {"io_max": "wbps=1Mriops=5"}})
+    with pytest.raises(ConfigError):
+        validate_priority("priority", {"verify": {"nice": 10}})
+    normalized = config_handler.normalize_options(
+        {"priority": {"delete": {"io-class": "idle"}}})
+    assert normalized == {"priority": {"delete": {"io_class": "idle"}}}
+
+
+def test_config_handler_validate_fanout(
+    config_handler: ConfigHandler,
+    tmp_path: Path,
+) -> None:
+    validate_fanout = config_handler.validator_map["fanout"]
+    assert validate_fanout(
+        "fanout", {"role": "replica", "batch_dir": tmp_path, "keep_batches": 2},
+    ) is None
+    with pytest.raises(ConfigError):
+        validate_fanout("fanout", {"role": "secondary"})
+    with pytest.raises(ConfigError):
+        validate_fanout("fanout", {"batch_dir": tmp_path / "missing"})
+    normalized = config_handler.normalize_options(
+        {"fanout": {"batch-dir": str(tmp_path)}})
+    assert normalized == {"fanout": {"batch_dir": tmp_path}}
+
+
+def test_config_handler_validate_proxy(config_handler: ConfigHandler) -> None:
+    validate_proxy = config_handler.validator_map["proxy"]
+    assert validate_proxy("proxy", {
+        "bind": "0.0.0.0",  # noqa: S104
+        "port": 8080,
+        "upstream_url": "https://ftp.altlinux.org/pub/distributions/ALTLinux",
+        "cache_size": "50G",
+        "lazy_arch_list": ["aarch64"],
+    }) is None
+    with pytest.raises(ConfigError):
+        validate_proxy("proxy", {"port": 0})
+    with pytest.raises(ConfigError):
+        validate_proxy("proxy", {"upstream_url": "rsync://ftp.altlinux.org/ALTLinux"})
+    with pytest.raises(ConfigError):
+        validate_proxy("proxy", {"lazy_arch_list": ["z80"]})
+
+
+def test_config_handler_validate_split_arch(config_handler: ConfigHandler) -> None:
+    validate_split_arch = config_handler.validator_map["split_arch"]
+    assert validate_split_arch("split_arch", {
+        "enabled": True,
+        "min_interval": 60,
+        "keep_last": 2,
+        "parts": [{"name": "x86_64-i586", "min_interval": 1440}, {"name": "common"}],
+    }) is None
+    with pytest.raises(ConfigError):
+        validate_split_arch("split_arch", {"keep_last": 0})
+    with pytest.raises(ConfigError):
+        validate_split_arch("split_arch", {"parts": {"name": "noarch"}})
+    with pytest.raises(ConfigError):
+        validate_split_arch("split_arch", {"parts": [{"min_interval": 5}]})
+    with pytest.raises(ConfigError):
+        validate_split_arch("split_arch", {"parts": [{"name": "z80"}]})
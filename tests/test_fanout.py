@@ -0,0 +1,52 @@
+import os
+import shutil
+from pathlib import Path
+
+from sisyphus_mirror.fanout import BatchStore, tree_fingerprint
+
+
+def make_tree(root: Path) -> Path:
+    (root / "branch" / "noarch" / "base").mkdir(parents=True)
+    (root / "branch" / "noarch" / "base" / "release").write_text("release")
+    (root / ".timestamp").write_text("1")
+    os.utime(root / ".timestamp", (1000, 1000))
+    return root
+
+
+def test_tree_fingerprint(tmp_path: Path) -> None:
+    tree = make_tree(tmp_path / "tree")
+    copy = tmp_path / "copy"
+    shutil.copytree(tree, copy)  # copies mtimes, not directory mtimes
+
+    assert tree_fingerprint(tree) == tree_fingerprint(copy)
+    assert tree_fingerprint(None) != tree_fingerprint(tree)
+    (copy / ".timestamp").write_text("2")
+    assert tree_fingerprint(tree) != tree_fingerprint(copy)
+
+
+def test_batch_store(tmp_path: Path) -> None:
+    base = make_tree(tmp_path / "p11-20260101000000000000")
+    batch_dir = tmp_path / "batches"
+    batch_dir.mkdir()
+    rules = tmp_path / "p11.rules"
+    rules.write_text("- *\n")
+    store = BatchStore(batch_dir)
+
+    first = store.new_batch("p11", None, "digest")
+    first.name = "p11-1"
+    store.path(first).write_bytes(b"batch")
+    assert store.find_batches("p11") == []  # not published yet
+    store.publish(first, rules)
+    second = store.new_batch("p11", base, "digest")
+    second.name = "p11-2"
+    store.publish(second, rules)
+
+    assert store.find_batches("p11") == [first, second]
+    assert store.find_applicable("p11", None, "digest") == first
+    assert store.find_applicable("p11", base, "digest") == second
+    assert store.find_applicable("p11", base, "other") is None
+    assert store.path(second, ".rules").read_text() == "- *\n"
+
+    assert store.prune("p11", 1) == [first]
+    assert not store.path(first).exists()
+    assert store.find_batches("p11") == [second]
@@ -0,0 +1,90 @@
+from pathlib import Path
+
+import pytest
+
+from sisyphus_mirror.filters import (
+    FilterEvaluator,
+    FilterRule,
+    build_filter_rules,
+    compile_rules,
+    evaluate_entries,
+    iter_manifest,
+    iter_tree,
+)
+
+
+def test_compile_rules() -> None:
+    rules = [
+        FilterRule("-", "*debuginfo*"),
+        FilterRule("+", "*debuginfo*"),
+        FilterRule("+", "noarch/**"),
+        FilterRule("-", "*"),
+        FilterRule("+", "x86_64/**"),
+    ]
+    assert compile_rules(rules) == [
+        FilterRule("-", "*debuginfo*"),
+        FilterRule("+", "noarch/**"),
+        FilterRule("-", "*"),
+    ]
+
+
+@pytest.mark.parametrize(("pattern", "path", "is_dir", "expected"), [
+    ("SRPMS", "branch/SRPMS", True, True),
+    ("SRPMS", "branch/SRPMS.classic", True, False),
+    ("*debuginfo*", "branch/x86_64/RPMS.debuginfo", True, True),
+    ("*/", "branch/x86_64", True, True),
+    ("*/", "branch/x86_64/file", False, False),
+    ("list/**", "branch/list/x/y", False, True),
+    ("list/**", "branch/list", True, False),
+    ("x86_64/**", "branch/x86_64-i586/file", False, False),
+    ("/branch/x86_64/a.rpm", "branch/x86_64/a.rpm", False, True),
+    ("/x86_64/a.rpm", "branch/x86_64/a.rpm", False, False),
+    ("list/***", "branch/list", True, True),
+    ("*.rp?", "branch/x86_64/a.rpm", False, True),
+    ("[ab].rpm", "branch/x86_64/a.rpm", False, True),
+    ("[!ab].rpm", "branch/x86_64/a.rpm", False, False),
+])
+def test_filter_evaluator_patterns(
+    pattern: str, path: str, is_dir: bool, expected: bool,  # noqa: FBT001
+) -> None:
+    evaluator = FilterEvaluator([FilterRule("-", pattern)])
+    assert evaluator.matches(path, is_dir=is_dir) is not expected
+
+
+def test_filter_evaluator_default_rules() -> None:
+    evaluator = FilterEvaluator(build_filter_rules())
+    assert evaluator.is_included("branch/.timestamp")
+    assert evaluator.is_included("branch/x86_64/RPMS.classic/bash.rpm")
+    assert evaluator.is_included("branch/list/task.lst")
+    assert not evaluator.is_included("branch/aarch64/RPMS.classic/bash.rpm")
+    assert not evaluator.is_included("branch/x86_64/RPMS.debuginfo/bash.rpm")
+    assert not evaluator.is_included("branch/SRPMS/foo/bar")
+
+
+def test_filter_evaluate_tree_and_manifest(tmp_path: Path) -> None:
+    tree = tmp_path / "tree"
+    for path, size in (
+        ("branch/x86_64/RPMS.classic/a.rpm", 10),
+        ("branch/aarch64/RPMS.classic/a.rpm", 20),
+        ("branch/x86_64/RPMS.debuginfo/a.rpm", 40),
+    ):
+        (tree / path).parent.mkdir(parents=True, exist_ok=True)
+        (tree / path).write_bytes(b"x" * size)
+
+    evaluator = FilterEvaluator(build_filter_rules())
+    report = evaluate_entries(iter_tree(tree), evaluator, show="excluded")
+    assert (report.included_files, report.included_bytes) == (1, 10)
+    assert (report.excluded_files, report.excluded_bytes) == (2, 60)
+    assert sorted(report.paths) == [
+        "branch/aarch64/RPMS.classic/a.rpm", "branch/x86_64/RPMS.debuginfo/a.rpm"]
+
+    manifest = tmp_path / "manifest"
+    manifest.write_text(
+        "drwxr-xr-x          4,096 2025/01/01 00:00:00 branch\n"
+        "-rw-r--r--          1,024 2025/01/01 00:00:00 branch/.timestamp\n"
+        "2048 branch/noarch/RPMS.classic/b.rpm\n"
+        "0 branch/noarch/\n",
+    )
+    report = evaluate_entries(iter_manifest(manifest), evaluator)
+    assert (report.included_files, report.included_bytes) == (2, 3072)
+    assert report.excluded_files == 0
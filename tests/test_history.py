@@ -0,0 +1,112 @@
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from sisyphus_mirror.history import (
+    HISTORY_DB_NAME,
+    RunHistory,
+    RunRecord,
+    TransferStats,
+    best_schedule_hour,
+    format_branch_stats,
+    parse_rsync_stats,
+    percentile,
+    show_stats,
+    trend,
+)
+
+RSYNC_STATS = """\
+Number of files: 12,345 (reg: 10,000, dir: 2,345)
+Number of created files: 120 (reg: 120)
+Number of deleted files: 0
+Number of regular files transferred: 250
+Total file size: 98,765,432,100 bytes
+Total transferred file size: 1,234,567 bytes
+Literal data: 1,234,567 bytes
+Matched data: 0 bytes
+File list size: 524,288
+Total bytes sent: 40,000
+Total bytes received: 1,300,000
+
+sent 40,000 bytes  received 1,300,000 bytes  100,000.00 bytes/sec
+"""
+
+
+def make_record(hour: int, day: int, received: int, sync_seconds: float) -> RunRecord:
+    started_at = datetime(2026, 1, day, hour).timestamp()  # noqa: DTZ001
+    return RunRecord(
+        branch="p11",
+        started_at=started_at,
+        finished_at=started_at + sync_seconds + 10,
+        status="ok",
+        stats=TransferStats(
+            files=100, files_transferred=10, bytes_received=received),
+        phases={"sync": sync_seconds},
+    )
+
+
+def test_parse_rsync_stats() -> None:
+    assert parse_rsync_stats(RSYNC_STATS) == TransferStats(
+        files=10000,
+        files_transferred=250,
+        total_size=98765432100,
+        transferred_size=1234567,
+        bytes_received=1300000,
+        bytes_sent=40000,
+    )
+    assert parse_rsync_stats("") == TransferStats()
+
+
+def test_run_history_roundtrip(tmp_path: Path) -> None:
+    history = RunHistory(tmp_path / "history.sqlite3")
+    record = make_record(3, 1, 1000, 5)
+    record.retries = 1
+    history.append(record)
+    history.append(RunRecord(branch="Sisyphus", status="failed", error="boom"))
+
+    assert history.load(["p11"]) == [record]
+    assert [loaded.branch for loaded in history.load()] == ["p11", "Sisyphus"]
+    assert history.load(since=record.started_at + 1)[0].error == "boom"
+    assert record.link_dest_ratio == 0.9  # noqa: PLR2004
+    assert record.throughput == 200  # noqa: PLR2004
+
+
+def test_show_stats_read_only(
+    tmp_path: Path, capsys: pytest.CaptureFixture[str],
+) -> None:
+    show_stats(working_dir=tmp_path)
+    assert capsys.readouterr().out == "No runs recorded.\n"
+    assert not (tmp_path / HISTORY_DB_NAME).exists()
+
+    # a database of an older schema is read without upgrading it
+    with sqlite3.connect(tmp_path / HISTORY_DB_NAME) as connection:
+        connection.execute(
+            "CREATE TABLE runs (id INTEGER PRIMARY KEY, branch TEXT, started_at REAL)")
+    assert RunHistory(tmp_path / HISTORY_DB_NAME).load() == []
+    show_stats(working_dir=tmp_path)
+    assert capsys.readouterr().out.startswith("No runs recorded in the last")
+    with sqlite3.connect(tmp_path / HISTORY_DB_NAME) as connection:
+        assert [row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")] == ["runs"]
+
+
+def test_run_history_stats() -> None:
+    assert percentile([5, 1, 4, 2, 3], 50) == 3  # noqa: PLR2004
+    assert percentile([5, 1, 4, 2, 3], 99) == 5  # noqa: PLR2004
+    assert trend([(0, 1)]) is None
+    assert trend([(0, 10), (30 * 24 * 3600, 20)]) == 10 / 15
+
+    records = [
+        make_record(3, 1, 1000, 10),
+        make_record(3, 2, 1000, 5),
+        make_record(15, 3, 1000, 100),
+        make_record(15, 4, 1000, 100),
+        make_record(21, 5, 1000, 1),  # a single run is not a trend
+    ]
+    assert best_schedule_hour(records) == (3, 150, 2)
+    report = format_branch_stats("p11", records)
+    assert report.startswith("Branch p11: 5 runs, 5 succeeded, 0 failed, 0 retries")
+    assert "link-dest hits" in report
+    assert "Suggested schedule window: 03:00-04:00" in report
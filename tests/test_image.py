@@ -0,0 +1,131 @@
+import os
+import tarfile
+from pathlib import Path
+
+import pytest
+
+from sisyphus_mirror.image import (
+    ImageIndex,
+    export_images,
+    export_snapshot,
+    import_image,
+    import_images,
+    index_path_of,
+)
+
+
+def make_snapshot(working_dir: Path, name: str, files: dict[str, bytes]) -> Path:
+    snapshot = working_dir / ".snapshots" / name
+    for path, content in files.items():
+        (snapshot / path).parent.mkdir(parents=True, exist_ok=True)
+        (snapshot / path).write_bytes(content)
+        os.utime(snapshot / path, (1000, 1000))
+    return snapshot
+
+
+def test_export_snapshot_full(tmp_path: Path) -> None:
+    snapshot = make_snapshot(tmp_path / "site", "p11-1", {
+        f"branch/x86_64/RPMS.classic/{name}.rpm": name.encode() * 3000
+        for name in ("bash", "coreutils", "grep")
+    })
+    (snapshot / "branch" / "RPMS.link").symlink_to("x86_64/RPMS.classic")
+
+    index = export_snapshot(snapshot, tmp_path / "images", frame_size=1)
+    image_path = tmp_path / "images" / "p11-1.tar.gz"
+
+    assert ImageIndex.load(index_path_of(image_path)) == index
+    assert len(index.frames) > len(index.files) == 3  # noqa: PLR2004 one member per frame
+    assert index.read_file(
+        image_path, "branch/x86_64/RPMS.classic/grep.rpm") == b"grep" * 3000
+    with pytest.raises(FileNotFoundError):
+        index.read_file(image_path, "branch/missing.rpm")
+    with tarfile.open(image_path) as tar:  # a plain tar.gz stream
+        assert tar.getmember("branch/RPMS.link").linkname == "x86_64/RPMS.classic"
+
+
+def test_export_images_dry_run(tmp_path: Path) -> None:
+    make_snapshot(tmp_path, "p11-1", {"branch/.timestamp": b"1"})
+    export_images(
+        working_dir=tmp_path, output=tmp_path / "images", snapshot="p11-1",
+        dry_run=True)
+    assert not (tmp_path / "images").exists()
+
+    export_images(working_dir=tmp_path, output=tmp_path / "images", branch_list=["p11"])
+    assert (tmp_path / "images" / "p11-1.tar.gz").is_file()
+
+
+def test_import_image_delta(tmp_path: Path) -> None:
+    site = tmp_path / "site"
+    first = make_snapshot(site, "p11-1", {
+        "branch/noarch/RPMS.classic/docs.rpm": b"docs",
+        "branch/x86_64/RPMS.classic/bash.rpm": b"bash",
+        "branch/x86_64/RPMS.classic/grep.rpm": b"grep",
+    })
+    second = make_snapshot(site, "p11-2", {"branch/.timestamp": b"2"})
+    (second / "branch" / "x86_64").mkdir()
+    # hard links from the previous snapshot, as rsync --link-dest makes them
+    (second / "branch" / "x86_64" / "RPMS.classic").mkdir()
+    os.link(
+        first / "branch" / "x86_64" / "RPMS.classic" / "bash.rpm",
+        second / "branch" / "x86_64" / "RPMS.classic" / "bash.rpm")
+    make_snapshot(site, "p11-2", {"branch/x86_64/RPMS.classic/sed.rpm": b"sed"})
+
+    images = tmp_path / "images"
+    full = export_snapshot(first, images)
+    delta = export_snapshot(second, images, base=first)
+    assert delta.base == "p11-1"
+    assert delta.base_files == [["branch/x86_64/RPMS.classic/bash.rpm", 4]]
+    assert sorted(path for path, *_ in delta.files) == [
+        "branch/.timestamp", "branch/x86_64/RPMS.classic/sed.rpm"]
+
+    mirror = tmp_path / "mirror"
+    with pytest.raises(RuntimeError, match="Base snapshot"):
+        import_image(images / delta.image, mirror)
+    import_images(
+        working_dir=mirror, images=[images / delta.image, images / full.image])
+
+    imported = mirror / ".snapshots" / "p11-2"
+    assert (mirror / "p11").resolve() == imported
+    rpms_dir = imported / "branch" / "x86_64" / "RPMS.classic"
+    assert sorted(path.name for path in rpms_dir.iterdir()) == ["bash.rpm", "sed.rpm"]
+    assert not (imported / "branch" / "noarch").exists()
+    assert (rpms_dir / "bash.rpm").stat().st_ino == (
+        mirror / ".snapshots" / "p11-1" / "branch" / "x86_64" / "RPMS.classic"
+        / "bash.rpm").stat().st_ino
+    assert (rpms_dir / "sed.rpm").stat().st_mtime == 1000  # noqa: PLR2004
+    assert not list((mirror / ".snapshots").glob("*_IMPORT__"))
+
+
+def test_import_image_checksum_mismatch(tmp_path: Path) -> None:
+    snapshot = make_snapshot(tmp_path / "site", "p11-1", {"branch/.timestamp": b"1"})
+    index = export_snapshot(snapshot, tmp_path / "images")
+    index.sha256 = "0" * 64
+    index.save(index_path_of(tmp_path / "images" / index.image))
+
+    with pytest.raises(ValueError, match="checksum mismatch"):
+        import_image(tmp_path / "images" / index.image, tmp_path / "mirror")
+    assert list((tmp_path / "mirror" / ".snapshots").iterdir()) == []
+
+
+def test_export_snapshot_split_view(tmp_path: Path) -> None:
+    part = make_snapshot(tmp_path, "p11.noarch-1", {
+        "branch/noarch/RPMS.classic/docs.rpm": b"docs"})
+    common = make_snapshot(tmp_path, "p11.common-1", {"branch/.timestamp": b"1"})
+    view = tmp_path / ".snapshots" / "p11-1"
+    (view / "branch").mkdir(parents=True)
+    (view / "branch" / "noarch").symlink_to(
+        Path("..", "..", part.name, "branch", "noarch"))
+    (view / "branch" / ".timestamp").symlink_to(
+        Path("..", "..", common.name, "branch", ".timestamp"))
+    (view / "branch" / "local.link").symlink_to("noarch")
+
+    index = export_snapshot(view, tmp_path / "images")
+
+    assert [path for path, *_ in index.files] == [
+        "branch/.timestamp", "branch/noarch/RPMS.classic/docs.rpm"]
+    mirror = tmp_path / "mirror"
+    import_image(tmp_path / "images" / index.image, mirror)
+    imported = mirror / ".snapshots" / "p11-1" / "branch"
+    assert not (imported / ".timestamp").is_symlink()
+    assert (imported / ".timestamp").read_bytes() == b"1"
+    assert (imported / "local.link").readlink() == Path("noarch")
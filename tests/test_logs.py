@@ -0,0 +1,122 @@
+import gzip
+from pathlib import Path
+
+import pytest
+
+from sisyphus_mirror.logs import LogRequest, SpaceSaving, analyze_logs, parse_log_line
+
+NGINX_LINE = (
+    '192.0.2.1 - - [01/Mar/2026:12:00:00 +0000] '
+    '"GET /pub/distributions/ALTLinux/p11/branch/{path} HTTP/1.1" {status} 1000 '
+    '"-" "apt"\n'
+)
+RSYNCD_LINE = (
+    "2026/03/01 12:00:00 [1234] send client.example.org [192.0.2.2] ALTLinux () "
+    "p11/branch/{path} 2000\n"
+)
+
+
+def test_parse_log_line() -> None:
+    bash = "x86_64/RPMS.classic/bash-5.2.37-alt1.x86_64.rpm"
+    assert parse_log_line(NGINX_LINE.format(path=bash, status=200)) == LogRequest(
+        "p11", bash, 1000)
+    assert parse_log_line(RSYNCD_LINE.format(path=bash)) == LogRequest(
+        "p11", bash, 2000)
+    assert parse_log_line(NGINX_LINE.format(path=bash, status=404)) is None
+    assert parse_log_line(NGINX_LINE.format(path="x86_64/", status=200)) is None
+    assert parse_log_line("2026/03/01 12:00:00 [1234] connect from host\n") is None
+
+    request = LogRequest("p11", bash, 1000)
+    assert (request.arch, request.directory) == ("x86_64", "x86_64/RPMS.classic")
+    assert request.package == "x86_64/RPMS.classic/bash"
+    assert LogRequest("p11", "list/list.txt", 0).arch == "common"
+    assert LogRequest("p11", "x86_64/base/release", 0).package is None
+
+
+def test_space_saving() -> None:
+    counter = SpaceSaving(4)
+    for key in "aaaaabbbbcdefga":
+        counter.add(key)
+
+    assert counter.top(2) == [("a", 6, 0), ("b", 4, 0)]
+    assert len(counter.counts) == 4  # noqa: PLR2004
+    assert counter.top(4)[-1] == ("f", 2, 1)  # overestimated by the evicted "d"
+    assert counter.upper_bound("c") == 2  # noqa: PLR2004
+    assert SpaceSaving(4).upper_bound("a") == 0
+
+
+def make_tree(working_dir: Path, files: list[str]) -> None:
+    snapshot = working_dir / ".snapshots" / "p11-20260301000000000000"
+    for path in files:
+        (snapshot / "branch" / path).parent.mkdir(parents=True, exist_ok=True)
+        (snapshot / "branch" / path).write_bytes(b"x" * 100)
+    (working_dir / "p11").symlink_to(snapshot.relative_to(working_dir))
+
+
+def test_analyze_logs(
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    make_tree(tmp_path, [
+        "noarch/RPMS.classic/docs-1.0-alt1.noarch.rpm",
+        "x86_64/RPMS.classic/bash-5.2.37-alt1.x86_64.rpm",
+        "x86_64/RPMS.gostcrypto/openssl-gost-3.0-alt1.x86_64.rpm",
+        "x86_64-i586/RPMS.classic/glibc-2.38-alt1.i586.rpm",
+    ])
+    bash = "x86_64/RPMS.classic/bash-{}-alt1.x86_64.rpm"
+    docs = "noarch/RPMS.classic/docs-1.0-alt1.noarch.rpm"
+    (tmp_path / "access.log").write_text(
+        NGINX_LINE.format(path=bash.format("5.2.37"), status=200) * 3
+        + NGINX_LINE.format(path=docs, status=200)
+        + NGINX_LINE.format(path="aarch64/RPMS.classic/a-1-alt1.rpm", status=200))
+    with gzip.open(tmp_path / "rsyncd.log.1.gz", "wt") as file:
+        file.write(RSYNCD_LINE.format(path=bash.format("5.2.36")) * 2)
+    hot_list = tmp_path / "hot.lst"
+
+    analyze_logs(
+        working_dir=tmp_path,
+        logs=[tmp_path / "access.log", tmp_path / "rsyncd.log.1.gz"],
+        branch_list=["p11"],
+        arch_list=["noarch", "x86_64", "x86_64-i586"],
+        exclude_files=["SRPMS"],
+        rate_limit="100k",
+        hot_list=hot_list,
+        top=5,
+    )
+
+    output = capsys.readouterr().out
+    assert "Parsed 7 repository requests of 7 lines" in output
+    assert "       5  x86_64/RPMS.classic/bash\n" in output
+    assert 'arch_list = ["noarch", "x86_64"]' in output
+    assert 'exclude_files = ["SRPMS", "/branch/x86_64/RPMS.gostcrypto/"]' in output
+    assert "Saves 200 B per full snapshot, 0s of transfer at 100.0 KiB/s" in output
+    assert "Requested but not mirrored: aarch64 (1 requests)" in output
+    # the latest requested version without package lists to resolve it
+    assert hot_list.read_text().splitlines() == [
+        f"p11/branch/{bash.format('5.2.36')}",
+        "p11/branch/aarch64/RPMS.classic/a-1-alt1.rpm",
+        f"p11/branch/{docs}",
+    ]
+
+
+def test_analyze_logs_without_requests(
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    make_tree(tmp_path, ["x86_64/RPMS.classic/bash-5.2.37-alt1.x86_64.rpm"])
+    (tmp_path / "access.log").write_text(
+        "unknown format p11/branch/x86_64/RPMS.classic/bash.rpm\n"
+        + NGINX_LINE.replace("p11", "p10").format(
+            path="x86_64/base/release", status=200))
+
+    analyze_logs(
+        working_dir=tmp_path,
+        logs=[tmp_path / "access.log"],
+        branch_list=["p11"],
+        arch_list=["noarch", "x86_64"],
+    )
+
+    output = capsys.readouterr().out
+    assert "Parsed 1 repository requests of 2 lines" in output
+    assert "No repository requests for branches p11" in output
+    assert "arch_list" not in output
@@ -1,6 +1,13 @@
+import asyncio
 from pathlib import Path
 
-from sisyphus_mirror.mirror import BranchMirror
+import pytest
+
+from sisyphus_mirror.fanout import BatchInfo, BatchStore
+from sisyphus_mirror.filters import FilterEvaluator, FilterRule
+from sisyphus_mirror.history import HISTORY_DB_NAME, RunHistory
+from sisyphus_mirror.mirror import BranchMirror, mirror_branch
+from sisyphus_mirror.snapshots import find_snapshots
 
 
 def test_branch_mirror_paths() -> None:
@@ -29,18 +36,299 @@ def test_branch_mirror_rsync_cmd() -> None:
         "--delete-excluded",
         "--stats",
         "--chmod=Du+w",
-        "--exclude=*debuginfo*",
-        "--exclude=SRPMS",
-        "--include=list/**",
-        "--include=.timestamp",
-        "--include=noarch/**",
-        "--include=x86_64/**",
-        "--include=x86_64-i586/**",
-        "--include=*/",
-        "--exclude=*",
+        f"--filter=merge {custom_home}/.filters/{branch}.rules",
         "--bwlimit=5m",
         "--contimeout=60",
         "--timeout=600",
         f"--partial-dir={custom_home}/.partial/{branch}",
         f"rsync://ftp.altlinux.org/ALTLinux/{branch}/branch",
         f"{custom_home}/.snapshots/__{branch}_UNCOMPLETE__/"]
+
+
+def test_mirror_branch(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    def prepare_rsync_cmd(self: BranchMirror) -> list[str]:
+        return ["touch", f"{self.dest_dir}/.timestamp"]
+
+    monkeypatch.setattr(BranchMirror, "prepare_rsync_cmd", prepare_rsync_cmd)
+
+    first = asyncio.run(mirror_branch("p11", working_dir=tmp_path))
+    second = asyncio.run(mirror_branch("p11", working_dir=tmp_path))
+
+    assert first is not None
+    assert second is not None
+    assert not first.exists()
+    assert (second / ".timestamp").exists()
+    assert (tmp_path / "p11").resolve() == second
+    assert not (tmp_path / ".snapshots" / "__p11_IN_PROCESS__").exists()
+
+    records = RunHistory(tmp_path / HISTORY_DB_NAME).load()
+    assert [record.status for record in records] == ["ok", "ok"]
+    assert records[-1].snapshot == second.name
+    assert set(records[-1].phases) == {"sync", "warmup", "delete"}
+
+
+def test_mirror_branch_failed(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(BranchMirror, "prepare_rsync_cmd", lambda _: ["false"])
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(mirror_branch("p11", working_dir=tmp_path))
+    assert not (tmp_path / ".snapshots" / "__p11_IN_PROCESS__").exists()
+    assert not (tmp_path / "p11").exists()
+
+    [record] = RunHistory(tmp_path / HISTORY_DB_NAME).load()
+    assert record.status == "failed"
+    assert record.retries == 2  # noqa: PLR2004
+
+
+def test_mirror_branch_peer_seeding(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    def prepare_rsync_cmd(self: BranchMirror, peer_url: str | None = None) -> list[str]:
+        if peer_url == "rsync://down.lan/ALTLinux":
+            return ["false"]
+        name = "seed" if peer_url else ".timestamp"
+        return ["touch", f"{self.dest_dir}/{name}"]
+
+    monkeypatch.setattr(BranchMirror, "prepare_rsync_cmd", prepare_rsync_cmd)
+
+    peer_urls = ["rsync://down.lan/ALTLinux", "rsync://up.lan/ALTLinux"]
+    snapshot = asyncio.run(
+        mirror_branch("p11", working_dir=tmp_path, peer_urls=peer_urls))
+
+    assert snapshot is not None
+    assert (snapshot / "seed").exists()
+    assert (snapshot / ".timestamp").exists()
+    [record] = RunHistory(tmp_path / HISTORY_DB_NAME).load()
+    assert record.peer_bytes == {"rsync://up.lan/ALTLinux": 0}
+
+
+def test_branch_mirror_peer_cmd() -> None:
+    instance = BranchMirror(branch="p11", branch_list=["p11"])
+    upstream_cmd = instance.prepare_rsync_cmd()
+    peer_cmd = instance.prepare_rsync_cmd("rsync://mirror.lan/ALTLinux")
+
+    assert "--bwlimit=5m" in upstream_cmd
+    assert "--bwlimit=5m" not in peer_cmd
+    assert "rsync://mirror.lan/ALTLinux/p11/branch" in peer_cmd
+
+
+def test_mirror_branch_hot_list(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    hot_list = tmp_path / "hot.lst"
+    hot_list.write_text(
+        "p11/branch/x86_64/RPMS.classic/bash-5.2-alt1.x86_64.rpm\n"
+        "p10/branch/x86_64/RPMS.classic/bash-5.1-alt1.x86_64.rpm\n")
+    files_from: list[str] = []
+
+    def prepare_hot_rsync_cmd(self: BranchMirror, path: Path) -> list[str]:
+        files_from.extend(path.read_text().splitlines())
+        return ["touch", f"{self.dest_dir}/hot"]
+
+    monkeypatch.setattr(
+        BranchMirror, "prepare_rsync_cmd",
+        lambda self: ["touch", f"{self.dest_dir}/.timestamp"])
+    monkeypatch.setattr(BranchMirror, "prepare_hot_rsync_cmd", prepare_hot_rsync_cmd)
+
+    snapshot = asyncio.run(
+        mirror_branch("p11", working_dir=tmp_path, hot_list=hot_list))
+
+    assert snapshot is not None
+    assert (snapshot / "hot").exists()
+    assert files_from == ["branch/x86_64/RPMS.classic/bash-5.2-alt1.x86_64.rpm"]
+    monkeypatch.undo()
+    hot_cmd = BranchMirror(
+        branch="p11", branch_list=["p11"]).prepare_hot_rsync_cmd(hot_list)
+    assert f"--files-from={hot_list}" in hot_cmd
+    assert "rsync://ftp.altlinux.org/ALTLinux/p11/" in hot_cmd
+
+
+def test_mirror_branch_dry_run_no_side_effects(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    def prepare_rsync_cmd(self: BranchMirror) -> list[str]:
+        assert self.filter_path.read_text()
+        return ["true"]
+
+    monkeypatch.setattr(BranchMirror, "prepare_rsync_cmd", prepare_rsync_cmd)
+    working_dir = tmp_path / "missing"
+    assert asyncio.run(mirror_branch(
+        "p11", working_dir=working_dir, dry_run=True)) is None
+    assert not working_dir.exists()
+
+
+def test_mirror_branch_fanout(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    def prepare_rsync_cmd(self: BranchMirror) -> list[str]:
+        assert self.write_batch is not None
+        self.write_batch.write_bytes(b"batch")
+        return ["touch", f"{self.dest_dir}/.timestamp"]
+
+    def prepare_read_batch_cmd(self: BranchMirror, batch: BatchInfo) -> list[str]:
+        assert self.batch_store is not None
+        assert self.batch_store.path(batch).exists()
+        return ["touch", f"{self.dest_dir}/.timestamp"]
+
+    monkeypatch.setattr(BranchMirror, "prepare_rsync_cmd", prepare_rsync_cmd)
+    monkeypatch.setattr(BranchMirror, "prepare_read_batch_cmd", prepare_read_batch_cmd)
+    batch_dir = tmp_path / "batches"
+    batch_dir.mkdir()
+    primary_dir = tmp_path / "primary"
+    replica_dir = tmp_path / "replica"
+    primary_dir.mkdir()
+    replica_dir.mkdir()
+
+    asyncio.run(mirror_branch(
+        "p11", working_dir=primary_dir,
+        fanout={"role": "primary", "batch_dir": batch_dir}))
+    [batch] = BatchStore(batch_dir).find_batches("p11")
+    assert batch.base is None
+
+    monkeypatch.setattr(BranchMirror, "prepare_rsync_cmd", lambda _: ["false"])
+    snapshot = asyncio.run(mirror_branch(
+        "p11", working_dir=replica_dir,
+        fanout={"role": "replica", "batch_dir": batch_dir}))
+    assert snapshot is not None
+    assert (snapshot / ".timestamp").exists()
+
+    # the replica base does not match the batch base anymore
+    with pytest.raises(RuntimeError):
+        asyncio.run(mirror_branch(
+            "p11", working_dir=replica_dir,
+            fanout={"role": "replica", "batch_dir": batch_dir}))
+
+
+def test_mirror_branch_fanout_retry(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    commands: list[bool] = []
+
+    def prepare_rsync_cmd(self: BranchMirror) -> list[str]:
+        commands.append(self.write_batch is not None)
+        if len(commands) == 1:
+            (self.dest_dir / "partial").touch()
+            return ["false"]
+        return ["touch", f"{self.dest_dir}/.timestamp"]
+
+    monkeypatch.setattr(BranchMirror, "prepare_rsync_cmd", prepare_rsync_cmd)
+    batch_dir = tmp_path / "batches"
+    batch_dir.mkdir()
+
+    snapshot = asyncio.run(mirror_branch(
+        "p11", working_dir=tmp_path / "primary",
+        fanout={"role": "primary", "batch_dir": batch_dir}))
+    assert snapshot is not None
+    assert (snapshot / ".timestamp").exists()
+    # the retry runs against a partly filled tree, no batch is published
+    assert commands == [True, False]
+    assert list(batch_dir.iterdir()) == []
+
+
+def test_branch_mirror_package_filter_cmd() -> None:
+    custom_home = Path("/custom-path")
+    instance = BranchMirror(
+        branch="p11", branch_list=["p11"], working_dir=custom_home,
+        package_filter={"exclude_groups": ["Games"]})
+
+    metadata_cmd = instance.prepare_metadata_rsync_cmd(custom_home / "metadata")
+    assert "--include=x86_64/base/**" in metadata_cmd
+    assert metadata_cmd[-2:] == [
+        "rsync://ftp.altlinux.org/ALTLinux/p11/branch", f"{custom_home}/metadata/"]
+
+    assert instance.filter_rules()[-2:] == [
+        FilterRule("+", "*/"), FilterRule("-", "*")]
+    instance.selected_packages = []
+    rules = [str(rule) for rule in instance.filter_rules()]
+    assert rules.index("- *.rpm") < rules.index("+ x86_64/**")
+
+
+def test_branch_mirror_filter_rules() -> None:
+    instance = BranchMirror(
+        branch="Sisyphus", branch_list=["Sisyphus"],
+        include_files=["list/**", "list/**", ".timestamp"])
+
+    assert [str(rule) for rule in instance.filter_rules()] == [
+        "- *debuginfo*",
+        "- SRPMS",
+        "+ list/**",
+        "+ .timestamp",
+        "+ noarch/**",
+        "+ x86_64/**",
+        "+ x86_64-i586/**",
+        "+ */",
+        "- *",
+    ]
+
+
+def test_branch_mirror_part_filter_rules() -> None:
+    arch_part = FilterEvaluator(BranchMirror(
+        branch="p11", branch_list=["p11"], part="x86_64").filter_rules())
+    common_part = FilterEvaluator(BranchMirror(
+        branch="p11", branch_list=["p11"], part="common").filter_rules())
+
+    assert arch_part.is_included("branch/x86_64/RPMS.classic/bash.rpm")
+    assert not arch_part.is_included("branch/x86_64-i586/RPMS.classic/bash.rpm")
+    assert not arch_part.is_included("branch/noarch/RPMS.classic/docs.rpm")
+    assert not arch_part.is_included("branch/.timestamp")
+    assert common_part.is_included("branch/.timestamp")
+    assert common_part.is_included("branch/list/list.txt")
+    assert not common_part.is_included("branch/noarch/RPMS.classic/docs.rpm")
+
+
+def test_mirror_branch_split_arch(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    fingerprints = {"common": "a", "noarch": "a", "x86_64": "a"}
+
+    def prepare_rsync_cmd(self: BranchMirror) -> list[str]:
+        part_dir = self.dest_dir / "branch" / (
+            "list" if self.part == "common" else str(self.part))
+        part_dir.mkdir(parents=True)
+        (part_dir / fingerprints[str(self.part)]).touch()
+        return ["true"]
+
+    async def list_upstream(self: BranchMirror) -> str:
+        return fingerprints[str(self.part)]
+
+    monkeypatch.setattr(BranchMirror, "prepare_rsync_cmd", prepare_rsync_cmd)
+    monkeypatch.setattr(BranchMirror, "list_upstream", list_upstream)
+    options = {
+        "working_dir": tmp_path,
+        "arch_list": ["noarch", "x86_64"],
+        "split_arch": {"enabled": True},
+    }
+
+    first = asyncio.run(mirror_branch("p11", **options))  # type: ignore[arg-type]
+    assert first is not None
+    assert (tmp_path / "p11" / "branch" / "noarch" / "a").exists()
+    assert (tmp_path / "p11" / "branch" / "list" / "a").exists()
+    first_x86_64 = (first / "branch" / "x86_64").readlink()
+    assert str(first_x86_64).startswith("../../p11.x86_64-")
+
+    # quiet parts cost no snapshot and no new view
+    assert asyncio.run(mirror_branch("p11", **options)) is None  # type: ignore[arg-type]
+
+    fingerprints["noarch"] = "b"
+    second = asyncio.run(mirror_branch("p11", **options))  # type: ignore[arg-type]
+    assert second is not None
+    assert not first.exists()
+    assert (second / "branch" / "x86_64").readlink() == first_x86_64
+    assert (tmp_path / "p11" / "branch" / "noarch" / "b").exists()
+    assert len(find_snapshots(tmp_path, "p11.noarch")) == 1
+    assert len(find_snapshots(tmp_path, "p11.x86_64")) == 1
+
+    fingerprints["noarch"] = "c"
+    options["split_arch"] = {
+        "enabled": True, "parts": [{"name": "noarch", "min_interval": 60}]}
+    assert asyncio.run(mirror_branch("p11", **options)) is None  # type: ignore[arg-type]
+
+
+def test_find_snapshots_part_names(tmp_path: Path) -> None:
+    for name in ("p11-1", "p11.x86_64-2", "p11.x86_64-i586-3", "__p11_UNCOMPLETE__"):
+        (tmp_path / ".snapshots" / name).mkdir(parents=True)
+
+    assert [path.name for path in find_snapshots(tmp_path, "p11")] == ["p11-1"]
+    assert [path.name for path in find_snapshots(tmp_path, "p11.x86_64")] == [
+        "p11.x86_64-2"]
@@ -0,0 +1,123 @@
+import hashlib
+import lzma
+import struct
+from pathlib import Path
+
+import pytest
+
+from sisyphus_mirror.packages import (
+    CRPMTAG_DIRECTORY,
+    CRPMTAG_FILENAME,
+    CRPMTAG_FILESIZE,
+    HEADER_MAGIC,
+    RPM_INT32_TYPE,
+    RPM_STRING_ARRAY_TYPE,
+    RPM_STRING_TYPE,
+    RPMTAG_GROUP,
+    RPMTAG_NAME,
+    RPMTAG_PROVIDENAME,
+    RPMTAG_REQUIRENAME,
+    PackageSelector,
+    read_branch_packages,
+    rewrite_indexes,
+)
+
+
+def make_header(
+    name: str,
+    group: str,
+    size: int,
+    requires: tuple[str, ...] = (),
+    provides: tuple[str, ...] = (),
+) -> bytes:
+    entries: list[tuple[int, int, bytes, int]] = [
+        (RPMTAG_NAME, RPM_STRING_TYPE, f"{name}\0".encode(), 1),
+        (RPMTAG_GROUP, RPM_STRING_TYPE, f"{group}\0".encode(), 1),
+        (CRPMTAG_FILENAME, RPM_STRING_TYPE, f"{name}-1.0-alt1.rpm\0".encode(), 1),
+        (CRPMTAG_DIRECTORY, RPM_STRING_TYPE, b"RPMS.classic\0", 1),
+        (CRPMTAG_FILESIZE, RPM_INT32_TYPE, struct.pack(">I", size), 1),
+    ]
+    for tag, values in ((RPMTAG_REQUIRENAME, requires), (RPMTAG_PROVIDENAME, provides)):
+        if values:
+            data = b"".join(f"{value}\0".encode() for value in values)
+            entries.append((tag, RPM_STRING_ARRAY_TYPE, data, len(values)))
+
+    index = b""
+    store = b""
+    for tag, type_, data, count in entries:
+        if type_ == RPM_INT32_TYPE:
+            store += b"\0" * (-len(store) % 4)
+        index += struct.pack(">IIII", tag, type_, len(store), count)
+        store += data
+    return HEADER_MAGIC + struct.pack(">II", len(entries), len(store)) + index + store
+
+
+@pytest.fixture
+def branch_dir(tmp_path: Path) -> Path:
+    base_dir = tmp_path / "x86_64" / "base"
+    base_dir.mkdir(parents=True)
+    pkglist = b"".join([
+        make_header("bash", "Shells", 1000, provides=("/bin/sh",)),
+        make_header("coreutils", "System/Base", 2000, requires=("/bin/sh",)),
+        make_header("supertux", "Games/Arcade", 500_000_000, requires=("libSDL",)),
+        make_header("libSDL", "System/Libraries", 3000),
+    ])
+    (base_dir / "pkglist.classic").write_bytes(pkglist)
+    (base_dir / "pkglist.classic.xz").write_bytes(lzma.compress(pkglist))
+    digest = hashlib.md5(pkglist).hexdigest()  # noqa: S324
+    (base_dir / "release").write_text(
+        "Origin: ALT Linux Team\n"
+        "MD5Sum:\n"
+        f" {digest} {len(pkglist)} base/pkglist.classic\n",
+    )
+    return tmp_path
+
+
+def test_read_branch_packages(branch_dir: Path) -> None:
+    packages = read_branch_packages(branch_dir, ["x86_64"])
+    assert [package.name for package in packages] == [
+        "bash", "coreutils", "supertux", "libSDL"]
+    assert packages[0].path == "x86_64/RPMS.classic/bash-1.0-alt1.rpm"
+    assert packages[0].provides == ("/bin/sh",)
+    assert packages[2].group == "Games/Arcade"
+    assert packages[2].size == 500_000_000  # noqa: PLR2004
+
+
+def test_package_selector(branch_dir: Path) -> None:
+    packages = read_branch_packages(branch_dir, ["x86_64"])
+
+    def names(selector: PackageSelector) -> list[str]:
+        return [package.name for package in selector.select(packages)]
+
+    assert names(PackageSelector(exclude_groups=["Games"])) == [
+        "bash", "coreutils", "libSDL"]
+    assert names(PackageSelector(max_size="1M")) == ["bash", "coreutils", "libSDL"]
+    assert names(PackageSelector(exclude_names=["^lib"])) == [
+        "bash", "coreutils", "supertux"]
+    assert names(PackageSelector(include_names=["^bash$"])) == ["bash"]
+    assert names(PackageSelector(include_names=["^core"])) == ["bash", "coreutils"]
+    assert names(PackageSelector(include_names=["^super"], max_size="1G")) == [
+        "supertux", "libSDL"]
+    assert names(PackageSelector(closure_of=["coreutils"])) == ["bash", "coreutils"]
+    assert names(PackageSelector(closure_of=["supertux"], max_size="1G")) == [
+        "supertux", "libSDL"]
+
+
+def test_rewrite_indexes(branch_dir: Path) -> None:
+    packages = read_branch_packages(branch_dir, ["x86_64"])
+    selected = PackageSelector(exclude_groups=["Games"]).select(packages)
+    base_dir = branch_dir / "x86_64" / "base"
+    old_inode = (base_dir / "pkglist.classic").stat().st_ino
+
+    rewritten = rewrite_indexes(branch_dir, packages, selected)
+
+    assert rewritten == [base_dir / "pkglist.classic", base_dir / "pkglist.classic.xz"]
+    assert (base_dir / "pkglist.classic").stat().st_ino != old_inode
+    assert read_branch_packages(branch_dir, ["x86_64"]) == selected
+    pkglist = (base_dir / "pkglist.classic").read_bytes()
+    assert lzma.decompress((base_dir / "pkglist.classic.xz").read_bytes()) == pkglist
+    digest = hashlib.md5(pkglist).hexdigest()  # noqa: S324
+    assert f" {digest} {len(pkglist)} base/pkglist.classic\n" in (
+        base_dir / "release").read_text()
+
+    assert rewrite_indexes(branch_dir, selected, selected) == []
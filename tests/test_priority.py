@@ -0,0 +1,42 @@
+import asyncio
+import os
+from pathlib import Path
+
+from sisyphus_mirror.priority import PhasePriority
+from sisyphus_mirror.process import run_blocking, run_process
+
+
+def test_phase_priority_ioprio() -> None:
+    assert PhasePriority().ioprio is None
+    assert PhasePriority(io_class="idle", io_level=7).ioprio == 3 << 13
+    assert PhasePriority(io_class="best-effort", io_level=7).ioprio == (2 << 13) | 7
+
+
+def test_phase_priority_not_configured(tmp_path: Path) -> None:
+    priority = PhasePriority()
+    assert priority.thread_initializer() is None
+    assert priority.child_preexec() is None
+    assert priority.prepare_cgroup("sync", tmp_path) is None
+
+
+def test_phase_priority_thread_initializer() -> None:
+    priority = PhasePriority(nice=19, io_class="idle")
+    main_nice = os.getpriority(os.PRIO_PROCESS, 0)
+
+    async def thread_nice() -> int:
+        return await run_blocking(
+            os.getpriority, os.PRIO_PROCESS, 0,
+            initializer=priority.thread_initializer(),
+        )
+
+    assert asyncio.run(thread_nice()) == 19  # noqa: PLR2004
+    assert os.getpriority(os.PRIO_PROCESS, 0) == main_nice
+
+
+def test_phase_priority_child_preexec(tmp_path: Path) -> None:
+    nice_path = tmp_path / "nice"
+    preexec_fn = PhasePriority(nice=19, io_class="idle").child_preexec()
+    returncode = asyncio.run(run_process(
+        ["sh", "-c", f"nice > {nice_path}"], preexec_fn=preexec_fn))
+    assert returncode == 0
+    assert nice_path.read_text().strip() == "19"
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from sisyphus_mirror.process import run_blocking, run_process
+
+
+def is_running(pid: int) -> bool:
+    status_path = Path(f"/proc/{pid}/status")
+    try:
+        status = status_path.read_text()
+    except FileNotFoundError:
+        return False
+    return "State:\tZ" not in status
+
+
+def test_run_process_returncode() -> None:
+    assert asyncio.run(run_process(["true"])) == 0
+    assert asyncio.run(run_process(["false"])) == 1
+
+
+def test_run_process_timeout_kills_group(tmp_path: Path) -> None:
+    pid_path = tmp_path / "pid"
+
+    async def run_with_timeout() -> None:
+        async with asyncio.timeout(0.5):
+            await run_process(["sh", "-c", f"sleep 30 & echo $! > {pid_path}; wait"])
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(run_with_timeout())
+    time.sleep(0.1)
+    assert not is_running(int(pid_path.read_text()))
+
+
+def test_run_blocking_waits_for_thread_on_cancel() -> None:
+    finished: list[bool] = []
+
+    def blocking() -> None:
+        time.sleep(0.2)
+        finished.append(True)
+
+    async def cancel_blocking() -> None:
+        task = asyncio.create_task(run_blocking(blocking))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_blocking())
+    assert finished == [True]
+
+
+def test_run_blocking_on_cancel_stops_thread() -> None:
+    stop = threading.Event()
+
+    async def cancel_blocking() -> None:
+        task = asyncio.create_task(
+            run_blocking(stop.wait, 10, on_cancel=stop.set))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    started = time.monotonic()
+    asyncio.run(cancel_blocking())
+    assert stop.is_set()
+    assert time.monotonic() - started < 5  # noqa: PLR2004
@@ -0,0 +1,201 @@
+import os
+import shutil
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from sisyphus_mirror.filters import FilterRule, build_filter_rules
+from sisyphus_mirror.proxy import (
+    CACHE_SUBDIR,
+    PullThroughCache,
+    make_proxy_server,
+    normalize_request_path,
+)
+
+RPM_PATH = "p11/branch/aarch64/RPMS.classic/foo-1.0-alt1.aarch64.rpm"
+
+
+class SlowHandler(SimpleHTTPRequestHandler):
+    requests: list[str] = []  # noqa: RUF012
+
+    def do_GET(self) -> None:
+        self.requests.append(self.path)
+        time.sleep(0.2)  # a window for concurrent requests
+        super().do_GET()
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def upstream(tmp_path: Path) -> Iterator[tuple[str, Path]]:
+    root = tmp_path / "upstream"
+    (root / RPM_PATH).parent.mkdir(parents=True)
+    (root / RPM_PATH).write_bytes(b"rpm" * 100)
+    SlowHandler.requests = []
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(SlowHandler, directory=str(root)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", root
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def proxy_url(tmp_path: Path, upstream: tuple[str, Path]) -> Iterator[str]:
+    working_dir = tmp_path / "mirror"
+    (working_dir / "p11" / "branch").mkdir(parents=True)
+    (working_dir / "p11" / "branch" / "local.txt").write_text("local")
+    (working_dir / ".history.sqlite3").write_text("private")
+    server = make_proxy_server(
+        working_dir=working_dir,
+        proxy={"bind": "127.0.0.1", "port": 0, "upstream_url": upstream[0]},
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(url: str) -> bytes:
+    with urlopen(url, timeout=10) as response:  # noqa: S310
+        return bytes(response.read())
+
+
+def test_normalize_request_path() -> None:
+    assert normalize_request_path("/p11/branch/a%20b.rpm?x=1") == "p11/branch/a b.rpm"
+    assert normalize_request_path("/../../etc/passwd") == "etc/passwd"
+    assert normalize_request_path("/.snapshots/p11-1/x") is None
+    assert normalize_request_path("/") is None
+    assert normalize_request_path("/p11/branch/aarch64/") is None
+
+
+def test_proxy_serves_local_and_cached_files(
+    proxy_url: str,
+    upstream: tuple[str, Path],
+    tmp_path: Path,
+) -> None:
+    assert fetch(f"{proxy_url}/p11/branch/local.txt") == b"local"
+    assert SlowHandler.requests == []
+
+    with ThreadPoolExecutor(4) as executor:
+        bodies = list(executor.map(fetch, [f"{proxy_url}/{RPM_PATH}"] * 4))
+    assert bodies == [b"rpm" * 100] * 4
+    assert SlowHandler.requests == [f"/{RPM_PATH}"]  # coalesced
+    assert (tmp_path / "mirror" / CACHE_SUBDIR / RPM_PATH).exists()
+
+    (upstream[1] / RPM_PATH).unlink()
+    assert fetch(f"{proxy_url}/{RPM_PATH}") == b"rpm" * 100  # cache hit
+
+    for path in ("p11/branch/missing.rpm", ".history.sqlite3"):
+        with pytest.raises(HTTPError) as error:
+            fetch(f"{proxy_url}/{path}")
+        assert error.value.code == 404  # noqa: PLR2004
+
+
+def test_pull_through_cache_lru(tmp_path: Path, upstream: tuple[str, Path]) -> None:
+    url, root = upstream
+    for name in ("a", "b", "c"):
+        (root / name).write_bytes(b"x" * 100)
+    cache = PullThroughCache(tmp_path / "cache", url, max_bytes=250)
+    cache.load()
+
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")  # b is the least recently used now
+    cache.get("c")
+    assert list(cache.entries) == ["a", "c"]
+    assert not (tmp_path / "cache" / "b").exists()
+    assert cache.total_bytes == 200  # noqa: PLR2004
+
+
+def test_pull_through_cache_revalidates_metadata(
+    tmp_path: Path, upstream: tuple[str, Path],
+) -> None:
+    url, root = upstream
+    release = "p11/branch/aarch64/base/release"
+    (root / release).parent.mkdir(parents=True)
+    (root / release).write_text("old")
+    os.utime(root / release, (1000, 1000))
+    cache = PullThroughCache(tmp_path / "cache", url, max_bytes=10000)
+    cache.load()
+
+    assert cache.get(release).read_text() == "old"
+    assert cache.get(release).read_text() == "old"  # checked recently
+    cache.get(RPM_PATH)
+    cache.validated.clear()
+    assert cache.get(release).read_text() == "old"  # not modified
+    cache.get(RPM_PATH)  # packages are never revalidated
+    assert SlowHandler.requests == [f"/{release}", f"/{RPM_PATH}", f"/{release}"]
+
+    (root / release).write_text("new")
+    cache.validated.clear()
+    assert cache.get(release).read_text() == "new"
+    assert cache.total_bytes == len("new") + len(b"rpm" * 100)
+
+    (root / release).unlink()
+    cache.validated.clear()
+    with pytest.raises(FileNotFoundError):
+        cache.get(release)
+    assert list(cache.entries) == [RPM_PATH]
+
+
+def test_pull_through_cache_directory(
+    tmp_path: Path, upstream: tuple[str, Path],
+) -> None:
+    cache_dir = tmp_path / "cache"
+    cache = PullThroughCache(cache_dir, upstream[0], max_bytes=1000)
+    cache.load()
+    directory = RPM_PATH.rsplit("/", 1)[0]
+    with pytest.raises(IsADirectoryError):
+        cache.get(directory)  # redirected to the index page
+    with pytest.raises(IsADirectoryError):
+        cache.get(f"{directory}/")
+    assert not cache.entries
+    assert list(cache_dir.rglob(".*.part")) == []
+    assert cache.get(RPM_PATH).read_bytes() == b"rpm" * 100
+
+    # an index page cached in place of a directory
+    shutil.rmtree(cache_dir / "p11")
+    (cache_dir / "p11" / "branch").mkdir(parents=True)
+    (cache_dir / "p11" / "branch" / "aarch64").write_text("<html>")
+    cache.load()
+    assert cache.get(RPM_PATH).read_bytes() == b"rpm" * 100
+    assert list(cache.entries) == [RPM_PATH]
+    assert cache.total_bytes == len(b"rpm" * 100)
+
+
+def test_pull_through_cache_load_evicts(tmp_path: Path) -> None:
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    for name in ("a", "b", "c"):
+        (cache_dir / name).write_bytes(b"x" * 100)
+    cache = PullThroughCache(cache_dir, "http://127.0.0.1:9", max_bytes=150)
+    cache.load()
+    assert len(cache.entries) == 1
+    assert len(list(cache_dir.iterdir())) == 1
+
+
+def test_proxy_directory_request(proxy_url: str) -> None:
+    directory = RPM_PATH.rsplit("/", 1)[0]
+    for path in (directory, f"{directory}/"):
+        with pytest.raises(HTTPError) as error:
+            fetch(f"{proxy_url}/{path}")
+        assert error.value.code == 404  # noqa: PLR2004
+    assert fetch(f"{proxy_url}/{RPM_PATH}") == b"rpm" * 100
+
+
+def test_lazy_arch_filter_rules() -> None:
+    rules = build_filter_rules(
+        arch_list=["noarch"], lazy_arch_list=["aarch64"], include_files=[])
+    assert FilterRule("+", "aarch64/base/**") in rules
+    assert FilterRule("+", "aarch64/**") not in rules
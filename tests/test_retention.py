@@ -0,0 +1,139 @@
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from sisyphus_mirror.mirror import BranchMirror
+from sisyphus_mirror.retention import RetentionPolicy, select_pressure_victim
+from sisyphus_mirror.usage import UsageStats
+
+NOW = datetime(2025, 3, 10, 12)  # noqa: DTZ001
+SNAPSHOTS = [
+    Path(f".snapshots/p11-{timestamp}000000")
+    for timestamp in (
+        "20250101010000",
+        "20250201010000",
+        "20250301010000",
+        "20250308010000",
+        "20250309010000",
+        "20250310010000",
+        "20250310110000",
+    )
+]
+
+
+def test_retention_keep_last() -> None:
+    policy = RetentionPolicy(keep_last=2)
+    assert policy.select_expired(SNAPSHOTS, NOW) == SNAPSHOTS[:-2]
+
+
+def test_retention_keep_daily_weekly_monthly() -> None:
+    policy = RetentionPolicy(keep_last=1, keep_daily=2)
+    assert policy.select_expired(SNAPSHOTS, NOW) == [*SNAPSHOTS[:4], SNAPSHOTS[5]]
+
+    policy = RetentionPolicy(keep_last=1, keep_weekly=3)
+    expected = [*SNAPSHOTS[:2], SNAPSHOTS[3], SNAPSHOTS[5]]
+    assert policy.select_expired(SNAPSHOTS, NOW) == expected
+
+    policy = RetentionPolicy(keep_last=1, keep_monthly=3)
+    assert policy.select_expired(SNAPSHOTS, NOW) == [*SNAPSHOTS[2:6]]
+
+
+def test_retention_max_age() -> None:
+    policy = RetentionPolicy(keep_last=5, max_age_days=3)
+    assert policy.select_expired(SNAPSHOTS, NOW) == SNAPSHOTS[:3]
+
+    # the published snapshot is never expired
+    policy = RetentionPolicy(keep_last=5, max_age_days=1)
+    assert policy.select_expired(SNAPSHOTS[:3], NOW) == SNAPSHOTS[:2]
+
+
+def test_retention_min_free_space() -> None:
+    assert RetentionPolicy(min_free_space="1G").min_free_bytes == 1024**3
+    assert not RetentionPolicy().is_under_pressure(Path("/"))
+    assert RetentionPolicy(min_free_space="1000000T").is_under_pressure(Path("/"))
+
+
+def test_select_pressure_victim() -> None:
+    snapshot_usage = {
+        "p11-20250101010000000000": UsageStats(exclusive_bytes=10),
+        "p11-20250201010000000000": UsageStats(exclusive_bytes=30),
+        "p10-20250301010000000000": UsageStats(exclusive_bytes=30),
+    }
+    candidates = list(snapshot_usage)
+    assert select_pressure_victim(snapshot_usage, candidates) == candidates[1]
+    assert select_pressure_victim(snapshot_usage, candidates[:1]) == candidates[0]
+
+
+def test_select_pressure_victim_tie_oldest() -> None:
+    # equal exclusive sizes: the oldest snapshot, whatever its branch
+    snapshot_usage = {
+        "p10-20250301010000000000": UsageStats(exclusive_bytes=30),
+        "p11-20250201010000000000": UsageStats(exclusive_bytes=30),
+    }
+    candidates = list(snapshot_usage)
+    assert select_pressure_victim(snapshot_usage, candidates) == candidates[1]
+
+
+def test_branch_mirror_free_space(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    snapshots_dir = tmp_path / ".snapshots"
+    small = snapshots_dir / "p11-20250101000000000000"
+    large = snapshots_dir / "p11-20250102000000000000"
+    published = snapshots_dir / "p11-20250103000000000000"
+    for snapshot in (small, large, published):
+        snapshot.mkdir(parents=True)
+    (large / "package.rpm").write_bytes(b"x" * 65536)
+
+    instance = BranchMirror(
+        branch="p11", branch_list=["p11"], working_dir=tmp_path,
+        retention={"min_free_space": "1G"})
+    pressure = iter([True, True, False, False])
+    monkeypatch.setattr(
+        RetentionPolicy, "is_under_pressure", lambda *_: next(pressure))
+    instance.free_space()
+
+    assert small.exists()
+    assert not large.exists()
+    assert published.exists()
+
+
+def test_branch_mirror_free_space_split_arch(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    snapshots_dir = tmp_path / ".snapshots"
+    parts = {
+        name: snapshots_dir / f"p11.{name}" / "branch"
+        for name in ("common-20250101000000000000", "noarch-20250101000000000000",
+                     "noarch-20250102000000000000")
+    }
+    for part_dir in parts.values():
+        part_dir.mkdir(parents=True)
+    (parts["noarch-20250101000000000000"] / "package.rpm").write_bytes(b"x" * 65536)
+    views = {}
+    for view_name, noarch in (
+        ("p11-20250101000000000000", "noarch-20250101000000000000"),
+        ("p11-20250102000000000000", "noarch-20250102000000000000"),
+    ):
+        view_dir = snapshots_dir / view_name / "branch"
+        view_dir.mkdir(parents=True)
+        for part in ("common-20250101000000000000", noarch):
+            (view_dir / part.split("-")[0]).symlink_to(
+                Path("..", "..", f"p11.{part}", "branch"))
+        views[view_name] = view_dir.parent
+
+    instance = BranchMirror(
+        branch="p11", branch_list=["p11"], working_dir=tmp_path,
+        retention={"min_free_space": "1G"}, split_arch={"enabled": True})
+    pressure = iter([True, True, False, False])
+    monkeypatch.setattr(
+        RetentionPolicy, "is_under_pressure", lambda *_: next(pressure))
+    instance.free_space()
+
+    # the old part holds the data, its view goes with it
+    assert not parts["noarch-20250101000000000000"].exists()
+    assert not views["p11-20250101000000000000"].exists()
+    assert views["p11-20250102000000000000"].exists()
+    assert parts["noarch-20250102000000000000"].exists()
+    assert parts["common-20250101000000000000"].exists()
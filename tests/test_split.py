@@ -0,0 +1,61 @@
+from pathlib import Path
+
+from sisyphus_mirror.split import PartStore, split_part_list, view_parts
+
+
+def make_part(working_dir: Path, name: str, entry: str) -> Path:
+    snapshot = working_dir / ".snapshots" / name
+    (snapshot / "branch" / entry).mkdir(parents=True)
+    return snapshot
+
+
+def test_part_store_option() -> None:
+    store = PartStore(Path(), "p11", {
+        "min_interval": 30,
+        "parts": [{"name": "noarch", "min_interval": 60}, {"name": "x86_64"}],
+    })
+    assert store.option("noarch", "min_interval", 0) == 60  # noqa: PLR2004
+    assert store.option("x86_64", "min_interval", 0) == 30  # noqa: PLR2004
+    assert store.option("x86_64", "keep_last", 1) == 1
+    assert split_part_list(["noarch", "x86_64", "noarch"]) == [
+        "common", "noarch", "x86_64"]
+
+
+def test_part_store_fingerprint(tmp_path: Path) -> None:
+    store = PartStore(tmp_path, "p11", {"enabled": True})
+    snapshot = make_part(tmp_path, "p11.noarch-20250101010000000000", "noarch")
+    (tmp_path / ".filters").mkdir()
+    assert store.load_fingerprint("noarch", snapshot) is None
+
+    store.save_fingerprint("noarch", snapshot, "a")
+    assert store.load_fingerprint("noarch", snapshot) == "a"
+    assert store.is_unchanged("noarch", "a")
+    assert not store.is_unchanged("noarch", "b")
+    assert not store.is_unchanged("noarch", None)
+
+    # foreign or damaged files are treated as a missing fingerprint
+    for content in ("[]", '"a"', '{"snapshot": "NAME", "fingerprint": 1}', "{"):
+        store.fingerprint_path("noarch").write_text(
+            content.replace("NAME", snapshot.name))
+        assert store.load_fingerprint("noarch", snapshot) is None
+
+
+def test_part_store_compose_view(tmp_path: Path) -> None:
+    store = PartStore(tmp_path, "p11", {"enabled": True})
+    common = make_part(tmp_path, "p11.common-20250101010000000000", "list")
+    noarch = make_part(tmp_path, "p11.noarch-20250101010000000000", "noarch")
+    view = tmp_path / ".snapshots" / "p11-20250101010000000000"
+
+    assert store.compose_view(view, ["common", "noarch"], None)
+    assert (view / "branch" / "noarch").resolve() == (noarch / "branch" / "noarch")
+    assert view_parts(view) == {common.name, noarch.name}
+    assert not store.compose_view(view, ["common", "noarch"], view)
+
+    # expired parts are kept while a view references them
+    newer = make_part(tmp_path, "p11.noarch-20250201010000000000", "noarch")
+    store.delete_old_parts([view])
+    assert noarch.exists()
+    store.delete_old_parts([])
+    assert not noarch.exists()
+    assert newer.exists()
+    assert common.exists()
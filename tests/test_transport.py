@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import re
+import struct
+import threading
+from collections.abc import Iterator
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from sisyphus_mirror.mirror import mirror_branch
+from sisyphus_mirror.packages import (
+    CRPMTAG_DIRECTORY,
+    CRPMTAG_FILENAME,
+    CRPMTAG_FILESIZE,
+    CRPMTAG_MD5,
+    HEADER_MAGIC,
+    RPM_INT32_TYPE,
+    RPM_STRING_TYPE,
+    RPMTAG_NAME,
+)
+from sisyphus_mirror.transport import HttpTransport, RemoteFile
+
+RANGE_RE = re.compile(r"^bytes=(\d+)-$")
+BRANCH_DIR = "p11/branch"
+
+
+def make_header(name: str, content: bytes) -> bytes:
+    entries: list[tuple[int, int, bytes]] = [
+        (RPMTAG_NAME, RPM_STRING_TYPE, f"{name}\0".encode()),
+        (CRPMTAG_FILENAME, RPM_STRING_TYPE, f"{name}-1.0-alt1.rpm\0".encode()),
+        (CRPMTAG_DIRECTORY, RPM_STRING_TYPE, b"RPMS.classic\0"),
+        (CRPMTAG_MD5, RPM_STRING_TYPE,
+            f"{hashlib.md5(content).hexdigest()}\0".encode()),  # noqa: S324
+        (CRPMTAG_FILESIZE, RPM_INT32_TYPE, struct.pack(">I", len(content))),
+    ]
+    index = b""
+    store = b""
+    for tag, type_, data in entries:
+        if type_ == RPM_INT32_TYPE:
+            store += b"\0" * (-len(store) % 4)
+        index += struct.pack(">IIII", tag, type_, len(store), 1)
+        store += data
+    return HEADER_MAGIC + struct.pack(">II", len(entries), len(store)) + index + store
+
+
+def write_branch(root: Path, packages: dict[str, bytes]) -> None:
+    arch_dir = root / BRANCH_DIR / "x86_64"
+    (arch_dir / "base").mkdir(parents=True, exist_ok=True)
+    (arch_dir / "RPMS.classic").mkdir(exist_ok=True)
+    for name, content in packages.items():
+        (arch_dir / "RPMS.classic" / f"{name}-1.0-alt1.rpm").write_bytes(content)
+    pkglist = b"".join(
+        make_header(name, content) for name, content in packages.items())
+    (arch_dir / "base" / "pkglist.classic").write_bytes(pkglist)
+    (arch_dir / "base" / "release").write_text(
+        "Origin: ALT Linux Team\n"
+        "MD5Sum:\n"
+        f" {hashlib.md5(pkglist).hexdigest()} {len(pkglist)} "  # noqa: S324
+        "base/pkglist.classic\n"
+        "SHA256:\n"
+        f" {hashlib.sha256(pkglist).hexdigest()} {len(pkglist)} "
+        "base/pkglist.classic\n",
+    )
+    (root / BRANCH_DIR / ".timestamp").write_text("1")
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    requests: list[tuple[str, str | None, int]] = []  # noqa: RUF012
+
+    def do_GET(self) -> None:
+        self.requests.append(
+            (self.path, self.headers.get("Range"), self.client_address[1]))
+        range_match = RANGE_RE.match(self.headers.get("Range") or "")
+        path = Path(self.translate_path(self.path))
+        if not range_match or not path.is_file():
+            super().do_GET()
+            return
+        content = path.read_bytes()[int(range_match[1]):]
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def upstream(tmp_path: Path) -> Iterator[tuple[str, Path]]:
+    root = tmp_path / "upstream"
+    write_branch(root, {"bash": b"b" * 1000, "coreutils": b"c" * 2000})
+    RangeHandler.requests = []
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(RangeHandler, directory=str(root)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", root
+    server.shutdown()
+    server.server_close()
+
+
+def make_transport(url: str, tmp_path: Path, **kwargs: Any) -> HttpTransport:
+    return HttpTransport(
+        base_url=f"{url}/{BRANCH_DIR}",
+        dest_dir=tmp_path / "dest",
+        partial_dir=tmp_path / "partial",
+        **kwargs,
+    )
+
+
+def test_http_transport_sync(tmp_path: Path, upstream: tuple[str, Path]) -> None:
+    url, _ = upstream
+    files = [
+        RemoteFile(f"x86_64/RPMS.classic/{name}-{index}.rpm")
+        for name in ("bash", "coreutils") for index in range(3)
+    ]
+    for remote in files:
+        path = upstream[1] / BRANCH_DIR / remote.path
+        path.write_bytes(remote.path.encode())
+
+    transport = make_transport(url, tmp_path, workers=2)
+    transport.sync(files)
+    transport.close()
+
+    for remote in files:
+        assert (tmp_path / "dest" / remote.path).read_text() == remote.path
+    assert transport.stats.files == transport.stats.files_transferred == len(files)
+    assert len({port for _, _, port in RangeHandler.requests}) <= 2  # noqa: PLR2004 keep-alive
+
+
+def test_http_transport_links_unchanged(
+    tmp_path: Path,
+    upstream: tuple[str, Path],
+) -> None:
+    url, root = upstream
+    transport = make_transport(url, tmp_path)
+    transport.sync([transport.release_file("x86_64")], metadata=True)
+    [pkglist] = transport.release_files("x86_64")
+    assert pkglist.hash_name == "sha256"  # the strongest checksum
+    transport.sync([pkglist], metadata=True)
+
+    previous = tmp_path / "previous"
+    (previous / "x86_64" / "RPMS.classic").mkdir(parents=True)
+    old_bash = previous / "x86_64" / "RPMS.classic" / "bash-1.0-alt1.rpm"
+    old_bash.write_bytes(b"b" * 1000)
+    transport = make_transport(url, tmp_path, link_dest_dirs=[previous])
+    RangeHandler.requests = []
+    transport.sync([
+        RemoteFile("x86_64/RPMS.classic/bash-1.0-alt1.rpm", 1000, immutable=True),
+        RemoteFile(
+            "x86_64/RPMS.classic/coreutils-1.0-alt1.rpm", 2000, "md5",
+            hashlib.md5(b"c" * 2000).hexdigest(), immutable=True),  # noqa: S324
+    ])
+
+    new_bash = tmp_path / "dest" / "x86_64" / "RPMS.classic" / "bash-1.0-alt1.rpm"
+    assert new_bash.stat().st_ino == old_bash.stat().st_ino
+    assert [path for path, _, _ in RangeHandler.requests] == [
+        f"/{BRANCH_DIR}/x86_64/RPMS.classic/coreutils-1.0-alt1.rpm"]
+    assert transport.stats.files_transferred == 1
+    assert (root / BRANCH_DIR / "x86_64" / "base" / "pkglist.classic").read_bytes() == (
+        tmp_path / "dest" / "x86_64" / "base" / "pkglist.classic").read_bytes()
+
+
+def test_http_transport_resume(tmp_path: Path, upstream: tuple[str, Path]) -> None:
+    url, _ = upstream
+    path = "x86_64/RPMS.classic/coreutils-1.0-alt1.rpm"
+    (tmp_path / "partial" / path).parent.mkdir(parents=True)
+    (tmp_path / "partial" / path).write_bytes(b"c" * 500)
+    content = b"c" * 2000
+
+    transport = make_transport(url, tmp_path)
+    transport.sync([RemoteFile(
+        path, len(content), "md5", hashlib.md5(content).hexdigest(),  # noqa: S324
+    )])
+
+    assert RangeHandler.requests[0][1] == "bytes=500-"
+    assert (tmp_path / "dest" / path).read_bytes() == content
+    assert transport.stats.bytes_received == 1500  # noqa: PLR2004
+    assert not (tmp_path / "partial" / path).exists()
+
+
+def test_http_transport_checksum_mismatch(
+    tmp_path: Path,
+    upstream: tuple[str, Path],
+) -> None:
+    url, _ = upstream
+    path = "x86_64/RPMS.classic/bash-1.0-alt1.rpm"
+    transport = make_transport(url, tmp_path)
+
+    with pytest.raises(RuntimeError, match="Download of"):
+        transport.sync([RemoteFile(path, 1000, "md5", "0" * 32)])
+    assert transport.retries == 2  # noqa: PLR2004
+    assert not (tmp_path / "dest" / path).exists()
+
+    with pytest.raises(FileNotFoundError):
+        make_transport(url, tmp_path).sync([RemoteFile("missing.rpm")])
+    make_transport(url, tmp_path).sync([RemoteFile("missing.rpm")], optional=True)
+
+
+def test_mirror_branch_http(tmp_path: Path, upstream: tuple[str, Path]) -> None:
+    url, root = upstream
+    working_dir = tmp_path / "mirror"
+    working_dir.mkdir()
+    options: dict[str, Any] = {
+        "working_dir": working_dir,
+        "source_url": url,
+        "arch_list": ["x86_64"],
+        "rate_limit": 0,
+    }
+
+    (root / BRANCH_DIR / "list" / "sub").mkdir(parents=True)
+    (root / BRANCH_DIR / "list" / "list.txt").write_text("list")
+    (root / BRANCH_DIR / "list" / "sub" / "more.txt").write_text("more")
+    first = asyncio.run(mirror_branch("p11", **options))
+    write_branch(root, {"bash": b"b" * 1000, "grep": b"g" * 300})
+    RangeHandler.requests = []
+    second = asyncio.run(mirror_branch("p11", **options))
+
+    assert first is not None
+    assert second is not None
+    rpms_dir = second / "branch" / "x86_64" / "RPMS.classic"
+    # the file set comes from the package lists, not from the upstream tree
+    assert sorted(path.name for path in rpms_dir.iterdir()) == [
+        "bash-1.0-alt1.rpm", "grep-1.0-alt1.rpm"]
+    assert (second / "branch" / ".timestamp").exists()
+    # glob includes are expanded from the upstream directory listing
+    assert (second / "branch" / "list" / "sub" / "more.txt").read_text() == "more"
+    assert (second / "branch" / "list" / "list.txt").exists()
+    # bash is hard-linked from the first snapshot
+    downloaded = {path.rsplit("/", 1)[-1] for path, _, _ in RangeHandler.requests}
+    assert downloaded == {
+        "release", "pkglist.classic", "grep-1.0-alt1.rpm", ".timestamp",
+        "", "list.txt", "more.txt"}  # "" - directory listings
+    assert (working_dir / "p11").resolve() == second
+
+
+def test_http_transport_include_files(
+    tmp_path: Path, upstream: tuple[str, Path],
+) -> None:
+    url, root = upstream
+    (root / BRANCH_DIR / "list").mkdir()
+    (root / BRANCH_DIR / "list" / "a b.txt").write_text("a")
+    transport = make_transport(url, tmp_path)
+
+    files, skipped = transport.include_files(
+        ["list/**", ".timestamp", "missing/**", "*.txt"])
+    assert [remote.path for remote in files] == ["list/a b.txt", ".timestamp"]
+    assert skipped == ["missing/**", "*.txt"]
+
+    # files of skipped patterns are kept, other unknown files are pruned
+    for name in ("missing/x", "stale.rpm"):
+        (tmp_path / "dest" / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / "dest" / name).touch()
+    pruned = transport.prune(set(), lambda path: path.startswith("missing/"))
+    assert pruned == ["stale.rpm"]
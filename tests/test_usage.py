@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import pytest
+
+from sisyphus_mirror import usage
+from sisyphus_mirror.usage import UsageAccounting, format_usage_report
+
+
+@pytest.fixture
+def working_dir(tmp_path: Path) -> Path:
+    snapshots_dir = tmp_path / ".snapshots"
+    old = snapshots_dir / "p11-20250101000000000000"
+    new = snapshots_dir / "p11-20250102000000000000"
+    other = snapshots_dir / "p10-20250102000000000000"
+    for snapshot in (old, new, other):
+        snapshot.mkdir(parents=True)
+    (old / "shared.rpm").write_bytes(b"x" * 8192)
+    (new / "shared.rpm").hardlink_to(old / "shared.rpm")
+    (old / "removed.rpm").write_bytes(b"x" * 8192)
+    (new / "branch-shared.rpm").write_bytes(b"x" * 8192)
+    (other / "branch-shared.rpm").hardlink_to(new / "branch-shared.rpm")
+    return tmp_path
+
+
+def test_usage_accounting_compute(working_dir: Path) -> None:
+    accounting = UsageAccounting(working_dir=working_dir)
+    accounting.update()
+    snapshot_usage, branch_usage = accounting.compute()
+
+    old = snapshot_usage["p11-20250101000000000000"]
+    new = snapshot_usage["p11-20250102000000000000"]
+    # snapshot root directory and removed.rpm
+    assert old.exclusive_inodes == 2  # noqa: PLR2004
+    assert old.shared_inodes == 1
+    assert new.exclusive_inodes == 1
+    assert new.shared_inodes == 2  # noqa: PLR2004
+    assert old.exclusive_bytes > new.exclusive_bytes
+
+    # shared.rpm is exclusive to p11, branch-shared.rpm is shared with p10
+    assert branch_usage["p11"].exclusive_inodes == 4  # noqa: PLR2004
+    assert branch_usage["p11"].shared_inodes == 1
+    assert branch_usage["p10"].exclusive_inodes == 1
+    assert branch_usage["p10"].shared_inodes == 1
+
+    report = format_usage_report(snapshot_usage, branch_usage)
+    assert "p11 (branch)" in report
+
+
+def test_usage_accounting_incremental(
+    working_dir: Path, monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    UsageAccounting(working_dir=working_dir).update()
+
+    newest = working_dir / ".snapshots" / "p11-20250103000000000000"
+    newest.mkdir()
+    scanned: list[str] = []
+    scan_snapshot = usage.scan_snapshot
+
+    def tracking_scan(snapshot: Path) -> dict[int, int]:
+        scanned.append(snapshot.name)
+        return scan_snapshot(snapshot)
+
+    monkeypatch.setattr(usage, "scan_snapshot", tracking_scan)
+    accounting = UsageAccounting(working_dir=working_dir)
+    accounting.update()
+    assert scanned == [newest.name]
+    assert len(accounting.snapshot_inodes) == 4  # noqa: PLR2004
@@ -0,0 +1,35 @@
+from pathlib import Path
+
+from sisyphus_mirror.consts import DEFAULT_WARM_PATHS
+from sisyphus_mirror.warmup import cool_down, find_hot_files, warm_up
+
+
+def make_snapshot(snapshot: Path) -> None:
+    for path in (
+        "branch/x86_64/base/pkglist.classic.xz",
+        "branch/x86_64/base/release",
+        "branch/list/sub/list.txt",
+        "branch/x86_64/RPMS.classic/bash.rpm",
+    ):
+        (snapshot / path).parent.mkdir(parents=True, exist_ok=True)
+        (snapshot / path).write_bytes(b"x" * 100)
+
+
+def test_warm_up(tmp_path: Path) -> None:
+    make_snapshot(tmp_path)
+    hot_files = find_hot_files(tmp_path, DEFAULT_WARM_PATHS)
+    assert [path.name for path in hot_files] == [
+        "list.txt", "pkglist.classic.xz", "release"]
+    assert warm_up(tmp_path, DEFAULT_WARM_PATHS, workers=2) == (3, 300)
+
+
+def test_cool_down(tmp_path: Path) -> None:
+    old_snapshot = tmp_path / "old"
+    new_snapshot = tmp_path / "new"
+    make_snapshot(old_snapshot)
+    make_snapshot(new_snapshot)
+    shared = "branch/list/sub/list.txt"
+    (new_snapshot / shared).unlink()
+    (new_snapshot / shared).hardlink_to(old_snapshot / shared)
+
+    assert cool_down(old_snapshot, new_snapshot, DEFAULT_WARM_PATHS) == (2, 200)